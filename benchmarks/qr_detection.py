@@ -0,0 +1,91 @@
+"""Сравнение распознавания QR-кодов на синтетических фото стеллажей.
+
+Генерирует фото с множеством мелких QR-кодов и сравнивает прежнюю функцию
+(полноразмерное цветное изображение целиком в pyzbar) с текущей
+QRCodeService.decode_qr_codes по полноте распознавания и времени на фото.
+
+Запуск из корня репозитория:
+    python -m benchmarks.qr_detection --photos 10 --codes 40
+"""
+import argparse
+import random
+import time
+from typing import Callable, List, Set, Tuple
+
+import cv2
+import numpy as np
+from pyzbar import pyzbar
+
+from services.qr_service import QRCodeService
+
+
+def legacy_decode_qr_codes(image_data: bytes) -> List[str]:
+    """Прежняя реализация decode_qr_codes"""
+    nparr = np.frombuffer(image_data, np.uint8)
+    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    return [qr.data.decode('utf-8') for qr in pyzbar.decode(image)]
+
+
+def make_qr(payload: str, size: int) -> np.ndarray:
+    code = cv2.QRCodeEncoder.create().encode(payload)
+    # Тихая зона в 4 модуля, как на напечатанной этикетке
+    code = cv2.copyMakeBorder(code, 4, 4, 4, 4, cv2.BORDER_CONSTANT, value=255)
+    return cv2.resize(code, (size, size), interpolation=cv2.INTER_NEAREST)
+
+
+def make_shelf_photo(rng: random.Random, index: int, codes: int, width: int, height: int,
+                     min_size: int, max_size: int) -> Tuple[bytes, Set[str]]:
+    """Фото стеллажа: серый фон, шум, мелкие QR-коды без пересечений, JPEG как у Telegram"""
+    canvas = np.full((height, width), 170, dtype=np.uint8)
+    canvas = cv2.add(canvas, np.random.default_rng(index).integers(0, 40, (height, width), dtype=np.uint8))
+    payloads, placed = set(), []
+    attempts = 0
+    while len(payloads) < codes and attempts < codes * 50:
+        attempts += 1
+        size = rng.randint(min_size, max_size)
+        left, top = rng.randint(0, width - size), rng.randint(0, height - size)
+        if any(left < x + s and x < left + size and top < y + s and y < top + size for x, y, s in placed):
+            continue
+        payload = f"QR-{index:02d}-{len(payloads) + 1:03d}"
+        canvas[top:top + size, left:left + size] = make_qr(payload, size)
+        placed.append((left, top, size))
+        payloads.add(payload)
+    canvas = cv2.GaussianBlur(canvas, (3, 3), 0)
+    return cv2.imencode(".jpg", canvas, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes(), payloads
+
+
+def run(name: str, decode: Callable[[bytes], List[str]], photos: List[Tuple[bytes, Set[str]]]):
+    expected = found = 0
+    started = time.perf_counter()
+    for image_data, payloads in photos:
+        expected += len(payloads)
+        found += len(payloads & set(decode(image_data)))
+    elapsed = time.perf_counter() - started
+    print(f"{name:<10} полнота: {found}/{expected} ({found / expected:.1%}), "
+          f"{elapsed / len(photos) * 1000:.0f} мс/фото")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photos", type=int, default=10)
+    parser.add_argument("--codes", type=int, default=40, help="кодов на фото")
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--min-size", type=int, default=90, help="минимальный размер кода в пикселях")
+    parser.add_argument("--max-size", type=int, default=160, help="максимальный размер кода в пикселях")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    photos = [
+        make_shelf_photo(rng, index, args.codes, args.width, args.height, args.min_size, args.max_size)
+        for index in range(args.photos)
+    ]
+    print(f"{args.photos} фото {args.width}x{args.height}, по {args.codes} кодов "
+          f"размером {args.min_size}-{args.max_size} px")
+    run("прежняя", legacy_decode_qr_codes, photos)
+    run("плитки", QRCodeService.decode_qr_codes, photos)
+
+
+if __name__ == "__main__":
+    main()
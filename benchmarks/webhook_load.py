@@ -0,0 +1,177 @@
+"""Нагрузочный тест webhook-режима без Telegram.
+
+Поднимает заглушку Bot API, которая принимает и считает ответы бота, и отправляет
+на webhook синтетические апдейты — сообщения от множества чатов. Меряет, сколько
+апдейтов в секунду сервер принимает и сколько успевает обработать (апдейт считается
+обработанным, когда бот ответил в его чат) и задержку обработки.
+
+Бот запускается отдельно, с заглушкой вместо api.telegram.org и тестовой БД
+(команда /start регистрирует в ней пользователей load_<чат>):
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_MODE=webhook WEBHOOK_WORKERS=4 python main.py
+
+Запуск из корня репозитория:
+    python -m benchmarks.webhook_load --chats 200 --updates 5000 --concurrency 64
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import aiohttp
+from aiohttp import web
+
+from bot.webhook import SECRET_HEADER
+
+
+class FakeBotApi:
+    """Заглушка Bot API: на любой метод отвечает успехом, запоминает время ответов по чатам"""
+
+    def __init__(self):
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.replies: Dict[int, List[float]] = defaultdict(list)
+        self.message_ids = itertools.count(1)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(await request.post())
+        chat_id = params.get("chat_id", "")
+        if chat_id.lstrip("-").isdigit():
+            self.replies[int(chat_id)].append(time.perf_counter())
+        if method in ("sendMessage", "sendDocument", "sendPhoto"):
+            result = {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id) if chat_id.lstrip("-").isdigit() else 0, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, host: str, port: int) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> dict:
+    user = {"id": chat_id, "is_bot": False, "first_name": f"Load {chat_id}", "username": f"load_{chat_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": user,
+            "text": text,
+        },
+    }
+
+
+async def wait_for_webhook(session: aiohttp.ClientSession, url: str, timeout: float) -> None:
+    """Ждет, пока бот поднимет webhook-сервер (на GET он отвечает 405)"""
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            async with session.get(url):
+                return
+        except aiohttp.ClientConnectionError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+def percentile(values: List[float], share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+async def run(args) -> None:
+    api = FakeBotApi()
+    api_runner = await api.start(args.api_host, args.api_port)
+    chats = [args.first_chat + n for n in range(args.chats)]
+    sent: Dict[int, List[float]] = defaultdict(list)
+    rejected = 0
+    update_ids = itertools.count(1)
+    headers = {SECRET_HEADER: args.secret} if args.secret else {}
+
+    async def post(session: aiohttp.ClientSession, chat_id: int) -> None:
+        nonlocal rejected
+        update = make_update(next(update_ids), chat_id, args.text)
+        while True:
+            started = time.perf_counter()
+            async with session.post(args.url, data=json.dumps(update), headers=headers) as response:
+                if response.status == 200:
+                    sent[chat_id].append(started)
+                    return
+                if response.status != 503:
+                    raise RuntimeError(f"Webhook ответил {response.status}")
+            # Очередь сервера заполнена: повторяем, как Telegram
+            rejected += 1
+            await asyncio.sleep(0.05)
+
+    # Апдейты одного чата отправляются по очереди, как их доставляет Telegram
+    async def chat_sender(session: aiohttp.ClientSession, chat_id: int, count: int, limit: asyncio.Semaphore):
+        for _ in range(count):
+            async with limit:
+                await post(session, chat_id)
+
+    per_chat = [args.updates // args.chats + (1 if n < args.updates % args.chats else 0) for n in range(args.chats)]
+    limit = asyncio.Semaphore(args.concurrency)
+    async with aiohttp.ClientSession(headers={"Content-Type": "application/json"}) as session:
+        await wait_for_webhook(session, args.url, args.timeout)
+        started = time.perf_counter()
+        await asyncio.gather(*[chat_sender(session, chat_id, count, limit) for chat_id, count in zip(chats, per_chat)])
+    posted = time.perf_counter()
+
+    # Ждем ответов бота на все апдейты, но не дольше --timeout
+    deadline = time.perf_counter() + args.timeout
+    while time.perf_counter() < deadline:
+        if all(len(api.replies[chat_id]) >= len(sent[chat_id]) for chat_id in chats):
+            break
+        await asyncio.sleep(0.05)
+    finished = max((times[-1] for times in api.replies.values() if times), default=posted)
+    await api_runner.cleanup()
+
+    # Апдейт чата n обработан n-м ответом в этот чат: один апдейт — один ответ
+    latencies, answered = [], 0
+    for chat_id in chats:
+        for sent_at, replied_at in zip(sent[chat_id], api.replies[chat_id]):
+            latencies.append(replied_at - sent_at)
+            answered += 1
+
+    total = sum(len(times) for times in sent.values())
+    print(f"Отправлено {total} апдейтов от {args.chats} чатов за {posted - started:.2f} с "
+          f"({total / (posted - started):.0f}/с), отказов 503: {rejected}")
+    print(f"Обработано {answered} из {total} за {finished - started:.2f} с ({answered / (finished - started):.0f}/с)")
+    if latencies:
+        print(f"Задержка: медиана {statistics.median(latencies) * 1000:.0f} мс, "
+              f"p95 {percentile(latencies, 0.95) * 1000:.0f} мс, макс {max(latencies) * 1000:.0f} мс")
+    print(f"Вызовы Bot API: {dict(api.calls)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook", help="адрес webhook бота")
+    parser.add_argument("--secret", default="", help="WEBHOOK_SECRET бота")
+    parser.add_argument("--api-host", default="127.0.0.1")
+    parser.add_argument("--api-port", type=int, default=8081, help="порт заглушки Bot API (TELEGRAM_API_URL бота)")
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременных запросов к webhook")
+    parser.add_argument("--text", default="/start", help="текст сообщений; должен вызывать ровно один ответ бота")
+    parser.add_argument("--first-chat", type=int, default=900000000, help="id первого синтетического чата")
+    parser.add_argument("--timeout", type=float, default=60, help="сколько ждать запуска бота и ответов после отправки, секунд")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,26 @@
 # Bot package 
+from typing import AsyncGenerator, BinaryIO, Iterable, Optional, Tuple
 from aiogram import Router
-from aiogram.types import CallbackQuery, InlineKeyboardMarkup
+from aiogram.types import CallbackQuery, InputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 router = Router()
 
+# Максимальная длина текста сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+class BufferInputFile(InputFile):
+    """Загружаемый файл, который читается частями из открытого буфера (BytesIO, SpooledTemporaryFile)"""
+
+    def __init__(self, buffer: BinaryIO, filename: str, chunk_size: int = 64 * 1024):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.buffer = buffer
+
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        self.buffer.seek(0)
+        while chunk := self.buffer.read(self.chunk_size):
+            yield chunk
+
 async def handle_empty_data(
     callback: CallbackQuery, 
     message_text: str, 
@@ -45,4 +61,61 @@ async def handle_empty_data(
             await callback.message.answer(message_text, reply_markup=builder.as_markup())
     else:
         # Если нет сообщения для редактирования, отправляем новое
-        await callback.answer(message_text, reply_markup=builder.as_markup()) 
\ No newline at end of file
+        await callback.answer(message_text, reply_markup=builder.as_markup())
+
+
+def message_length(text: str) -> int:
+    """Длина текста так, как ее считает Telegram (в единицах UTF-16: эмодзи — две)"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def fit_lines(header: str, lines: Iterable[str], limit: int = MESSAGE_LIMIT) -> Tuple[str, int]:
+    """Собирает заголовок и строки в текст не длиннее limit. Возвращает текст и число вошедших строк"""
+    text = header
+    length = message_length(header)
+    count = 0
+    for line in lines:
+        line_length = message_length(line)
+        if length + line_length > limit:
+            break
+        text += line
+        length += line_length
+        count += 1
+    return text, count
+
+
+def parse_page_callback(data: str, prefix: str) -> Tuple[Optional[int], Optional[int]]:
+    """Разбирает callback_data страницы: "{prefix}", "{prefix}_next_{id}", "{prefix}_prev_{id}" -> (after, before)"""
+    rest = data.removeprefix(prefix)
+    if rest.startswith("_next_"):
+        return int(rest.removeprefix("_next_")), None
+    if rest.startswith("_prev_"):
+        return None, int(rest.removeprefix("_prev_"))
+    return None, None
+
+
+def add_page_buttons(
+    builder: InlineKeyboardBuilder,
+    prefix: str,
+    prev_cursor: Optional[int],
+    next_cursor: Optional[int]
+) -> int:
+    """Добавляет кнопки перехода между страницами. Возвращает количество добавленных кнопок"""
+    buttons = 0
+    if prev_cursor is not None:
+        builder.button(text="◀️", callback_data=f"{prefix}_prev_{prev_cursor}")
+        buttons += 1
+    if next_cursor is not None:
+        builder.button(text="▶️", callback_data=f"{prefix}_next_{next_cursor}")
+        buttons += 1
+    return buttons
+
+
+def parse_action_callback(data: str, prefix: str) -> Tuple[int, Optional[int]]:
+    """Разбирает callback_data действия над элементом списка: "{prefix}{id}" или "{prefix}{id}_{after}".
+
+    after — курсор страницы, на которой была кнопка (0 — первая страница), чтобы после
+    действия перерисовать ту же страницу.
+    """
+    item_id, _, after = data.removeprefix(prefix).partition("_")
+    return int(item_id), (int(after) or None) if after else None
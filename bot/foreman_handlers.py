@@ -1,60 +1,34 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, InputMediaPhoto, FSInputFile
+from aiogram.types import Message, CallbackQuery, InputMediaPhoto
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from services.user_service import UserService
-from services.tool_request_service import ToolRequestService
+from services.user_cache import UserSnapshot
+from services.tool_request_service import ToolRequestService, ResolvedRequest
 from services.inventory_check_service import InventoryCheckService
-from database.connection import SessionLocal
-from database.models import User, Object, Tool, ToolRequest, InventoryCheck
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import User
 from aiogram import Bot
 from datetime import datetime
 import xml.etree.ElementTree as ET
-from services.qr_service import QRCodeService
+from services.qr_service import QRCodeService, InventoryTimings
+from services.inventory_session_service import InventorySessionService, InventorySession
+from services.decode_cache import get_decode_cache
 from services.inventory_report_service import InventoryReportService
-from bot import handle_empty_data
-from bot.worker_handlers import get_worker_menu
-
-async def send_notification_safely(bot: Bot, user: any, message: str) -> bool:
-    """
-    Безопасно отправляет уведомление пользователю.
-    
-    Args:
-        bot: Экземпляр бота
-        user: Объект пользователя из базы данных
-        message: Текст сообщения
-        
-    Returns:
-        bool: True если сообщение отправлено успешно, False в противном случае
-    """
-    try:
-        # Сначала пытаемся отправить по chat_id
-        if hasattr(user, 'chat_id') and user.chat_id:
-            await bot.send_message(user.chat_id, message)
-            return True
-        
-        # Если нет chat_id, пытаемся по username
-        if hasattr(user, 'username') and user.username:
-            username = str(user.username)
-            # Убираем @ если есть
-            if username.startswith('@'):
-                username = username[1:]
-            
-            # Пытаемся отправить сообщение
-            await bot.send_message(username, message)
-            return True
-            
-        return False
-    except Exception as e:
-        error_message = str(e).lower()
-        if "chat not found" in error_message or "user not found" in error_message:
-            print(f"Пользователь {getattr(user, 'username', 'Unknown')} не найден или не начал диалог с ботом")
-        elif "blocked" in error_message:
-            print(f"Пользователь {getattr(user, 'username', 'Unknown')} заблокировал бота")
-        else:
-            print(f"Ошибка отправки уведомления пользователю {getattr(user, 'username', 'Unknown')}: {e}")
-        return False
+from services.lookup_service import LookupService, ROLE_FOREMAN, ROLE_WORKER
+from bot import (
+    handle_empty_data, BufferInputFile, MESSAGE_LIMIT, fit_lines, message_length, parse_page_callback,
+    parse_action_callback, add_page_buttons
+)
+from services.tool_service import ToolService
+from services.notification_service import NotificationService
+from services.pagination import Page
+from config import INVENTORY_PROGRESS_INTERVAL
+import asyncio
+import time
+from typing import AbstractSet, List, Optional, Sequence, Set, Tuple
 
 router = Router()
 
@@ -72,12 +46,16 @@ MSG_REG_REJECT_ERROR = "❌ Ошибка при отклонении регис
 MSG_NO_TOOLS = "🔧 На вашем объекте нет инструментов."
 MSG_TOOLS_LIST = "🔧 Инструменты на вашем объекте:\n"
 MSG_NO_TOOL_REQUESTS = "Нет заявок на передачу инструментов."
+MSG_TOOL_REQUESTS_INBOX = "📋 Заявки на инструменты:\n\n"
+MSG_REGISTRATIONS_INBOX = "👥 Заявки на регистрацию:\n\n"
 MSG_TOOL_REQUEST = "Заявка: {tool_name} (инв. №{inv_num}) для {to_object}"
 MSG_TOOL_REQUEST_APPROVED = "Заявка одобрена, инструмент передан!"
 MSG_TOOL_REQUEST_REJECTED = "Заявка отклонена!"
 MSG_INVENTORY_PHOTO_PROMPT = "Отправьте фотографии QR-кодов всех инструментов на объекте одним или несколькими сообщениями."
 MSG_INVENTORY_PHOTO_RECEIVED = "Фото получено. Отправьте ещё или нажмите 'Подтвердить'."
+MSG_INVENTORY_PROGRESS = "Отправьте фотографии QR-кодов всех инструментов на объекте одним или несколькими сообщениями.\n\n📸 Фотографий получено: {photos}\n🔎 Распознано QR-кодов: {codes}"
 MSG_INVENTORY_DONE = "Инвентаризация завершена! Вот XML для 1C:"
+MSG_INVENTORY_TRUNCATED = "\n… список сокращён, полностью — в XML-отчёте ниже."
 MSG_NO_WORKERS = "На вашем объекте нет рабочих."
 MSG_WORKERS_LIST = "👷 Рабочие на объекте:\n"
 MSG_TOOL_REQUEST_APPROVED = "✅ Ваша заявка на инструмент '{tool_name}' (инв. №{inventory_number}) одобрена! Инструмент передан на объект '{object_name}'."
@@ -91,255 +69,252 @@ def get_foreman_menu():
     builder.button(text="🔧 Инструменты на объекте", callback_data="foreman_tools")
     builder.button(text="📦 Заявки на инструменты", callback_data="foreman_requests")
     builder.button(text="📋 Провести инвентаризацию", callback_data="start_inventory")
+    builder.button(text="🔄 Инвентаризация: только изменения", callback_data="start_inventory_delta")
     builder.adjust(1)
     return builder.as_markup()
 
+def render_inbox_page(
+    header: str,
+    lines: List[str],
+    page: Page,
+    prefix: str,
+    approve_prefix: str,
+    reject_prefix: str,
+    select_prefix: Optional[str] = None,
+    selected: AbstractSet[int] = frozenset(),
+    bulk_buttons: Sequence[Tuple[str, str]] = ()
+):
+    """Текст и клавиатура страницы входящих заявок: нумерованные строки и кнопки на каждую заявку.
+
+    Кнопки действий несут курсор страницы, чтобы после обработки перерисовать ее же.
+    С select_prefix у заявки появляется кнопка выбора (выбранные — в selected), а
+    bulk_buttons (текст, префикс callback_data) добавляются отдельной строкой.
+    """
+    text, count = fit_lines(header, (f"{number}. {line}\n" for number, line in enumerate(lines, 1)))
+    page = page.truncate(count)
+    # Страница начинается сразу после id, предшествующего ее первой строке (0 — первая страница)
+    after = page.rows[0][0] - 1 if page.prev_cursor is not None else 0
+    builder = InlineKeyboardBuilder()
+    row_size = 3 if select_prefix else 2
+    for number, row in enumerate(page.rows, 1):
+        builder.button(text=f"✅ {number}", callback_data=f"{approve_prefix}{row[0]}_{after}")
+        builder.button(text=f"❌ {number}", callback_data=f"{reject_prefix}{row[0]}_{after}")
+        if select_prefix:
+            mark = "☑️" if row[0] in selected else "⬜"
+            builder.button(text=f"{mark} {number}", callback_data=f"{select_prefix}{row[0]}_{after}")
+    for text_, callback_prefix in bulk_buttons:
+        builder.button(text=text_, callback_data=f"{callback_prefix}_{after}")
+    page_buttons = add_page_buttons(builder, prefix, page.prev_cursor, page.next_cursor)
+    builder.button(text="🔙 Назад", callback_data="back_to_menu")
+    sizes = [row_size] * len(page.rows) + [len(bulk_buttons)] * bool(bulk_buttons) + [page_buttons] * bool(page_buttons)
+    builder.adjust(*sizes, 1)
+    return text, builder.as_markup()
+
+def render_tools_page(page: Page, prefix: str):
+    """Текст и клавиатура страницы инструментов объекта; строки сверх лимита Telegram уходят на следующую страницу"""
+    statuses = LookupService.get().statuses
+    text, count = fit_lines(MSG_TOOLS_LIST, (
+        f"• {name} (инв. №{inventory_number}) — {statuses.name(status_id)}\n"
+        for _, name, inventory_number, status_id in page.rows
+    ))
+    page = page.truncate(count)
+    builder = InlineKeyboardBuilder()
+    page_buttons = add_page_buttons(builder, prefix, page.prev_cursor, page.next_cursor)
+    builder.button(text="🔙 Назад", callback_data="back_to_menu")
+    builder.adjust(*([page_buttons] if page_buttons else []), 1)
+    return text, builder.as_markup()
+
 @router.message(Command("foreman"))
 async def cmd_foreman_menu(message: Message):
     await message.answer(MSG_FOREMAN_MENU, reply_markup=get_foreman_menu())
 
-# Просмотр регистраций на объект
-@router.callback_query(F.data == "registrations")
-async def show_registrations(callback: CallbackQuery):
-    username = f"@{callback.from_user.username}" if callback.from_user.username else None
-    user = UserService.get_user_by_username(username)
+# Просмотр регистраций на объект: все заявки одним сообщением, постранично
+@router.callback_query(F.data.regexp(r"^registrations(_(next|prev)_\d+)?$"))
+async def show_registrations(callback: CallbackQuery, db: AsyncSession, user: Optional[UserSnapshot]):
     if not user or not user.object:
         await callback.answer(MSG_NO_OBJECT, show_alert=True)
         return
-    db = SessionLocal()
-    try:
-        registrations = db.query(User).filter(
-            User.object_id == user.object.id, 
-            User.role_id == 1
-        ).all()
-    finally:
-        db.close()
-    if not registrations:
-        await handle_empty_data(callback, "Нет новых заявок на регистрацию на ваш объект.", "back_to_menu")
+    after, before = parse_page_callback(callback.data, "registrations")
+    await show_registrations_page(callback, db, user.object.id, after=after, before=before)
+
+async def show_registrations_page(callback: CallbackQuery, db: AsyncSession, object_id: int, after: Optional[int] = None, before: Optional[int] = None):
+    page = await UserService.get_registrations_page(db, object_id, after=after, before=before)
+    if not page.rows:
+        await handle_empty_data(callback, MSG_NO_REGISTRATIONS, "back_to_menu")
         return
-    for reg in registrations:
-        builder = InlineKeyboardBuilder()
-        builder.button(text="✅ Подтвердить", callback_data=f"approve_reg_{reg.id}")
-        builder.button(text="❌ Отклонить", callback_data=f"reject_reg_{reg.id}")
-        await callback.message.edit_text(f"Заявка на регистрацию: {reg.username} ({reg.name or 'Без имени'})", reply_markup=builder.as_markup())
+    lines = [f"{username} ({name or 'Без имени'})" for _, username, name in page.rows]
+    text, keyboard = render_inbox_page(MSG_REGISTRATIONS_INBOX, lines, page, "registrations", "approve_reg_", "reject_reg_")
+    await callback.message.edit_text(text, reply_markup=keyboard)
 
 @router.callback_query(F.data.startswith("approve_reg_"))
-async def approve_registration(callback: CallbackQuery):
-    reg_id = int(callback.data.removeprefix("approve_reg_"))
-    username = f"@{callback.from_user.username}" if callback.from_user.username else None
-    foreman = UserService.get_user_by_username(username)
-    if not foreman or not foreman.object:
+async def approve_registration(callback: CallbackQuery, db: AsyncSession, user: Optional[UserSnapshot]):
+    reg_id, after = parse_action_callback(callback.data, "approve_reg_")
+    if not user or not user.object:
         await callback.answer(MSG_NO_OBJECT, show_alert=True)
         return
-    if UserService.approve_user(reg_id, foreman.object.id):
-        await callback.message.edit_text("Регистрация подтверждена!", reply_markup=InlineKeyboardBuilder().button(text="🔙 Назад", callback_data="back_to_menu").as_markup())
-        user = UserService.get_user_by_id(reg_id)
-        if user and callback.bot:
-            await send_notification_safely(
-                callback.bot,
-                user,
-                MSG_REG_APPROVED_USER.format(object_name=foreman.object.name)
+    if await UserService.approve_user(db, reg_id, user.object.id):
+        registered_user = await UserService.get_user_by_id(db, reg_id)
+        if registered_user:
+            # Уведомление уйдет из очереди после commit
+            await NotificationService.enqueue(
+                db,
+                registered_user,
+                MSG_REG_APPROVED_USER.format(object_name=user.object.name)
             )
+        await callback.answer(MSG_REG_APPROVED)
+        await show_registrations_page(callback, db, user.object.id, after=after)
     else:
         await callback.answer(MSG_REG_APPROVE_ERROR, show_alert=True)
 
 @router.callback_query(F.data.startswith("reject_reg_"))
-async def reject_registration(callback: CallbackQuery):
-    reg_id = int(callback.data.removeprefix("reject_reg_"))
-    if UserService.reject_user(reg_id):
-        await callback.message.edit_text("Регистрация отклонена!", reply_markup=InlineKeyboardBuilder().button(text="🔙 Назад", callback_data="back_to_menu").as_markup())
-        user = UserService.get_user_by_id(reg_id)
-        if user and callback.bot:
-            await send_notification_safely(
-                callback.bot,
-                user,
+async def reject_registration(callback: CallbackQuery, db: AsyncSession, user: Optional[UserSnapshot]):
+    reg_id, after = parse_action_callback(callback.data, "reject_reg_")
+    if not user or not user.object:
+        await callback.answer(MSG_NO_OBJECT, show_alert=True)
+        return
+    if await UserService.reject_user(db, reg_id):
+        rejected_user = await UserService.get_user_by_id(db, reg_id)
+        if rejected_user:
+            await NotificationService.enqueue(
+                db,
+                rejected_user,
                 MSG_REG_REJECTED_USER
             )
+        await callback.answer(MSG_REG_REJECTED)
+        await show_registrations_page(callback, db, user.object.id, after=after)
     else:
         await callback.answer(MSG_REG_REJECT_ERROR, show_alert=True)
 
 # Просмотр инструментов на объекте
-@router.callback_query(F.data == "foreman_tools")
-async def show_foreman_tools(callback: CallbackQuery):
-    username = f"@{callback.from_user.username}" if callback.from_user.username else None
-    user = UserService.get_user_by_username(username)
+@router.callback_query(F.data.regexp(r"^foreman_tools(_(next|prev)_\d+)?$"))
+async def show_foreman_tools(callback: CallbackQuery, db: AsyncSession, user: Optional[UserSnapshot]):
     if not user or not user.object:
         await callback.answer(MSG_NO_OBJECT, show_alert=True)
         return
     
-    # Перезагружаем объект в текущей сессии с загрузкой связанных данных
-    db = SessionLocal()
-    try:
-        object_with_tools = db.query(Object).filter(Object.id == user.object.id).first()
-        if not object_with_tools:
-            await callback.answer(MSG_NO_OBJECT, show_alert=True)
-            return
-        
-        # Загружаем инструменты с их связанными данными
-        tools = db.query(Tool).filter(Tool.current_object_id == user.object.id).all()
-        
-        # Предзагружаем связанные данные для каждого инструмента
-        for tool in tools:
-            _ = tool.tool_name.name  # Загружаем tool_name
-            _ = tool.status.name     # Загружаем status
-            _ = tool.inventory_number  # Загружаем inventory_number
-    finally:
-        db.close()
+    # Одна страница инструментов: курсор в callback_data
+    after, before = parse_page_callback(callback.data, "foreman_tools")
+    page = await ToolService.get_object_tools_page(db, user.object.id, after=after, before=before)
     
-    if not tools:
+    if not page.rows:
         await callback.message.edit_text(MSG_NO_TOOLS, reply_markup=InlineKeyboardBuilder().button(text="🔙 Назад", callback_data="back_to_menu").as_markup())
         return
-    text = MSG_TOOLS_LIST
-    for tool in tools:
-        text += f"• {tool.tool_name.name} (инв. №{tool.inventory_number}) — {tool.status.name}\n"
-    await callback.message.edit_text(text, reply_markup=InlineKeyboardBuilder().button(text="🔙 Назад", callback_data="back_to_menu").as_markup())
+    text, keyboard = render_tools_page(page, "foreman_tools")
+    await callback.message.edit_text(text, reply_markup=keyboard)
 
-# Просмотр и обработка заявок на инструменты
-@router.callback_query(F.data == "foreman_requests")
-async def show_foreman_requests(callback: CallbackQuery):
-    username = f"@{callback.from_user.username}" if callback.from_user.username else None
-    user = UserService.get_user_by_username(username)
+# Просмотр и обработка заявок на инструменты: все заявки одним сообщением, постранично
+@router.callback_query(F.data.regexp(r"^foreman_requests(_(next|prev)_\d+)?$"))
+async def show_foreman_requests(callback: CallbackQuery, state: FSMContext, db: AsyncSession, user: Optional[UserSnapshot]):
     if not user or not user.object:
         await callback.answer(MSG_NO_OBJECT, show_alert=True)
         return
-    db = SessionLocal()
-    try:
-        # Показываем только заявки, которые еще не выполнены (не имеют статус "Выполнено")
-        requests = db.query(ToolRequest).filter(
-            ToolRequest.from_object_id == user.object.id,
-            ToolRequest.status_id != 2  # 2 = "Выполнено"
-        ).all()
-        
-        # Предзагружаем связанные данные в текущей сессии
-        request_data = []
-        for req in requests:
-            tool_name = req.tool.tool_name.name if req.tool and req.tool.tool_name else "Неизвестный инструмент"
-            inventory_number = req.tool.inventory_number if req.tool else "Без номера"
-            to_object_name = req.to_object.name if req.to_object else "Неизвестный объект"
-            requester_name = req.requester.name if req.requester else "Неизвестный пользователь"
-            requester_username = req.requester.username if req.requester else "Без username"
-            request_data.append({
-                'id': req.id,
-                'tool_name': tool_name,
-                'inventory_number': inventory_number,
-                'to_object_name': to_object_name,
-                'requester_name': requester_name,
-                'requester_username': requester_username
-            })
-    finally:
-        db.close()
-    
-    if not request_data:
-        await handle_empty_data(callback, "Нет заявок на передачу инструментов.", "back_to_menu")
+    after, before = parse_page_callback(callback.data, "foreman_requests")
+    await show_requests_page(callback, state, db, user.object.id, after=after, before=before)
+
+async def get_selected_requests(state: FSMContext) -> Set[int]:
+    return set((await state.get_data()).get("selected_requests", []))
+
+async def show_requests_page(callback: CallbackQuery, state: FSMContext, db: AsyncSession, object_id: int, after: Optional[int] = None, before: Optional[int] = None):
+    # Показываем только заявки, которые еще не выполнены (не имеют статус "Выполнено")
+    page = await ToolRequestService.get_incoming_page(db, object_id, after=after, before=before)
+    if not page.rows:
+        await handle_empty_data(callback, MSG_NO_TOOL_REQUESTS, "back_to_menu")
         return
-    
-    # Отправляем каждую заявку отдельным сообщением
-    for req_data in request_data:
-        builder = InlineKeyboardBuilder()
-        builder.button(text="✅ Одобрить", callback_data=f"approve_req_{req_data['id']}")
-        builder.button(text="❌ Отклонить", callback_data=f"reject_req_{req_data['id']}")
-        builder.adjust(2)
-        
-        message_text = f"📋 Заявка на инструмент\n\n"
-        message_text += f"🔧 Инструмент: {req_data['tool_name']}\n"
-        message_text += f"📝 Инв. номер: {req_data['inventory_number']}\n"
-        message_text += f"🏗️ Объект назначения: {req_data['to_object_name']}\n"
-        message_text += f"👤 Отправитель: {req_data['requester_name']} ({req_data['requester_username']})"
-        
-        await callback.message.answer(message_text, reply_markup=builder.as_markup())
-    
-    # Отправляем сообщение с кнопкой "Назад"
-    await callback.message.answer("📋 Все заявки на инструменты:", reply_markup=InlineKeyboardBuilder().button(text="🔙 Назад", callback_data="back_to_menu").as_markup())
+    lines = [
+        f"🔧 {tool_name} (инв. №{inventory_number or 'Без номера'}) → {to_object_name or 'Неизвестный объект'}, "
+        f"👤 {requester_name or 'Без имени'} ({requester_username})"
+        for _, tool_name, inventory_number, to_object_name, requester_name, requester_username in page.rows
+    ]
+    selected = await get_selected_requests(state)
+    if selected:
+        bulk_buttons = [(f"✅ Выбранные ({len(selected)})", "req_bulk_approve_sel"), (f"❌ Выбранные ({len(selected)})", "req_bulk_reject_sel")]
+    else:
+        bulk_buttons = [("✅ Одобрить все", "req_bulk_approve_all"), ("❌ Отклонить все", "req_bulk_reject_all")]
+    text, keyboard = render_inbox_page(
+        MSG_TOOL_REQUESTS_INBOX, lines, page, "foreman_requests", "approve_req_", "reject_req_",
+        select_prefix="select_req_", selected=selected, bulk_buttons=bulk_buttons
+    )
+    await callback.message.edit_text(text, reply_markup=keyboard)
 
-@router.callback_query(F.data.startswith("approve_req_"))
-async def approve_tool_request(callback: CallbackQuery):
-    req_id = int(callback.data.removeprefix("approve_req_"))
-    
-    # Получаем пользователя, который обрабатывает заявку
-    username = f"@{callback.from_user.username}" if callback.from_user.username else None
-    approver = UserService.get_user_by_username(username)
-    if not approver:
-        await callback.answer("❌ Не удалось определить пользователя!", show_alert=True)
+@router.callback_query(F.data.startswith("select_req_"))
+async def toggle_request_selection(callback: CallbackQuery, state: FSMContext, db: AsyncSession, user: Optional[UserSnapshot]):
+    req_id, after = parse_action_callback(callback.data, "select_req_")
+    if not user or not user.object:
+        await callback.answer(MSG_NO_OBJECT, show_alert=True)
         return
-    
-    db = SessionLocal()
-    try:
-        req = db.query(ToolRequest).filter(ToolRequest.id == req_id).first()
-        if req:
-            # Меняем статус на "Выполнено" (id = 2)
-            req.status_id = 2
-            # Устанавливаем approver_id
-            req.approver_id = approver.id
-            # Перемещаем инструмент на новый объект
-            req.tool.current_object_id = req.to_object_id
-            db.commit()
-            
-            # Удаляем сообщение с заявкой
-            await callback.message.delete()
-            # Отправляем уведомление
-            await callback.answer("✅ Заявка обработана, инструмент передан!", show_alert=True)
-            
-            # Отправляем уведомление пользователю, который подал заявку
-            if req.requester and callback.bot:
-                tool_name = req.tool.tool_name.name if req.tool and req.tool.tool_name else "инструмент"
-                inventory_number = req.tool.inventory_number if req.tool else "Без номера"
-                object_name = req.to_object.name if req.to_object else "неизвестный объект"
-                notification_message = MSG_TOOL_REQUEST_APPROVED.format(
-                    tool_name=tool_name,
-                    inventory_number=inventory_number,
-                    object_name=object_name
-                )
-                await send_notification_safely(callback.bot, req.requester, notification_message)
-        else:
-            await callback.answer("❌ Заявка не найдена!", show_alert=True)
-    except Exception as e:
-        print(f"Ошибка при обработке заявки: {e}")
-        await callback.answer("❌ Ошибка при обработке заявки!", show_alert=True)
-    finally:
-        db.close()
+    selected = await get_selected_requests(state)
+    selected ^= {req_id}
+    await state.update_data(selected_requests=sorted(selected))
+    await callback.answer()
+    await show_requests_page(callback, state, db, user.object.id, after=after)
 
-@router.callback_query(F.data.startswith("reject_req_"))
-async def reject_tool_request(callback: CallbackQuery):
-    req_id = int(callback.data.removeprefix("reject_req_"))
-    
-    # Получаем пользователя, который обрабатывает заявку
-    username = f"@{callback.from_user.username}" if callback.from_user.username else None
-    approver = UserService.get_user_by_username(username)
-    if not approver:
+def tool_request_notification(req: ResolvedRequest, approve: bool) -> str:
+    if approve:
+        return MSG_TOOL_REQUEST_APPROVED.format(
+            tool_name=req.tool_name,
+            inventory_number=req.inventory_number or "Без номера",
+            object_name=req.to_object_name or "неизвестный объект"
+        )
+    return MSG_TOOL_REQUEST_REJECTED.format(tool_name=req.tool_name, inventory_number=req.inventory_number or "Без номера")
+
+async def resolve_tool_requests(
+    callback: CallbackQuery,
+    state: FSMContext,
+    db: AsyncSession,
+    user: Optional[UserSnapshot],
+    approve: bool,
+    request_ids: Optional[List[int]],
+    after: Optional[int]
+) -> None:
+    """Одобряет или отклоняет заявки (одну, выбранные или все), ставит уведомления в очередь и обновляет список"""
+    # Пользователь, который обрабатывает заявки (подставляет UserMiddleware)
+    if not user or not user.object:
         await callback.answer("❌ Не удалось определить пользователя!", show_alert=True)
         return
-    
-    db = SessionLocal()
     try:
-        req = db.query(ToolRequest).filter(ToolRequest.id == req_id).first()
-        if req:
-            # Меняем статус на "Выполнено" (id = 2)
-            req.status_id = 2
-            # Устанавливаем approver_id
-            req.approver_id = approver.id
-            db.commit()
-            
-            # Удаляем сообщение с заявкой
-            await callback.message.delete()
-            # Отправляем уведомление
-            await callback.answer("✅ Заявка обработана!", show_alert=True)
-            
-            # Отправляем уведомление пользователю, который подал заявку
-            if req.requester and callback.bot:
-                tool_name = req.tool.tool_name.name if req.tool and req.tool.tool_name else "инструмент"
-                inventory_number = req.tool.inventory_number if req.tool else "Без номера"
-                notification_message = MSG_TOOL_REQUEST_REJECTED.format(
-                    tool_name=tool_name,
-                    inventory_number=inventory_number
-                )
-                await send_notification_safely(callback.bot, req.requester, notification_message)
-        else:
-            await callback.answer("❌ Заявка не найдена!", show_alert=True)
+        resolved = await ToolRequestService.resolve_requests(
+            db, user.object.id, user.id, approve=approve, request_ids=request_ids
+        )
+        # Все уведомления одной вставкой, уйдут из очереди после commit
+        await NotificationService.enqueue_many(db, [(req, tool_request_notification(req, approve)) for req in resolved])
     except Exception as e:
         print(f"Ошибка при обработке заявки: {e}")
+        await db.rollback()
         await callback.answer("❌ Ошибка при обработке заявки!", show_alert=True)
-    finally:
-        db.close()
+        return
+
+    selected = await get_selected_requests(state)
+    if selected and resolved:
+        await state.update_data(selected_requests=sorted(selected - {req.id for req in resolved}))
+    if not resolved:
+        await callback.answer("❌ Заявка не найдена или уже обработана!", show_alert=True)
+    elif request_ids is not None and len(request_ids) == 1:
+        await callback.answer("✅ Заявка обработана, инструмент передан!" if approve else "✅ Заявка обработана!", show_alert=True)
+    else:
+        await callback.answer(f"✅ Обработано заявок: {len(resolved)}", show_alert=True)
+    # Обновляем список заявок на месте, обработанные заявки из него пропадают
+    await show_requests_page(callback, state, db, user.object.id, after=after)
+
+@router.callback_query(F.data.startswith("approve_req_"))
+async def approve_tool_request(callback: CallbackQuery, state: FSMContext, db: AsyncSession, user: Optional[UserSnapshot]):
+    req_id, after = parse_action_callback(callback.data, "approve_req_")
+    await resolve_tool_requests(callback, state, db, user, True, [req_id], after)
+
+@router.callback_query(F.data.startswith("reject_req_"))
+async def reject_tool_request(callback: CallbackQuery, state: FSMContext, db: AsyncSession, user: Optional[UserSnapshot]):
+    req_id, after = parse_action_callback(callback.data, "reject_req_")
+    await resolve_tool_requests(callback, state, db, user, False, [req_id], after)
+
+@router.callback_query(F.data.regexp(r"^req_bulk_(approve|reject)_(all|sel)_\d+$"))
+async def bulk_resolve_tool_requests(callback: CallbackQuery, state: FSMContext, db: AsyncSession, user: Optional[UserSnapshot]):
+    _, _, action, scope, after = callback.data.split("_")
+    request_ids = None
+    if scope == "sel":
+        request_ids = sorted(await get_selected_requests(state))
+        if not request_ids:
+            await callback.answer("Нет выбранных заявок", show_alert=True)
+            return
+    await resolve_tool_requests(callback, state, db, user, action == "approve", request_ids, int(after) or None)
 
 # Инвентаризация: FSM для сбора фото QR-кодов
 from aiogram.fsm.state import State, StatesGroup
@@ -348,88 +323,197 @@ class InventoryStates(StatesGroup):
     waiting_for_photos = State()
     confirm = State()
 
-@router.callback_query(F.data == "start_inventory")
+def get_inventory_progress_markup(has_photos: bool):
+    builder = InlineKeyboardBuilder()
+    # Кнопка "Подтвердить" появляется только после первой фотографии
+    if has_photos:
+        builder.button(text="✅ Подтвердить", callback_data="confirm_inventory")
+    builder.button(text="🔙 Назад", callback_data="back_to_menu")
+    builder.adjust(1)
+    return builder.as_markup()
+
+class InventoryProgressUpdater:
+    """Обновляет сообщение со счётчиками инвентаризации не чаще раза в INVENTORY_PROGRESS_INTERVAL.
+
+    Обновление, пришедшее раньше, откладывается и показывает последние счётчики, так что
+    альбом из десятков фото не упирается в лимиты Telegram на редактирование.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, message_id: int):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self._lock = asyncio.Lock()
+        self._last_text = None
+        self._last_edit = 0.0
+        self._pending: Optional[asyncio.Task] = None
+        self._stopped = False
+
+    async def __call__(self, session: InventorySession):
+        if self._stopped or self._pending:
+            return
+        delay = self._last_edit + INVENTORY_PROGRESS_INTERVAL - time.monotonic()
+        if delay > 0:
+            self._pending = asyncio.create_task(self._edit_later(session, delay))
+        else:
+            await self._edit(session)
+
+    def stop(self):
+        """Больше не редактировать сообщение: его заняло меню или итог инвентаризации"""
+        self._stopped = True
+        if self._pending:
+            self._pending.cancel()
+
+    async def _edit_later(self, session: InventorySession, delay: float):
+        await asyncio.sleep(delay)
+        self._pending = None
+        try:
+            await self._edit(session)
+        except Exception as e:
+            print(f"Ошибка обновления прогресса инвентаризации: {e}")
+
+    async def _edit(self, session: InventorySession):
+        async with self._lock:
+            text = MSG_INVENTORY_PROGRESS.format(photos=session.photo_count, codes=len(session.qr_codes))
+            # Telegram не позволяет отправить то же самое содержимое повторно
+            if self._stopped or text == self._last_text:
+                return
+            self._last_edit = time.monotonic()
+            await self.bot.edit_message_text(
+                chat_id=self.chat_id,
+                message_id=self.message_id,
+                text=text,
+                reply_markup=get_inventory_progress_markup(session.photo_count > 0)
+            )
+            self._last_text = text
+
+@router.callback_query(F.data.in_({"start_inventory", "start_inventory_delta"}))
 async def start_inventory(callback: CallbackQuery, state: FSMContext):
     await state.set_state(InventoryStates.waiting_for_photos)
-    # Сохраняем ID сообщения для последующего редактирования
-    await state.update_data(message_id=callback.message.message_id)
-    await callback.message.edit_text("Отправьте фотографии QR-кодов всех инструментов на объекте одним или несколькими сообщениями.\n\n📸 Фотографий получено: 0", reply_markup=InlineKeyboardBuilder().button(text="🔙 Назад", callback_data="back_to_menu").as_markup())
+    # Сохраняем ID сообщения для последующего редактирования и режим отчета
+    await state.update_data(
+        message_id=callback.message.message_id,
+        photos=[],
+        delta_mode=callback.data == "start_inventory_delta"
+    )
+    # Фото будут обрабатываться в фоне по мере поступления
+    InventorySessionService.start_session(
+        callback.message.chat.id,
+        callback.from_user.id,
+        callback.bot,
+        InventoryProgressUpdater(callback.bot, callback.message.chat.id, callback.message.message_id)
+    )
+    await callback.message.edit_text(MSG_INVENTORY_PROGRESS.format(photos=0, codes=0), reply_markup=get_inventory_progress_markup(False))
 
 @router.message(InventoryStates.waiting_for_photos)
 async def receive_photos(message: Message, state: FSMContext):
-    photos = (await state.get_data()).get("photos", [])
-    photos.append(message.photo[-1].file_id)
+    if not message.photo:
+        return
+    data = await state.get_data()
+    photos = data.get("photos", [])
+    # file_unique_id одинаков у повторно отправленного фото и служит ключом кэша
+    photo = message.photo[-1]
+    photos.append((photo.file_id, photo.file_unique_id))
     await state.update_data(photos=photos)
     
     # Получаем ID сообщения для редактирования
-    data = await state.get_data()
     message_id = data.get("message_id")
-    
-    # Создаем клавиатуру с кнопкой "Подтвердить" только если есть фотографии
-    builder = InlineKeyboardBuilder()
-    if len(photos) > 0:
-        builder.button(text="✅ Подтвердить", callback_data="confirm_inventory")
-    builder.button(text="🔙 Назад", callback_data="back_to_menu")
-    builder.adjust(1)
+
+    session = InventorySessionService.get_session(message.chat.id, message.from_user.id)
+    if not session:
+        session = InventorySessionService.start_session(
+            message.chat.id,
+            message.from_user.id,
+            message.bot,
+            InventoryProgressUpdater(message.bot, message.chat.id, message_id)
+        )
+    # Начинаем скачивание и распознавание фото сразу
+    session.add_photo(photo.file_id, photo.file_unique_id)
     
     # Редактируем исходное сообщение
     try:
-        await message.bot.edit_message_text(
-            chat_id=message.chat.id,
-            message_id=message_id,
-            text=f"Отправьте фотографии QR-кодов всех инструментов на объекте одним или несколькими сообщениями.\n\n📸 Фотографий получено: {len(photos)}",
-            reply_markup=builder.as_markup()
-        )
+        if session.on_progress:
+            await session.on_progress(session)
     except Exception as e:
         print(f"Ошибка редактирования сообщения: {e}")
 
 @router.callback_query(F.data == "confirm_inventory")
-async def confirm_inventory(callback: CallbackQuery, state: FSMContext):
+async def confirm_inventory(callback: CallbackQuery, state: FSMContext, db: AsyncSession, user: Optional[UserSnapshot]):
     data = await state.get_data()
     photos = data.get("photos", [])
-    username = f"@{callback.from_user.username}" if callback.from_user.username else None
-    user = UserService.get_user_by_username(username)
     if not user or not user.object:
         await callback.answer(MSG_NO_OBJECT, show_alert=True)
         return
+    # Пока дожидаемся распознавания фото, соединение из пула не держим
+    await db.commit()
+    confirm_started = time.perf_counter()
+    session = InventorySessionService.finish_session(callback.message.chat.id, callback.from_user.id)
+    if session:
+        # Дальше сообщение редактирует только этот обработчик
+        session.stop_progress()
     
     # Показываем сообщение о начале обработки
     await callback.message.edit_text("🔍 Обрабатываю фотографии и распознаю QR-коды...", reply_markup=InlineKeyboardBuilder().button(text="🔙 Назад", callback_data="back_to_menu").as_markup())
     
     try:
-        # Обрабатываем фотографии и получаем результаты
-        found_tools, missing_tools = await QRCodeService.process_inventory_photos(
-            photos, user.object.id, callback.bot
-        )
+        if session:
+            # Фото уже обработаны в фоне, остаётся дождаться последних
+            timings = session.timings
+            qr_codes = await session.wait()
+        else:
+            # Сессии нет (например, бот перезапускался) — обрабатываем фото целиком
+            timings = InventoryTimings()
+            qr_codes = await QRCodeService.collect_qr_codes(photos, callback.bot, timings=timings)
+
+        # Сопоставляем коды с инструментами объекта
+        delta = None
+        if data.get("delta_mode"):
+            found_tools, missing_tools, delta = await QRCodeService.get_inventory_delta(db, qr_codes, user.object.id, timings)
+        else:
+            found_tools, missing_tools = await QRCodeService.resolve_inventory(db, qr_codes, user.object.id, timings)
+
+        timings.total = time.perf_counter() - (session.started if session else confirm_started)
+        print(f"Обработка инвентаризации объекта {user.object.id}: {timings}, "
+              f"ожидание после подтверждения: {time.perf_counter() - confirm_started:.2f}с")
+        print(f"Кэш декодирования: {get_decode_cache().stats}")
         
-        # Обновляем статусы инструментов в базе данных
-        QRCodeService.update_inventory_statuses(found_tools, missing_tools)
+        # Обновляем статусы инструментов в базе данных одной транзакцией
+        await QRCodeService.update_inventory_statuses(db, found_tools, missing_tools)
         
-        # Создаем запись об инвентаризации
-        check = InventoryCheckService.create_check(
+        # Создаем запись об инвентаризации вместе с результатами по каждому инструменту
+        check = await InventoryCheckService.create_check(
+            db,
             user_id=user.id, 
             object_id=user.object.id, 
-            date=datetime.utcnow()
+            date=datetime.utcnow(),
+            tool_ids=[tool.id for tool in found_tools],
+            missing_tool_ids=[tool.id for tool in missing_tools]
         )
+        # Фиксируем результаты до отправки отчета, чтобы не держать блокировки на время загрузки
+        await db.commit()
         
-        # Генерируем отчет
+        # Генерируем текстовое резюме: в режиме изменений — только разницу с прошлой проверкой
         total_tools = len(found_tools) + len(missing_tools)
-        xml_report = InventoryReportService.generate_inventory_xml(
-            object_name=user.object.name,
-            user_name=user.username,
-            date=check.date,
-            found_tools=found_tools,
-            missing_tools=missing_tools,
-            total_tools=total_tools
-        )
-        
-        # Генерируем текстовое резюме
-        summary_text = InventoryReportService.generate_summary_text(
-            object_name=user.object.name,
-            found_tools=found_tools,
-            missing_tools=missing_tools,
-            total_tools=total_tools
-        )
+        if delta is not None and delta.previous_date is not None:
+            summary_text = InventoryReportService.generate_delta_text(
+                object_name=user.object.name,
+                delta=delta,
+                found_count=len(found_tools),
+                missing_count=len(missing_tools)
+            )
+        else:
+            summary_text = InventoryReportService.generate_summary_text(
+                object_name=user.object.name,
+                found_tools=found_tools,
+                missing_tools=missing_tools,
+                total_tools=total_tools
+            )
+        # Длинный список инструментов не помещается в сообщение: оставляем начало, остальное — в XML
+        if message_length(summary_text) > MESSAGE_LIMIT:
+            summary_text, _ = fit_lines(
+                "", summary_text.splitlines(keepends=True), MESSAGE_LIMIT - message_length(MSG_INVENTORY_TRUNCATED)
+            )
+            summary_text = summary_text.rstrip("\n") + MSG_INVENTORY_TRUNCATED
         
         # Отправляем результаты
         await callback.message.edit_text(
@@ -437,31 +521,33 @@ async def confirm_inventory(callback: CallbackQuery, state: FSMContext):
             reply_markup=InlineKeyboardBuilder().button(text="🔙 Назад", callback_data="back_to_menu").as_markup()
         )
         
-        # Отправляем XML-отчет как файл
-        import tempfile
-        import os
-        
-        # Создаем временный файл
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.xml', delete=False, encoding='utf-8') as temp_file:
-            temp_file.write(xml_report)
-            temp_file_path = temp_file.name
+        # Генерируем отчет в буфер в памяти (большие отчеты уходят во временный файл)
+        xml_report = InventoryReportService.stream_inventory_xml(
+            object_name=user.object.name,
+            user_name=user.username,
+            date=check.date,
+            found_tools=found_tools,
+            missing_tools=missing_tools,
+            total_tools=total_tools,
+            found_count=len(found_tools),
+            missing_count=len(missing_tools)
+        )
         
+        # Отправляем XML-отчет как файл прямо из буфера
         try:
-            # Отправляем файл
             await callback.message.answer_document(
-                document=FSInputFile(
-                    path=temp_file_path,
+                document=BufferInputFile(
+                    xml_report,
                     filename=f"inventory_report_{user.object.name}_{check.date.strftime('%Y%m%d_%H%M%S')}.xml"
                 ),
                 caption=f"📄 XML-отчет инвентаризации объекта '{user.object.name}' от {check.date.strftime('%d.%m.%Y %H:%M')}"
             )
         finally:
-            # Удаляем временный файл
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
+            xml_report.close()
         
     except Exception as e:
         print(f"Ошибка при обработке инвентаризации: {e}")
+        await db.rollback()
         await callback.message.edit_text(
             f"❌ Ошибка при обработке инвентаризации: {str(e)}",
             reply_markup=InlineKeyboardBuilder().button(text="🔙 Назад", callback_data="back_to_menu").as_markup()
@@ -470,17 +556,11 @@ async def confirm_inventory(callback: CallbackQuery, state: FSMContext):
     await state.clear()
 
 @router.callback_query(F.data == "object_workers")
-async def show_object_workers(callback: CallbackQuery):
-    username = f"@{callback.from_user.username}" if callback.from_user.username else None
-    user = UserService.get_user_by_username(username)
+async def show_object_workers(callback: CallbackQuery, db: AsyncSession, user: Optional[UserSnapshot]):
     if not user or not user.object:
         await callback.answer(MSG_NO_OBJECT, show_alert=True)
         return
-    db = SessionLocal()
-    try:
-        workers = db.query(User).filter(User.object_id == user.object.id, User.role_id == 3).all()
-    finally:
-        db.close()
+    workers = (await db.execute(select(User).filter(User.object_id == user.object.id, User.role_id == LookupService.role_id(ROLE_WORKER)))).scalars().all()
     if not workers:
         await callback.message.edit_text("На вашем объекте нет рабочих.", reply_markup=InlineKeyboardBuilder().button(text="🔙 Назад", callback_data="back_to_menu").as_markup())
         return
@@ -491,10 +571,9 @@ async def show_object_workers(callback: CallbackQuery):
 
 # Обработчик кнопки "Назад" - возврат в главное меню
 @router.callback_query(F.data == "back_to_menu")
-async def back_to_menu(callback: CallbackQuery):
-    username = f"@{callback.from_user.username}" if callback.from_user.username else None
-    user = UserService.get_user_by_username(username)
-    if user and user.role and user.role.name == "прораб объекта":
+async def back_to_menu(callback: CallbackQuery, user: Optional[UserSnapshot]):
+    if user and user.role_id == LookupService.role_id(ROLE_FOREMAN):
         await callback.message.edit_text(MSG_FOREMAN_MENU, reply_markup=get_foreman_menu())
     else:
+        from bot.worker_handlers import get_worker_menu
         await callback.message.edit_text("✅ Вы уже зарегистрированы!", reply_markup=get_worker_menu()) 
\ No newline at end of file
@@ -0,0 +1,55 @@
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from database.connection import AsyncSessionLocal
+from services.user_service import UserService
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Открывает одну сессию БД на апдейт и передает ее обработчикам аргументом db.
+
+    Сервисы только делают flush, а commit выполняется один раз после обработчика
+    (rollback — если обработчик упал). Соединение берется из пула при первом запросе,
+    так что апдейты без обращений к БД его не занимают. Обработчик, который надолго
+    уходит во внешние операции, может сам вызвать db.commit() — в конце закоммитится
+    только то, что изменилось после этого.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        async with AsyncSessionLocal() as db:
+            data["db"] = db
+            try:
+                result = await handler(event, data)
+            except Exception:
+                await db.rollback()
+                raise
+            await db.commit()
+            return result
+
+
+class UserMiddleware(BaseMiddleware):
+    """Передает обработчику пользователя бота аргументом user (UserSnapshot или None).
+
+    Пользователь берется из кэша по Telegram id и username и загружается из БД только
+    при промахе. Обработчики без параметра user его не запрашивают. Регистрируется
+    как внутренний middleware после DbSessionMiddleware.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        from_user = data.get("event_from_user")
+        if handler_object and ("user" in handler_object.params or handler_object.varkw):
+            data["user"] = None
+            if from_user and from_user.username:
+                data["user"] = await UserService.get_user_snapshot(data["db"], f"@{from_user.username}", from_user.id)
+        return await handler(event, data)
@@ -0,0 +1,242 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import queue
+import signal
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram присылает secret_token из setWebhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Управляющие сообщения в очереди процесса-обработчика (апдейты — словари)
+STOP = None
+INVALIDATE = "invalidate"
+
+
+def update_chat_id(update: dict) -> Optional[int]:
+    """Чат апдейта по сырому JSON: chat, chat сообщения (callback_query) или отправитель"""
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat.get("id")
+        sender = value.get("from") or value.get("user")
+        if sender:
+            return sender.get("id")
+    return None
+
+
+class ChatLanes:
+    """Обработка апдейтов: по порядку внутри чата, параллельно между чатами.
+
+    Каждый апдейт ждет завершения предыдущего апдейта своего чата, одновременно
+    выполняется не больше concurrency обработчиков, в работе — не больше max_pending апдейтов.
+    """
+
+    def __init__(self, handler: Callable[[dict], Awaitable], concurrency: int, max_pending: int):
+        self.handler = handler
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.max_pending = max_pending
+        self.tails: Dict[int, asyncio.Task] = {}
+        self.tasks: Set[asyncio.Task] = set()
+        self.ready = asyncio.Event()
+        self.ready.set()
+        self.processed = 0
+        self.errors = 0
+
+    def submit(self, update: dict) -> bool:
+        """Ставит апдейт в очередь его чата. False — очередь заполнена"""
+        if len(self.tasks) >= self.max_pending:
+            return False
+        key = update_chat_id(update)
+        previous = self.tails.get(key) if key is not None else None
+        task = asyncio.create_task(self._run(update, previous))
+        self.tasks.add(task)
+        if len(self.tasks) >= self.max_pending:
+            self.ready.clear()
+        if key is not None:
+            self.tails[key] = task
+        task.add_done_callback(lambda done: self._finished(done, key))
+        return True
+
+    async def wait_ready(self) -> None:
+        """Ждет, пока в очереди появится место"""
+        await self.ready.wait()
+
+    async def join(self) -> None:
+        """Дожидается всех принятых апдейтов"""
+        if self.tasks:
+            await asyncio.wait(list(self.tasks))
+
+    async def _run(self, update: dict, previous: Optional[asyncio.Task]) -> None:
+        if previous is not None:
+            # Ошибка предыдущего апдейта чата не мешает следующему
+            await asyncio.wait([previous])
+        async with self.semaphore:
+            try:
+                await self.handler(update)
+                self.processed += 1
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Ошибка обработки апдейта {update.get('update_id')}: {e}")
+
+    def _finished(self, task: asyncio.Task, key: Optional[int]) -> None:
+        self.tasks.discard(task)
+        if key is not None and self.tails.get(key) is task:
+            del self.tails[key]
+        if len(self.tasks) < self.max_pending:
+            self.ready.set()
+
+
+class WorkerPool:
+    """Процессы-обработчики апдейтов: у каждого своя очередь, чат закреплен за процессом по id.
+
+    target(index, queues) запускается в отдельном процессе (spawn) и читает queues[index];
+    очереди остальных процессов он использует, чтобы рассылать им сбросы кэшей.
+    """
+
+    def __init__(self, target: Callable, workers: int, queue_size: int):
+        context = multiprocessing.get_context("spawn")
+        self.queues = [context.Queue(queue_size) for _ in range(workers)]
+        self.processes = [
+            context.Process(target=target, args=(index, self.queues), name=f"bot-worker-{index}")
+            for index in range(workers)
+        ]
+        self._round_robin = itertools.count()
+
+    def start(self) -> None:
+        for process in self.processes:
+            process.start()
+
+    def submit(self, update: dict) -> bool:
+        """Передает апдейт процессу его чата. False — очередь процесса заполнена"""
+        key = update_chat_id(update)
+        if key is None:
+            key = next(self._round_robin)
+        try:
+            self.queues[key % len(self.queues)].put_nowait(update)
+        except queue.Full:
+            return False
+        return True
+
+    def dead_workers(self) -> List[str]:
+        return [process.name for process in self.processes if not process.is_alive()]
+
+    async def watch(self, stop: asyncio.Event, interval: float = 1.0) -> None:
+        """Останавливает сервер, если процесс-обработчик завершился: его чаты некому обслужить"""
+        while not stop.is_set():
+            dead = self.dead_workers()
+            if dead:
+                logger.error(f"Процессы-обработчики завершились: {', '.join(dead)}")
+                stop.set()
+                return
+            await asyncio.sleep(interval)
+
+    def stop(self, timeout: float = 30) -> None:
+        """Просит процессы доделать принятые апдейты и завершиться"""
+        for worker_queue, process in zip(self.queues, self.processes):
+            if process.is_alive():
+                worker_queue.put(STOP)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"{process.name} не завершился за {timeout} с, останавливаем принудительно")
+                process.terminate()
+                process.join()
+
+
+def ignore_stop_signals() -> None:
+    """Процессы-обработчики останавливает главный процесс, а не Ctrl+C или SIGTERM группе процессов"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def publish_to_queues(queues, index: int) -> Callable[[str, Optional[int]], None]:
+    """Функция, рассылающая сброс кэша всем процессам, кроме index"""
+    def publish(kind: str, key: Optional[int]) -> None:
+        for other, worker_queue in enumerate(queues):
+            if other == index:
+                continue
+            try:
+                worker_queue.put_nowait((INVALIDATE, kind, key))
+            except queue.Full:
+                # Кэш другого процесса устареет не дольше, чем на свой TTL
+                logger.warning(f"Очередь процесса {other} заполнена, сброс кэша ({kind}, {key}) не передан")
+    return publish
+
+
+async def consume_queue(
+    worker_queue,
+    lanes: ChatLanes,
+    on_invalidate: Callable[[str, Optional[int]], None],
+    poll_interval: float = 1.0
+) -> None:
+    """Читает очередь процесса-обработчика до STOP или завершения главного процесса"""
+    loop = asyncio.get_running_loop()
+    parent = multiprocessing.parent_process()
+    while True:
+        await lanes.wait_ready()
+        try:
+            item = await loop.run_in_executor(None, worker_queue.get, True, poll_interval)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                logger.error("Главный процесс завершился, останавливаем обработчик")
+                break
+            continue
+        if item is STOP:
+            break
+        if isinstance(item, tuple) and item[0] == INVALIDATE:
+            on_invalidate(item[1], item[2])
+            continue
+        lanes.submit(item)
+    await lanes.join()
+
+
+async def start_webhook_server(
+    submit: Callable[[dict], bool],
+    host: str,
+    port: int,
+    path: str,
+    secret: str = ""
+) -> web.AppRunner:
+    """HTTP-сервер, принимающий апдейты Telegram на path. Возвращает runner для остановки.
+
+    Апдейт только ставится в очередь, ответ уходит сразу; при заполненной очереди — 503,
+    и Telegram повторит доставку позже.
+    """
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret and request.headers.get(SECRET_HEADER) != secret:
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(update, dict):
+            return web.Response(status=400)
+        if not submit(update):
+            return web.Response(status=503)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def wait_for_stop_signal(stop: asyncio.Event) -> None:
+    """Ждет SIGINT/SIGTERM (или установки stop другим способом)"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
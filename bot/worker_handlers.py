@@ -1,19 +1,25 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from services.user_service import UserService
+from services.user_cache import UserSnapshot
 from services.tool_request_service import ToolRequestService
-from database.connection import get_db, SessionLocal
-from database.models import User, Object, Tool, RequestStatus, Status
-from aiogram import Bot
+from services.object_service import ObjectService, ObjectDirectory
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import RequestStatus
 from services.inventory_check_service import InventoryCheckService
+from services.lookup_service import LookupService, ROLE_PENDING, ROLE_FOREMAN
 from sqlalchemy.orm import Session
 from aiogram.fsm.state import State, StatesGroup
-from bot.foreman_handlers import get_foreman_menu
-from bot import handle_empty_data
-from bot.foreman_handlers import send_notification_safely
+from bot.foreman_handlers import get_foreman_menu, InventoryStates
+from services.inventory_session_service import InventorySessionService
+from bot import handle_empty_data, parse_page_callback, add_page_buttons
+from bot.foreman_handlers import render_tools_page
+from services.notification_service import NotificationService
+from services.tool_service import ToolService
+from typing import Dict, Optional, Tuple
 
 router = Router()
 
@@ -30,7 +36,8 @@ MSG_NO_OTHER_OBJECTS = "Нет других объектов для запрос
 MSG_SELECT_DONOR_OBJECT = "Выберите объект, с которого хотите запросить инструмент:"
 MSG_OBJECT_NOT_FOUND = "❌ Объект не найден."
 MSG_NO_TOOLS_ON_OBJECT = "На выбранном объекте нет доступных инструментов."
-MSG_SELECT_TOOL = "Выберите инструмент для запроса:"
+MSG_SELECT_TOOL_NAME = "Выберите инструмент для запроса:"
+MSG_SELECT_TOOL = "Выберите экземпляр инструмента для запроса:"
 MSG_REQUEST_SENT = "Заявка на инструмент отправлена! Ожидайте решения."
 MSG_ENTER_NAME = "Пожалуйста, введите ваше полное имя:"
 MSG_NO_OBJECTS_FOR_REG = "Нет доступных объектов для регистрации. Обратитесь к администратору."
@@ -60,38 +67,64 @@ def get_worker_menu(foreman_username=None):
     builder.adjust(1)
     return builder.as_markup()
 
+# Клавиатуры выбора объекта: префикс callback_data и последняя кнопка
+OBJECT_KEYBOARDS = {
+    "donor": ("select_donor_", "🔙 Назад", "back_to_menu"),
+    "register": ("select_object_", "🔙 Отмена", "cancel_registration"),
+}
+# Собранные клавиатуры для текущей версии справочника: (вид, исключенный объект) -> разметка
+_object_keyboards: Dict[Tuple[str, Optional[int]], InlineKeyboardMarkup] = {}
+_object_keyboards_version: Optional[int] = None
+
+def get_objects_keyboard(directory: ObjectDirectory, kind: str, exclude_id: Optional[int] = None) -> InlineKeyboardMarkup:
+    """Клавиатура со всеми объектами (или всеми, кроме exclude_id), собранная один раз на версию справочника"""
+    global _object_keyboards_version
+    if _object_keyboards_version != directory.version:
+        _object_keyboards.clear()
+        _object_keyboards_version = directory.version
+    markup = _object_keyboards.get((kind, exclude_id))
+    if markup is None:
+        prefix, last_text, last_callback = OBJECT_KEYBOARDS[kind]
+        builder = InlineKeyboardBuilder()
+        for obj in directory.without(exclude_id):
+            builder.button(text=f"🏗️ {obj.name}", callback_data=f"{prefix}{obj.id}")
+        builder.button(text=last_text, callback_data=last_callback)
+        builder.adjust(1)
+        markup = builder.as_markup()
+        _object_keyboards[(kind, exclude_id)] = markup
+    return markup
+
 # /start - регистрация
 @router.message(Command("start"))
-async def cmd_start(message: Message, state: FSMContext):
+async def cmd_start(message: Message, state: FSMContext, db: AsyncSession, user: Optional[UserSnapshot]):
     username = message.from_user.username
     if not username:
         await message.answer(MSG_NEED_USERNAME)
         return
     username = f"@{username}"
-    user = UserService.get_user_by_username(username)
-    if user and user.role and user.role.name == "прораб объекта":
+    if user and user.role_id == LookupService.role_id(ROLE_FOREMAN):
         # Обновляем chat_id если его нет
         if not getattr(user, 'chat_id', None):
             user_id = user.id
             if hasattr(user_id, 'value'):
                 user_id = user_id.value
-            UserService.update_user(int(user_id), chat_id=message.chat.id)
+            await UserService.update_user(db, int(user_id), chat_id=message.chat.id)
         await message.answer(MSG_FOREMAN_MENU, reply_markup=get_foreman_menu())
         return
     if not user:
-        UserService.create_user(username, chat_id=message.chat.id)
+        await UserService.create_user(db, username, chat_id=message.chat.id)
         await message.answer(
             MSG_WELCOME_REGISTER,
             reply_markup=InlineKeyboardBuilder().button(text="📝 Зарегистрироваться", callback_data="register").as_markup()
         )
         return
-    if user.role.name == "в обработке" or not getattr(user, 'name', None) or not getattr(user, 'object', None):
+    if user.role_id == LookupService.role_id(ROLE_PENDING) or not getattr(user, 'name', None) or not getattr(user, 'object', None):
         # Обновляем chat_id если его нет
         if not getattr(user, 'chat_id', None):
             user_id = user.id
             if hasattr(user_id, 'value'):
                 user_id = user_id.value
-            UserService.update_user(int(user_id), chat_id=message.chat.id)
+            await UserService.update_user(db, int(user_id), chat_id=message.chat.id)
         await message.answer(
             MSG_CONTINUE_REGISTER,
             reply_markup=InlineKeyboardBuilder().button(text="📝 Зарегистрироваться", callback_data="register").as_markup()
@@ -102,18 +135,10 @@ async def cmd_start(message: Message, state: FSMContext):
         user_id = user.id
         if hasattr(user_id, 'value'):
             user_id = user_id.value
-        UserService.update_user(int(user_id), chat_id=message.chat.id)
+        await UserService.update_user(db, int(user_id), chat_id=message.chat.id)
     
-    # Получаем информацию о бригадире объекта
-    db = SessionLocal()
-    try:
-        foreman = db.query(User).filter(
-            User.object_id == user.object.id,
-            User.role_id == 2  # 2 = "прораб объекта"
-        ).first()
-        foreman_username = foreman.username if foreman else None
-    finally:
-        db.close()
+    # Бригадир объекта из справочника объектов (object.foreman_id)
+    foreman_username = (await ObjectService.get_directory(db)).foreman_username(user.object.id)
     
     # Формируем сообщение с информацией о бригадире
     menu_text = MSG_ALREADY_REGISTERED
@@ -128,133 +153,100 @@ async def cmd_start(message: Message, state: FSMContext):
     )
 
 # Просмотр инструментов на объекте
-@router.callback_query(F.data == "my_tools")
-async def show_my_tools(callback: CallbackQuery):
-    username = callback.from_user.username
-    if not username:
-        await callback.answer(MSG_NO_OBJECT, show_alert=True)
-        return
-    username = f"@{username}"
-    user = UserService.get_user_by_username(username)
+@router.callback_query(F.data.regexp(r"^my_tools(_(next|prev)_\d+)?$"))
+async def show_my_tools(callback: CallbackQuery, db: AsyncSession, user: Optional[UserSnapshot]):
     if not user or not getattr(user, 'object', None):
         await callback.answer(MSG_NO_OBJECT, show_alert=True)
         return
     
-    # Перезагружаем объект в текущей сессии с загрузкой связанных данных
-    db = SessionLocal()
-    try:
-        object_with_tools = db.query(Object).filter(Object.id == user.object.id).first()
-        if not object_with_tools:
-            await callback.answer(MSG_NO_OBJECT, show_alert=True)
-            return
-        
-        # Загружаем инструменты с их связанными данными
-        tools = db.query(Tool).filter(Tool.current_object_id == user.object.id).all()
-        
-        # Предзагружаем связанные данные для каждого инструмента
-        for tool in tools:
-            _ = tool.tool_name.name  # Загружаем tool_name
-            _ = tool.status.name     # Загружаем status
-            _ = tool.inventory_number  # Загружаем inventory_number
-    finally:
-        db.close()
+    # Одна страница инструментов: курсор в callback_data
+    after, before = parse_page_callback(callback.data, "my_tools")
+    page = await ToolService.get_object_tools_page(db, user.object.id, after=after, before=before)
     
-    if not tools:
+    if not page.rows:
         await handle_empty_data(callback, MSG_NO_TOOLS, "back_to_menu")
         return
-    text = MSG_TOOLS_LIST
-    for tool in tools:
-        text += f"• {tool.tool_name.name} (инв. №{tool.inventory_number}) — {tool.status.name}\n"
+    text, keyboard = render_tools_page(page, "my_tools")
     if callback.message:
-        await callback.message.edit_text(text, reply_markup=InlineKeyboardBuilder().button(text="🔙 Назад", callback_data="back_to_menu").as_markup())
+        await callback.message.edit_text(text, reply_markup=keyboard)
     else:
-        await callback.message.answer(text, reply_markup=InlineKeyboardBuilder().button(text="🔙 Назад", callback_data="back_to_menu").as_markup())
+        await callback.message.answer(text, reply_markup=keyboard)
 
 # Запросить инструмент с другого объекта
 @router.callback_query(F.data == "request_tool")
-async def request_tool(callback: CallbackQuery, state: FSMContext):
-    username = callback.from_user.username
-    if not username:
-        await callback.answer(MSG_NO_OBJECT, show_alert=True)
-        return
-    username = f"@{username}"
-    user = UserService.get_user_by_username(username)
+async def request_tool(callback: CallbackQuery, state: FSMContext, db: AsyncSession, user: Optional[UserSnapshot]):
     if not user or not getattr(user, 'object', None):
         await callback.answer(MSG_NO_OBJECT, show_alert=True)
         return
-    db = SessionLocal()
-    try:
-        objects = db.query(Object).filter(Object.id != user.object.id).all()
-    finally:
-        db.close()
-    if not objects:
+    directory = await ObjectService.get_directory(db)
+    if not directory.without(user.object.id):
         await handle_empty_data(callback, MSG_NO_OTHER_OBJECTS, "back_to_menu")
         return
-    builder = InlineKeyboardBuilder()
-    for obj in objects:
-        builder.button(text=f"🏗️ {obj.name}", callback_data=f"select_donor_{obj.id}")
-    builder.button(text="🔙 Назад", callback_data="back_to_menu")
-    builder.adjust(1)
+    keyboard = get_objects_keyboard(directory, "donor", exclude_id=user.object.id)
     if callback.message:
-        await callback.message.edit_text(MSG_SELECT_DONOR_OBJECT, reply_markup=builder.as_markup())
+        await callback.message.edit_text(MSG_SELECT_DONOR_OBJECT, reply_markup=keyboard)
     else:
-        await callback.message.answer(MSG_SELECT_DONOR_OBJECT, reply_markup=builder.as_markup())
+        await callback.message.answer(MSG_SELECT_DONOR_OBJECT, reply_markup=keyboard)
 
-@router.callback_query(F.data.startswith("select_donor_"))
-async def select_donor_object(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(F.data.regexp(r"^(select_donor_\d+|donor_names_\d+_(next|prev)_\d+)$"))
+async def select_donor_object(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     data = callback.data or ""
-    if not data.startswith("select_donor_"):
+    if data.startswith("select_donor_"):
+        donor_object_id = int(data.removeprefix("select_donor_"))
+    else:
+        donor_object_id = int(data.split("_")[2])
+    donor_object = (await ObjectService.get_directory(db)).get(donor_object_id)
+    if not donor_object:
         await callback.answer(MSG_OBJECT_NOT_FOUND, show_alert=True)
         return
-    donor_object_id = int(data.removeprefix("select_donor_"))
-    db = SessionLocal()
-    try:
-        donor_object = db.query(Object).filter(Object.id == donor_object_id).first()
-        
-        # Получаем статус "В наличии"
-        available_status = db.query(Status).filter(Status.name == "В наличии").first()
-        if not available_status:
-            await callback.answer("❌ Статус 'В наличии' не найден в базе данных!", show_alert=True)
-            return
-        
-        # Загружаем только инструменты со статусом "В наличии"
-        tools = db.query(Tool).filter(
-            Tool.current_object_id == donor_object_id,
-            Tool.status_id == available_status.id
-        ).all()
         
-        # Предзагружаем связанные данные в текущей сессии
-        tool_data = []
-        for tool in tools:
-            tool_name = tool.tool_name.name if tool.tool_name else "Неизвестный инструмент"
-            inventory_number = tool.inventory_number or "Без номера"
-            tool_data.append({
-                'id': tool.id,
-                'name': tool_name,
-                'inventory_number': inventory_number
-            })
-    finally:
-        db.close()
+    # Названия доступных инструментов объекта с количеством, одна страница (GROUP BY name_id)
+    prefix = f"donor_names_{donor_object_id}"
+    after, before = parse_page_callback(data, prefix)
+    page = await ToolService.get_available_names_page(db, donor_object_id, after=after, before=before)
     
-    if not donor_object:
-        await callback.answer(MSG_OBJECT_NOT_FOUND, show_alert=True)
-        return
-    if not tool_data:
+    if not page.rows:
         await handle_empty_data(callback, MSG_NO_TOOLS_ON_OBJECT, "request_tool")
         return
     
     builder = InlineKeyboardBuilder()
-    for tool in tool_data:
-        builder.button(text=f"{tool['name']} (инв. №{tool['inventory_number']})", callback_data=f"request_tool_{tool['id']}_{donor_object_id}")
+    for name_id, name, count in page.rows:
+        builder.button(text=f"{name} ({count} шт.)", callback_data=f"donor_tools_{donor_object_id}_{name_id}")
+    page_buttons = add_page_buttons(builder, prefix, page.prev_cursor, page.next_cursor)
     builder.button(text="🔙 Назад", callback_data="request_tool")
-    builder.adjust(1)
+    builder.adjust(*[1] * len(page.rows), *([page_buttons] if page_buttons else []), 1)
+    if callback.message:
+        await callback.message.edit_text(MSG_SELECT_TOOL_NAME, reply_markup=builder.as_markup())
+    else:
+        await callback.message.answer(MSG_SELECT_TOOL_NAME, reply_markup=builder.as_markup())
+
+@router.callback_query(F.data.regexp(r"^donor_tools_\d+_\d+(_(next|prev)_\d+)?$"))
+async def select_donor_tool(callback: CallbackQuery, db: AsyncSession):
+    parts = callback.data.split("_")
+    donor_object_id, name_id = int(parts[2]), int(parts[3])
+    
+    # Одна страница доступных экземпляров выбранного названия
+    prefix = f"donor_tools_{donor_object_id}_{name_id}"
+    after, before = parse_page_callback(callback.data, prefix)
+    page = await ToolService.get_available_tools_page(db, donor_object_id, name_id, after=after, before=before)
+    
+    if not page.rows:
+        await handle_empty_data(callback, MSG_NO_TOOLS_ON_OBJECT, f"select_donor_{donor_object_id}")
+        return
+    
+    builder = InlineKeyboardBuilder()
+    for tool_id, name, inventory_number in page.rows:
+        builder.button(text=f"{name} (инв. №{inventory_number or 'Без номера'})", callback_data=f"request_tool_{tool_id}_{donor_object_id}")
+    page_buttons = add_page_buttons(builder, prefix, page.prev_cursor, page.next_cursor)
+    builder.button(text="🔙 Назад", callback_data=f"select_donor_{donor_object_id}")
+    builder.adjust(*[1] * len(page.rows), *([page_buttons] if page_buttons else []), 1)
     if callback.message:
         await callback.message.edit_text(MSG_SELECT_TOOL, reply_markup=builder.as_markup())
     else:
         await callback.message.answer(MSG_SELECT_TOOL, reply_markup=builder.as_markup())
 
 @router.callback_query(F.data.startswith("request_tool_"))
-async def confirm_tool_request(callback: CallbackQuery, state: FSMContext):
+async def confirm_tool_request(callback: CallbackQuery, state: FSMContext, db: AsyncSession, user: Optional[UserSnapshot]):
     data = callback.data or ""
     if not data.startswith("request_tool_"):
         await callback.answer(MSG_NO_OBJECT, show_alert=True)
@@ -265,12 +257,6 @@ async def confirm_tool_request(callback: CallbackQuery, state: FSMContext):
         return
     tool_id = int(parts[2])
     from_object_id = int(parts[3])
-    username = callback.from_user.username
-    if not username:
-        await callback.answer(MSG_NO_OBJECT, show_alert=True)
-        return
-    username = f"@{username}"
-    user = UserService.get_user_by_username(username)
     if not user or not getattr(user, 'object', None):
         await callback.answer(MSG_NO_OBJECT, show_alert=True)
         return
@@ -285,7 +271,8 @@ async def confirm_tool_request(callback: CallbackQuery, state: FSMContext):
     if user_id_int is None:
         await callback.answer(MSG_NO_OBJECT, show_alert=True)
         return
-    ToolRequestService.create_request(
+    await ToolRequestService.create_request(
+        db,
         tool_id=tool_id,
         requester_id=user_id_int,
         from_object_id=from_object_id,
@@ -297,12 +284,12 @@ async def confirm_tool_request(callback: CallbackQuery, state: FSMContext):
         await callback.message.answer(MSG_REQUEST_SENT, reply_markup=InlineKeyboardBuilder().button(text="🔙 Назад", callback_data="back_to_menu").as_markup())
 
 # Уведомления о статусе заявки (пример функции для отправки уведомления)
-async def notify_user_about_request(bot: Bot, user_id: int, status: str, tool_name: str):
-    user = UserService.get_user_by_id(user_id)
+async def notify_user_about_request(db: AsyncSession, user_id: int, status: str, tool_name: str):
+    user = await UserService.get_user_by_id(db, user_id)
     if not user:
         return
     text = MSG_REQUEST_STATUS.format(tool_name=tool_name, status=status.lower())
-    await send_notification_safely(bot, user, text)
+    await NotificationService.enqueue(db, user, text)
 
 @router.callback_query(F.data == "register")
 async def start_registration(callback: CallbackQuery, state: FSMContext):
@@ -310,27 +297,18 @@ async def start_registration(callback: CallbackQuery, state: FSMContext):
     await callback.message.answer(MSG_ENTER_NAME)
 
 @router.message(RegistrationStates.waiting_for_name)
-async def process_name(message: Message, state: FSMContext):
+async def process_name(message: Message, state: FSMContext, db: AsyncSession):
     await state.update_data(name=message.text)
-    db = SessionLocal()
-    try:
-        objects = db.query(Object).all()
-    finally:
-        db.close()
-    if not objects:
+    directory = await ObjectService.get_directory(db)
+    if not directory.objects:
         await message.answer(MSG_NO_OBJECTS_FOR_REG)
         await state.clear()
         return
-    builder = InlineKeyboardBuilder()
-    for obj in objects:
-        builder.button(text=f"🏗️ {obj.name}", callback_data=f"select_object_{obj.id}")
-    builder.button(text="🔙 Отмена", callback_data="cancel_registration")
-    builder.adjust(1)
     await state.set_state(RegistrationStates.waiting_for_object)
-    await message.answer(MSG_SELECT_OBJECT, reply_markup=builder.as_markup())
+    await message.answer(MSG_SELECT_OBJECT, reply_markup=get_objects_keyboard(directory, "register"))
 
 @router.callback_query(F.data.startswith("select_object_"), RegistrationStates.waiting_for_object)
-async def process_object_selection(callback: CallbackQuery, state: FSMContext):
+async def process_object_selection(callback: CallbackQuery, state: FSMContext, db: AsyncSession, user: Optional[UserSnapshot]):
     data = callback.data or ""
     if not data.startswith("select_object_"):
         if callback.message:
@@ -346,8 +324,6 @@ async def process_object_selection(callback: CallbackQuery, state: FSMContext):
             await callback.message.answer(MSG_REG_ERROR)
         await state.clear()
         return
-    username = f"@{username}"
-    user = UserService.get_user_by_username(username)
     if user:
         user_id = user.id
         if hasattr(user_id, 'value'):
@@ -357,7 +333,7 @@ async def process_object_selection(callback: CallbackQuery, state: FSMContext):
         except Exception:
             user_id_int = None
         if user_id_int is not None:
-            UserService.update_user(user_id_int, name=name, object_id=object_id)
+            await UserService.update_user(db, user_id_int, name=name, object_id=object_id)
     if callback.message:
         await callback.message.answer(MSG_REG_SENT.format(name=name))
     await state.clear()
@@ -369,29 +345,21 @@ async def cancel_registration(callback: CallbackQuery, state: FSMContext):
 
 # Обработчик кнопки "Назад" - возврат в главное меню
 @router.callback_query(F.data == "back_to_menu")
-async def back_to_menu(callback: CallbackQuery):
-    username = callback.from_user.username
-    if not username:
-        await callback.answer(MSG_NO_OBJECT, show_alert=True)
-        return
-    username = f"@{username}"
-    user = UserService.get_user_by_username(username)
-    if user and user.role and user.role.name == "прораб объекта":
+async def back_to_menu(callback: CallbackQuery, state: FSMContext, db: AsyncSession, user: Optional[UserSnapshot]):
+    # Выход из инвентаризации: фото в обработке больше не обновляют сообщение, новые не принимаются
+    if await state.get_state() in InventoryStates.__all_states_names__:
+        await state.clear()
+    InventorySessionService.cancel_session(callback.message.chat.id, callback.from_user.id)
+    if user and user.role_id == LookupService.role_id(ROLE_FOREMAN):
         if callback.message:
             await callback.message.edit_text(MSG_FOREMAN_MENU, reply_markup=get_foreman_menu())
         else:
             await callback.message.answer(MSG_FOREMAN_MENU, reply_markup=get_foreman_menu())
+    elif not user or not user.object:
+        await callback.answer(MSG_NO_OBJECT, show_alert=True)
     else:
-        # Получаем информацию о бригадире объекта
-        db = SessionLocal()
-        try:
-            foreman = db.query(User).filter(
-                User.object_id == user.object.id,
-                User.role_id == 2  # 2 = "прораб объекта"
-            ).first()
-            foreman_username = foreman.username if foreman else None
-        finally:
-            db.close()
+        # Бригадир объекта из справочника объектов (object.foreman_id)
+        foreman_username = (await ObjectService.get_directory(db)).foreman_username(user.object.id)
         
         # Формируем сообщение с информацией о бригадире
         menu_text = MSG_ALREADY_REGISTERED
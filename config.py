@@ -5,6 +5,8 @@ load_dotenv()
 
 # Bot configuration
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# Свой сервер Bot API (например, telegram-bot-api или заглушка нагрузочного теста); пусто — api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
 
 # Database configuration
 DB_USERNAME = os.getenv("DB_USERNAME")
@@ -13,5 +15,81 @@ DB_NAME = os.getenv("DB_NAME")
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 
-# Database URL
-DATABASE_URL = f"postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}" 
\ No newline at end of file
+# Database URL (DATABASE_URL можно задать целиком, например sqlite:///bot.db для локальных тестов)
+DATABASE_URL = os.getenv("DATABASE_URL") or f"postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# Асинхронный драйвер для бота: asyncpg для PostgreSQL, aiosqlite для SQLite
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or (
+    DATABASE_URL
+    .replace("postgresql://", "postgresql+asyncpg://", 1)
+    .replace("sqlite://", "sqlite+aiosqlite://", 1)
+)
+
+# Пул соединений с БД (для SQLite не используется)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # сколько ждать свободное соединение, секунды
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # переоткрывать соединения старше, секунды (-1 — никогда)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Метрики пула: период записи в лог (0 — не писать) и локальный эндпоинт /metrics (порт 0 — выключен)
+DB_POOL_METRICS_INTERVAL = float(os.getenv("DB_POOL_METRICS_INTERVAL", "300"))
+DB_METRICS_HOST = os.getenv("DB_METRICS_HOST", "127.0.0.1")
+DB_METRICS_PORT = int(os.getenv("DB_METRICS_PORT", "0"))
+
+# Кэш пользователей для обработчиков: время жизни записи (секунды) и максимальный размер
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
+# Справочник объектов сбрасывается при изменении объектов через бота; TTL (секунды) —
+# страховка для правок в обход бота (init_db.py, SQL, другой процесс)
+OBJECT_CACHE_TTL = float(os.getenv("OBJECT_CACHE_TTL", "600"))
+# Сколько строк показывать на одной странице списков (инструменты объекта и т.п.)
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "20"))
+
+# Очередь уведомлений: лимиты Telegram (сообщений в секунду на бота и на один чат) и повторы
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "25"))
+NOTIFY_CHAT_RATE = float(os.getenv("NOTIFY_CHAT_RATE", "1"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "8"))
+NOTIFY_RETRY_BASE = float(os.getenv("NOTIFY_RETRY_BASE", "5"))  # секунды, удваивается с каждой попыткой
+NOTIFY_RETRY_MAX = float(os.getenv("NOTIFY_RETRY_MAX", "3600"))
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "100"))
+NOTIFY_POLL_INTERVAL = float(os.getenv("NOTIFY_POLL_INTERVAL", "5"))  # секунды; новые уведомления этого процесса будят сразу
+NOTIFY_LEASE = float(os.getenv("NOTIFY_LEASE", "300"))  # на сколько секунд взятое в работу уведомление скрыто от других процессов
+
+# Режим получения апдейтов: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Публичный адрес бота (https://bot.example.com); пусто — webhook в Telegram не регистрируется
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # сверяется с заголовком X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Процессов-обработчиков; апдейты одного чата всегда попадают в один процесс
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))
+# Апдейтов, обрабатываемых одновременно в одном процессе (разумно не больше пула соединений с БД)
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "16"))
+# Апдейтов в очереди одного процесса; сверх этого сервер отвечает 503, и Telegram повторит доставку
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+
+# Inventory processing
+# Сколько фотографий инвентаризации скачивается из Telegram одновременно
+INVENTORY_DOWNLOAD_CONCURRENCY = int(os.getenv("INVENTORY_DOWNLOAD_CONCURRENCY", "8"))
+# Сообщение с прогрессом инвентаризации редактируется не чаще раза в столько секунд
+INVENTORY_PROGRESS_INTERVAL = float(os.getenv("INVENTORY_PROGRESS_INTERVAL", "1.5"))
+# Распознавание QR-кодов: сначала уменьшенная копия фото, затем плитки в полном разрешении
+QR_DOWNSCALE_MAX_SIDE = int(os.getenv("QR_DOWNSCALE_MAX_SIDE", "1280"))
+QR_TILE_SIZE = int(os.getenv("QR_TILE_SIZE", "1024"))
+QR_TILE_OVERLAP = int(os.getenv("QR_TILE_OVERLAP", "256"))  # должно быть больше размера одного кода на фото
+QR_MIN_CODE_SIZE = int(os.getenv("QR_MIN_CODE_SIZE", "60"))  # сторона самого мелкого кода на фото, px
+# Количество процессов для декодирования QR-кодов (0 — по числу ядер)
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", "0"))
+# С какого количества строк результаты проверки записываются через COPY (PostgreSQL)
+BULK_COPY_THRESHOLD = int(os.getenv("BULK_COPY_THRESHOLD", "500"))
+
+# Размер XML-отчета, после которого буфер переносится из памяти во временный файл
+INVENTORY_XML_SPOOL_SIZE = int(os.getenv("INVENTORY_XML_SPOOL_SIZE", str(1024 * 1024)))
+
+# Кэш распознанных QR-кодов по file_unique_id фото
+DECODE_CACHE_PATH = os.getenv("DECODE_CACHE_PATH", "decode_cache.sqlite3")  # пусто — только в памяти
+DECODE_CACHE_MEMORY_SIZE = int(os.getenv("DECODE_CACHE_MEMORY_SIZE", "2000"))
+DECODE_CACHE_MAX_ENTRIES = int(os.getenv("DECODE_CACHE_MAX_ENTRIES", "200000"))
+DECODE_CACHE_MAX_AGE_DAYS = float(os.getenv("DECODE_CACHE_MAX_AGE_DAYS", "90"))
@@ -1,14 +1,46 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from config import DATABASE_URL
+from config import (
+    DATABASE_URL,
+    ASYNC_DATABASE_URL,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+)
+from database.pool_metrics import MeteredQueuePool, MeteredAsyncQueuePool, register_engine
 
-# Create database engine
-engine = create_engine(DATABASE_URL)
+def pool_options(url: str, poolclass) -> dict:
+    """Настройки пула из config.py; у SQLite свой пул, его не трогаем"""
+    if url.startswith("sqlite"):
+        return {}
+    return dict(
+        poolclass=poolclass,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+
+# Create database engine (синхронный, для init_db.py и скриптов обслуживания)
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL, MeteredQueuePool))
 
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Асинхронный движок для бота: запросы не блокируют event loop
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL, MeteredAsyncQueuePool))
+
+register_engine("sync", engine)
+register_engine("async", async_engine)
+
+# Объекты остаются доступными после commit, ленивые загрузки в async невозможны
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # Create base class for models
 Base = declarative_base()
 
@@ -18,4 +50,9 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    """Get async database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, BigInteger, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import Column, Integer, String, BigInteger, DateTime, ForeignKey, Text, Boolean, Index
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text, true
+from datetime import datetime
 from database.connection import Base
 
 
@@ -46,6 +47,10 @@ class Status(Base):
 
 class User(Base):
     __tablename__ = "user"
+    __table_args__ = (
+        # Регистрации, рабочие и бригадир объекта
+        Index("ix_user_object_id_role_id", "object_id", "role_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(255), unique=True, nullable=False)  # @username
@@ -81,6 +86,14 @@ class Object(Base):
 
 class Tool(Base):
     __tablename__ = "tools"
+    __table_args__ = (
+        # Инструменты объекта с нужным статусом
+        Index("ix_tools_current_object_id_status_id", "current_object_id", "status_id"),
+        # Постраничный просмотр инструментов объекта по id
+        Index("ix_tools_current_object_id_id", "current_object_id", "id"),
+        # Выбор инструмента у объекта-донора: группировка по названию и страницы экземпляров
+        Index("ix_tools_object_status_name_id", "current_object_id", "status_id", "name_id", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     inventory_number = Column(Text, unique=True, nullable=False)
@@ -99,6 +112,10 @@ class Tool(Base):
 
 class InventoryCheck(Base):
     __tablename__ = "inventory_checks"
+    __table_args__ = (
+        # Поиск последней проверки объекта
+        Index("ix_inventory_checks_object_id_date", "object_id", "date"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     date = Column(DateTime, nullable=False, default=func.current_timestamp())
@@ -116,6 +133,7 @@ class ToolOnCheck(Base):
     
     check_id = Column(Integer, ForeignKey("inventory_checks.id"), primary_key=True)
     tool_id = Column(Integer, ForeignKey("tools.id"), primary_key=True)
+    found = Column(Boolean, nullable=False, default=True, server_default=true())  # False — инструмент не найден при проверке
     
     # Relationships
     check = relationship("InventoryCheck", back_populates="tool_on_checks")
@@ -124,6 +142,18 @@ class ToolOnCheck(Base):
 
 class ToolRequest(Base):
     __tablename__ = "tool_request"
+    __table_args__ = (
+        # Заявки на инструменты объекта-донора по статусу
+        Index("ix_tool_request_from_object_id_status_id", "from_object_id", "status_id"),
+        # Не больше одной открытой заявки на инструмент для объекта: повторные нажатия
+        # "Запросить" не плодят дубликаты (закрытая заявка получает resolved_at)
+        Index(
+            "uq_tool_request_open_tool_id_to_object_id", "tool_id", "to_object_id",
+            unique=True,
+            postgresql_where=text("resolved_at IS NULL"),
+            sqlite_where=text("resolved_at IS NULL"),
+        ),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     tool_id = Column(Integer, ForeignKey("tools.id"), nullable=False)
@@ -133,6 +163,8 @@ class ToolRequest(Base):
     approver_id = Column(Integer, ForeignKey("user.id"))
     status_id = Column(Integer, ForeignKey("request_status.id"), nullable=False)
     created_at = Column(DateTime, nullable=False, default=func.current_timestamp())
+    # Когда заявку одобрили или отклонили; NULL — заявка открыта
+    resolved_at = Column(DateTime)
     
     # Relationships
     tool = relationship("Tool", back_populates="tool_requests")
@@ -140,4 +172,23 @@ class ToolRequest(Base):
     to_object = relationship("Object", foreign_keys=[to_object_id], back_populates="tool_requests_to")
     requester = relationship("User", foreign_keys=[requester_id], back_populates="tool_requests_requester")
     approver = relationship("User", foreign_keys=[approver_id], back_populates="tool_requests_approver")
-    status = relationship("RequestStatus", back_populates="tool_requests") 
\ No newline at end of file
+    status = relationship("RequestStatus", back_populates="tool_requests")
+
+
+class Notification(Base):
+    """Исходящее уведомление пользователю; отправляет фоновый NotificationDispatcher"""
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        # Выборка уведомлений, которые пора отправить
+        Index("ix_notification_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(BigInteger, nullable=True)
+    username = Column(Text, nullable=True)  # если chat_id еще неизвестен
+    text = Column(Text, nullable=False)
+    status = Column(String(16), nullable=False, default="pending", server_default="pending")  # pending / failed
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)  # UTC
+    created_at = Column(DateTime, nullable=False, default=func.current_timestamp())
+    last_error = Column(Text, nullable=True)
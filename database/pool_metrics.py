@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List
+from aiohttp import web
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+
+class PoolMetrics:
+    """Счетчики выдачи соединений из пула и гистограмма времени ожидания"""
+
+    # Границы корзин гистограммы ожидания, секунды
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.bucket_counts: List[int] = [0] * (len(self.BUCKETS) + 1)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            self.bucket_counts[bisect_left(self.BUCKETS, seconds)] += 1
+
+
+class _MeteredPoolMixin:
+    """Замеряет, сколько времени занимает получение соединения из пула"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.metrics.observe(time.perf_counter() - started, timed_out=True)
+            raise
+        self.metrics.observe(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        # engine.dispose() пересоздает пул — счетчики переносим в новый
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+class MeteredQueuePool(_MeteredPoolMixin, QueuePool):
+    pass
+
+
+class MeteredAsyncQueuePool(_MeteredPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+# Движки, чьи пулы попадают в метрики: имя -> Engine/AsyncEngine
+_engines: Dict[str, object] = {}
+
+
+def register_engine(name: str, engine) -> None:
+    _engines[name] = engine
+
+
+def _metered_pools():
+    for name, engine in _engines.items():
+        # Пул берем у движка при каждом чтении: после dispose() это новый объект
+        pool = engine.pool
+        if isinstance(pool, _MeteredPoolMixin):
+            yield name, pool
+
+
+def format_pool_metrics() -> str:
+    """Состояние пулов одной строкой для лога"""
+    lines = []
+    for name, pool in _metered_pools():
+        m = pool.metrics
+        requests = m.checkouts + m.timeouts
+        average_ms = m.wait_seconds / requests * 1000 if requests else 0.0
+        lines.append(
+            f"{name}: занято {pool.checkedout()}/{pool.size()}, "
+            f"переполнение {max(0, pool.overflow())}/{pool._max_overflow}, "
+            f"выдач {m.checkouts}, таймаутов {m.timeouts}, "
+            f"ожидание среднее {average_ms:.1f}мс, макс {m.max_wait_seconds * 1000:.1f}мс"
+        )
+    return "; ".join(lines) or "нет пулов с метриками"
+
+
+def render_pool_metrics() -> str:
+    """Метрики пулов в текстовом формате Prometheus: каждое семейство — одной группой по всем движкам"""
+    pools = [(f'engine="{name}"', pool) for name, pool in _metered_pools()]
+    out = []
+
+    def family(metric: str, kind: str, help_text: str, samples):
+        out.append(f"# HELP {metric} {help_text}")
+        out.append(f"# TYPE {metric} {kind}")
+        out.extend(samples)
+
+    family("db_pool_size", "gauge", "Configured pool size.",
+           [f"db_pool_size{{{label}}} {pool.size()}" for label, pool in pools])
+    family("db_pool_checked_out", "gauge", "Connections currently checked out.",
+           [f"db_pool_checked_out{{{label}}} {pool.checkedout()}" for label, pool in pools])
+    family("db_pool_overflow", "gauge", "Overflow connections currently open.",
+           [f"db_pool_overflow{{{label}}} {max(0, pool.overflow())}" for label, pool in pools])
+    family("db_pool_timeouts_total", "counter", "Checkouts that failed with a pool timeout.",
+           [f"db_pool_timeouts_total{{{label}}} {pool.metrics.timeouts}" for label, pool in pools])
+
+    histogram = []
+    for label, pool in pools:
+        m = pool.metrics
+        cumulative = 0
+        for bound, count in zip(PoolMetrics.BUCKETS + (float("inf"),), m.bucket_counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            histogram.append(f'db_pool_wait_seconds_bucket{{{label},le="{le}"}} {cumulative}')
+        histogram.append(f"db_pool_wait_seconds_sum{{{label}}} {m.wait_seconds}")
+        histogram.append(f"db_pool_wait_seconds_count{{{label}}} {cumulative}")
+    family("db_pool_wait_seconds", "histogram", "Time spent acquiring a connection from the pool.", histogram)
+    return "\n".join(out) + "\n"
+
+
+async def log_pool_metrics(interval: float):
+    """Периодически пишет состояние пулов в лог"""
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"Пул БД: {format_pool_metrics()}")
+
+
+async def start_metrics_server(host: str, port: int):
+    """Поднимает HTTP-эндпоинт /metrics для локального сбора метрик. Возвращает runner для остановки"""
+    async def metrics(request):
+        return web.Response(text=render_pool_metrics(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
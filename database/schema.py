@@ -0,0 +1,31 @@
+import os
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from database.connection import engine
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini")
+
+
+def get_alembic_config() -> Config:
+    config = Config(ALEMBIC_INI)
+    # Логирование настраивает само приложение
+    config.attributes["configure_logger"] = False
+    return config
+
+
+def upgrade_database(revision: str = "head") -> None:
+    """Применяет миграции Alembic (то же, что alembic upgrade head)"""
+    config = get_alembic_config()
+    with engine.begin() as connection:
+        config.attributes["connection"] = connection
+        command.upgrade(config, revision)
+
+
+def schema_is_current() -> bool:
+    """Проверяет, что БД на последней миграции. Один запрос к alembic_version, без DDL"""
+    heads = set(ScriptDirectory.from_config(get_alembic_config()).get_heads())
+    with engine.connect() as connection:
+        current = set(MigrationContext.configure(connection).get_current_heads())
+    return current == heads
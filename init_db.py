@@ -1,13 +1,14 @@
 from database.connection import SessionLocal, engine
-from database.models import Base, Role, RequestStatus, Status, Object, Tool, ToolName
+from database.schema import upgrade_database
+from database.models import Role, RequestStatus, Status, Object, Tool, ToolName
 from sqlalchemy.orm import Session
 import random
 from sqlalchemy import text
 
 def init_database():
     """Initialize database with basic data"""
-    # Create tables
-    Base.metadata.create_all(bind=engine)
+    # Create tables: схема создается и обновляется миграциями Alembic
+    upgrade_database()
     
     db = SessionLocal()
     try:
@@ -159,10 +160,6 @@ def test_database_connection():
             result = connection.execute(text("SELECT 1"))
             print("✅ Database connection successful!")
             
-        # Test creating tables
-        Base.metadata.create_all(bind=engine)
-        print("✅ Tables created successfully!")
-        
         # Test session
         db = SessionLocal()
         try:
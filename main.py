@@ -1,13 +1,34 @@
 import asyncio
 import logging
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Tuple
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommand, BotCommandScopeDefault
-from config import BOT_TOKEN
+from config import (
+    BOT_TOKEN, TELEGRAM_API_URL, DB_POOL_METRICS_INTERVAL, DB_METRICS_HOST, DB_METRICS_PORT, DECODE_WORKERS,
+    NOTIFY_GLOBAL_RATE, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_WORKERS, WEBHOOK_CONCURRENCY, WEBHOOK_QUEUE_SIZE
+)
 from bot.worker_handlers import router as worker_router
 from bot.foreman_handlers import router as foreman_router
-from database.connection import engine
-from database.models import Base
+from bot.middlewares import DbSessionMiddleware, UserMiddleware
+from bot.webhook import (
+    ChatLanes, WorkerPool, consume_queue, ignore_stop_signals, publish_to_queues, start_webhook_server,
+    wait_for_stop_signal
+)
+from database.connection import async_engine, AsyncSessionLocal
+from database.schema import schema_is_current
+from database.pool_metrics import format_pool_metrics, log_pool_metrics, start_metrics_server
+from services.qr_service import QRCodeService
+from services.decode_cache import get_decode_cache
+from services.user_cache import get_user_cache, set_invalidation_publisher
+from services.notification_service import NotificationDispatcher
+from services.lookup_service import LookupService
+from services.object_service import ObjectService
 
 # Configure logging
 logging.basicConfig(
@@ -19,23 +40,59 @@ logger = logging.getLogger(__name__)
 # Global bot instance
 bot = None
 
-async def main():
-    """Main function to start the bot"""
-    global bot
-    
-    # Create tables if they don't exist
+
+def check_schema() -> bool:
+    # Схема ведется миграциями Alembic, при запуске только проверяем версию
     try:
-        Base.metadata.create_all(bind=engine)
-        logger.info("Database tables created successfully")
+        if not schema_is_current():
+            logger.error("Database schema is out of date, run: python init_db.py (or alembic upgrade head)")
+            return False
     except Exception as e:
-        logger.error(f"Error creating database tables: {e}")
-        return
+        logger.error(f"Error checking database schema: {e}")
+        return False
+    return True
 
-    # Initialize bot and dispatcher
-    bot = Bot(token=BOT_TOKEN)
+
+async def load_directories() -> bool:
+    # Справочники ролей и статусов загружаются один раз, справочник объектов — заранее
+    try:
+        async with AsyncSessionLocal() as db:
+            await LookupService.load(db)
+            # Роли бригадиров могли поменять в обход бота, пока он был остановлен
+            repaired = await ObjectService.repair_foremen(db)
+            await db.commit()
+            if repaired:
+                logger.warning(f"Object foremen repaired from user roles: {repaired}")
+            await ObjectService.load(db)
+    except Exception as e:
+        logger.error(f"Error loading lookup tables: {e}")
+        return False
+    return True
+
+
+def create_bot() -> Bot:
+    if TELEGRAM_API_URL:
+        return Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+    return Bot(token=BOT_TOKEN)
+
+
+def create_dispatcher() -> Dispatcher:
     storage = MemoryStorage()
     dp = Dispatcher(storage=storage)
 
+    # Одна сессия БД на апдейт для всех обработчиков
+    dp.update.outer_middleware(DbSessionMiddleware())
+    # Пользователь бота из кэша для обработчиков с параметром user
+    dp.message.middleware(UserMiddleware())
+    dp.callback_query.middleware(UserMiddleware())
+
+    # Include routers
+    dp.include_router(worker_router)
+    dp.include_router(foreman_router)
+    return dp
+
+
+async def set_bot_commands(bot: Bot):
     # Set bot commands menu
     await bot.set_my_commands(
         commands=[
@@ -45,21 +102,172 @@ async def main():
         scope=BotCommandScopeDefault()
     )
 
-    # Include routers
-    dp.include_router(worker_router)
-    dp.include_router(foreman_router)
 
-    # Start polling
-    logger.info("Starting bot...")
+@asynccontextmanager
+async def bot_runtime(index: int = 0, workers: int = 1) -> AsyncIterator[Tuple[Bot, Dispatcher]]:
+    """Бот, диспетчер и фоновые службы одного процесса, обрабатывающего апдейты.
+
+    При нескольких процессах (index из workers) ядра для декодирования QR и общий
+    лимит уведомлений делятся между ними, а порт /metrics у каждого свой: DB_METRICS_PORT + index.
+    """
+    global bot
+
+    # Start warm QR decoding worker pool
+    QRCodeService.start_decode_pool(max(1, (DECODE_WORKERS or os.cpu_count() or 1) // workers))
+    # Кэш декодирования открывается и чистится до приема апдейтов, а не в первом обработчике
+    get_decode_cache()
+
+    # Initialize bot and dispatcher
+    bot = create_bot()
+    dp = create_dispatcher()
+
+    # Метрики пула соединений: в лог и, если задан порт, на локальный /metrics
+    metrics_task = None
+    if DB_POOL_METRICS_INTERVAL > 0:
+        metrics_task = asyncio.create_task(log_pool_metrics(DB_POOL_METRICS_INTERVAL))
+    metrics_runner = None
+    if DB_METRICS_PORT:
+        metrics_port = DB_METRICS_PORT + index
+        metrics_runner = await start_metrics_server(DB_METRICS_HOST, metrics_port)
+        logger.info(f"Pool metrics served on http://{DB_METRICS_HOST}:{metrics_port}/metrics")
+
+    # Уведомления из очереди notification_outbox отправляются в фоне с лимитами Telegram
+    notification_dispatcher = NotificationDispatcher(bot, global_rate=NOTIFY_GLOBAL_RATE / workers)
+    notification_task = asyncio.create_task(notification_dispatcher.run())
+
     try:
-        await dp.start_polling(bot)
-    except KeyboardInterrupt:
-        logger.info("Bot stopped by user")
-    except Exception as e:
-        logger.error(f"Error starting bot: {e}")
+        yield bot, dp
     finally:
+        notification_task.cancel()
+        logger.info(
+            f"Notifications: sent {notification_dispatcher.sent}, failed {notification_dispatcher.failed}, "
+            f"queued in memory {len(notification_dispatcher.queue)}"
+        )
         await bot.session.close()
+        if metrics_task:
+            metrics_task.cancel()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        logger.info(f"Database pool: {format_pool_metrics()}")
+        logger.info(f"User cache: {get_user_cache().stats}")
+        await async_engine.dispose()
+        QRCodeService.shutdown_decode_pool()
+        logger.info(f"Decode cache: {get_decode_cache().stats}")
+        get_decode_cache().close()
+
+
+async def register_webhook(bot: Bot, dp: Dispatcher):
+    if not WEBHOOK_URL:
+        logger.warning("WEBHOOK_URL is not set, webhook is not registered in Telegram")
+        return
+    await bot.set_webhook(
+        WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logger.info(f"Webhook registered: {WEBHOOK_URL + WEBHOOK_PATH}")
+
+
+def apply_invalidation(kind: str, key: Optional[int]):
+    """Сброс кэша, пришедший от другого процесса-обработчика"""
+    if kind == "user":
+        get_user_cache().invalidate(key)
+    elif kind == "objects":
+        ObjectService.invalidate()
+
+
+async def run_polling():
+    if not check_schema() or not await load_directories():
+        return
+    async with bot_runtime() as (bot, dp):
+        await set_bot_commands(bot)
+        # Webhook, оставшийся от запуска в режиме webhook, мешает getUpdates
+        await bot.delete_webhook()
+
+        # Start polling
+        logger.info("Starting bot...")
+        try:
+            await dp.start_polling(bot)
+        except KeyboardInterrupt:
+            logger.info("Bot stopped by user")
+        except Exception as e:
+            logger.error(f"Error starting bot: {e}")
+
+
+async def run_webhook():
+    """Webhook в одном процессе: апдейты обрабатываются здесь же, по порядку внутри чата"""
+    if not check_schema() or not await load_directories():
+        return
+    async with bot_runtime() as (bot, dp):
+        await set_bot_commands(bot)
+        lanes = ChatLanes(lambda update: dp.feed_raw_update(bot, update), WEBHOOK_CONCURRENCY, WEBHOOK_QUEUE_SIZE)
+        runner = await start_webhook_server(lanes.submit, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET)
+        logger.info(f"Webhook server listening on http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        try:
+            await register_webhook(bot, dp)
+            await wait_for_stop_signal(asyncio.Event())
+        finally:
+            await runner.cleanup()
+            await lanes.join()
+            logger.info(f"Updates: processed {lanes.processed}, failed {lanes.errors}")
+
+
+async def run_webhook_workers():
+    """Webhook с несколькими процессами: этот процесс только принимает апдейты и раздает их по чатам"""
+    if not check_schema():
+        return
+    front_bot = create_bot()
+    pool = WorkerPool(run_worker_process, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE)
+    pool.start()
+    runner = None
+    try:
+        runner = await start_webhook_server(pool.submit, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET)
+        logger.info(
+            f"Webhook server listening on http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}, "
+            f"{WEBHOOK_WORKERS} worker processes"
+        )
+        await set_bot_commands(front_bot)
+        await register_webhook(front_bot, create_dispatcher())
+        stop = asyncio.Event()
+        watch_task = asyncio.create_task(pool.watch(stop))
+        await wait_for_stop_signal(stop)
+        watch_task.cancel()
+    except Exception as e:
+        logger.error(f"Error starting webhook server: {e}")
+    finally:
+        if runner:
+            await runner.cleanup()
+        await asyncio.get_running_loop().run_in_executor(None, pool.stop)
+        await front_bot.session.close()
+
+
+async def run_worker(index: int, queues):
+    if not await load_directories():
+        return
+    # Сбросы кэшей после commit в этом процессе передаются остальным обработчикам
+    set_invalidation_publisher(publish_to_queues(queues, index))
+    async with bot_runtime(index, len(queues)) as (bot, dp):
+        lanes = ChatLanes(lambda update: dp.feed_raw_update(bot, update), WEBHOOK_CONCURRENCY, WEBHOOK_QUEUE_SIZE)
+        logger.info(f"Worker {index} started")
+        await consume_queue(queues[index], lanes, apply_invalidation)
+        logger.info(f"Worker {index}: processed {lanes.processed}, failed {lanes.errors}")
+
+
+def run_worker_process(index: int, queues):
+    """Точка входа процесса-обработчика (запускается через spawn)"""
+    ignore_stop_signals()
+    asyncio.run(run_worker(index, queues))
+
+
+async def main():
+    """Main function to start the bot"""
+    if BOT_MODE == "webhook" and WEBHOOK_WORKERS > 1:
+        await run_webhook_workers()
+    elif BOT_MODE == "webhook":
+        await run_webhook()
+    else:
+        await run_polling()
 
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,154 @@
+"""Исходная схема: таблицы бота на момент перехода на миграции
+
+Базы, созданные раньше через Base.metadata.create_all, тоже доводятся до этой
+схемы: существующие таблицы пропускаются, недостающие колонка tool_on_check.found
+и индекс inventory_checks(object_id, date) добавляются.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _lookup_table(name: str) -> None:
+    op.create_table(
+        name,
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("name"),
+    )
+    op.create_index(f"ix_{name}_id", name, ["id"])
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    existing = set(inspector.get_table_names())
+
+    for name in ("roles", "tool_name", "request_status", "status"):
+        if name not in existing:
+            _lookup_table(name)
+
+    # object и user ссылаются друг на друга: внешний ключ object.foreman_id добавляется после user
+    if "object" not in existing:
+        op.create_table(
+            "object",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("name", sa.Text(), nullable=False),
+            sa.Column("location", sa.Text(), nullable=True),
+            sa.Column("foreman_id", sa.Integer(), nullable=True),
+            sa.PrimaryKeyConstraint("id"),
+            sa.UniqueConstraint("name"),
+        )
+        op.create_index("ix_object_id", "object", ["id"])
+
+    if "user" not in existing:
+        op.create_table(
+            "user",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("username", sa.String(length=255), nullable=False),
+            sa.Column("chat_id", sa.BigInteger(), nullable=True),
+            sa.Column("name", sa.Text(), nullable=True),
+            sa.Column("role_id", sa.Integer(), nullable=False),
+            sa.Column("object_id", sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(["object_id"], ["object.id"]),
+            sa.ForeignKeyConstraint(["role_id"], ["roles.id"]),
+            sa.PrimaryKeyConstraint("id"),
+            sa.UniqueConstraint("username"),
+        )
+        op.create_index("ix_user_id", "user", ["id"])
+
+    if "object" not in existing:
+        with op.batch_alter_table("object") as batch_op:
+            batch_op.create_foreign_key("object_foreman_id_fkey", "user", ["foreman_id"], ["id"])
+
+    if "tools" not in existing:
+        op.create_table(
+            "tools",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("inventory_number", sa.Text(), nullable=False),
+            sa.Column("name_id", sa.Integer(), nullable=False),
+            sa.Column("qr_code_value", sa.Text(), nullable=False),
+            sa.Column("current_object_id", sa.Integer(), nullable=True),
+            sa.Column("status_id", sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(["current_object_id"], ["object.id"]),
+            sa.ForeignKeyConstraint(["name_id"], ["tool_name.id"]),
+            sa.ForeignKeyConstraint(["status_id"], ["status.id"]),
+            sa.PrimaryKeyConstraint("id"),
+            sa.UniqueConstraint("inventory_number"),
+            sa.UniqueConstraint("qr_code_value"),
+        )
+        op.create_index("ix_tools_id", "tools", ["id"])
+
+    if "inventory_checks" not in existing:
+        op.create_table(
+            "inventory_checks",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("date", sa.DateTime(), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=False),
+            sa.Column("object_id", sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(["object_id"], ["object.id"]),
+            sa.ForeignKeyConstraint(["user_id"], ["user.id"]),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_inventory_checks_id", "inventory_checks", ["id"])
+    existing_indexes = {index["name"] for index in sa.inspect(op.get_bind()).get_indexes("inventory_checks")}
+    if "ix_inventory_checks_object_id_date" not in existing_indexes:
+        op.create_index("ix_inventory_checks_object_id_date", "inventory_checks", ["object_id", "date"])
+
+    if "tool_on_check" not in existing:
+        op.create_table(
+            "tool_on_check",
+            sa.Column("check_id", sa.Integer(), nullable=False),
+            sa.Column("tool_id", sa.Integer(), nullable=False),
+            sa.Column("found", sa.Boolean(), server_default=sa.true(), nullable=False),
+            sa.ForeignKeyConstraint(["check_id"], ["inventory_checks.id"]),
+            sa.ForeignKeyConstraint(["tool_id"], ["tools.id"]),
+            sa.PrimaryKeyConstraint("check_id", "tool_id"),
+        )
+    elif "found" not in {column["name"] for column in inspector.get_columns("tool_on_check")}:
+        op.add_column("tool_on_check", sa.Column("found", sa.Boolean(), server_default=sa.true(), nullable=False))
+
+    if "tool_request" not in existing:
+        op.create_table(
+            "tool_request",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("tool_id", sa.Integer(), nullable=False),
+            sa.Column("from_object_id", sa.Integer(), nullable=True),
+            sa.Column("to_object_id", sa.Integer(), nullable=True),
+            sa.Column("requester_id", sa.Integer(), nullable=False),
+            sa.Column("approver_id", sa.Integer(), nullable=True),
+            sa.Column("status_id", sa.Integer(), nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(["approver_id"], ["user.id"]),
+            sa.ForeignKeyConstraint(["from_object_id"], ["object.id"]),
+            sa.ForeignKeyConstraint(["requester_id"], ["user.id"]),
+            sa.ForeignKeyConstraint(["status_id"], ["request_status.id"]),
+            sa.ForeignKeyConstraint(["to_object_id"], ["object.id"]),
+            sa.ForeignKeyConstraint(["tool_id"], ["tools.id"]),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_tool_request_id", "tool_request", ["id"])
+
+
+def downgrade() -> None:
+    op.drop_table("tool_request")
+    op.drop_table("tool_on_check")
+    op.drop_table("inventory_checks")
+    op.drop_table("tools")
+    with op.batch_alter_table("object") as batch_op:
+        batch_op.drop_constraint("object_foreman_id_fkey", type_="foreignkey")
+    op.drop_table("user")
+    op.drop_table("object")
+    for name in ("status", "request_status", "tool_name", "roles"):
+        op.drop_table(name)
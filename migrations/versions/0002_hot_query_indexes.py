@@ -0,0 +1,31 @@
+"""Составные индексы для частых фильтров
+
+tools(current_object_id, status_id) — доступные инструменты объекта-донора,
+tool_request(from_object_id, status_id) — заявки на инструменты бригадира,
+user(object_id, role_id) — регистрации, рабочие и бригадир объекта.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_tools_current_object_id_status_id", "tools", ["current_object_id", "status_id"])
+    op.create_index("ix_tool_request_from_object_id_status_id", "tool_request", ["from_object_id", "status_id"])
+    op.create_index("ix_user_object_id_role_id", "user", ["object_id", "role_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_user_object_id_role_id", table_name="user")
+    op.drop_index("ix_tool_request_from_object_id_status_id", table_name="tool_request")
+    op.drop_index("ix_tools_current_object_id_status_id", table_name="tools")
@@ -0,0 +1,38 @@
+"""Заполнение object.foreman_id по ролям пользователей
+
+С этой ревизии object.foreman_id — основная ссылка на бригадира объекта, бот
+поддерживает ее при смене ролей и объектов. Для уже существующих данных бригадиром
+объекта становится пользователь с ролью "прораб объекта" и наименьшим id.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ROLE_FOREMAN = "прораб объекта"
+
+
+def upgrade() -> None:
+    op.execute(
+        sa.text(
+            'UPDATE object SET foreman_id = ('
+            ' SELECT MIN(u.id) FROM "user" u JOIN roles r ON r.id = u.role_id'
+            ' WHERE u.object_id = object.id AND r.name = :role'
+            ')'
+        ).bindparams(role=ROLE_FOREMAN)
+    )
+
+
+def downgrade() -> None:
+    # Колонка была и до этой ревизии; заполненные значения ничему не мешают
+    pass
@@ -0,0 +1,23 @@
+"""Индекс tools(current_object_id, id) для постраничного просмотра инструментов объекта
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_tools_current_object_id_id", "tools", ["current_object_id", "id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_tools_current_object_id_id", table_name="tools")
@@ -0,0 +1,28 @@
+"""Индекс tools(current_object_id, status_id, name_id, id) для выбора инструмента у объекта-донора
+
+Покрывает и GROUP BY name_id по доступным инструментам объекта, и постраничный
+просмотр экземпляров одного названия.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_tools_object_status_name_id", "tools", ["current_object_id", "status_id", "name_id", "id"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_tools_object_status_name_id", table_name="tools")
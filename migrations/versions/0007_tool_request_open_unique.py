@@ -0,0 +1,51 @@
+"""Одна открытая заявка на инструмент для объекта: tool_request.resolved_at и частичный уникальный индекс
+
+Статусы заявок — строки справочника, их id зависят от данных, поэтому открытость заявки
+хранит сама строка: resolved_at заполняется при одобрении или отклонении. Уже закрытым
+заявкам проставляется время создания, открытые дубликаты (повторные нажатия "Запросить")
+удаляются, остается самая ранняя заявка.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+REQUEST_DONE = "Выполнено"
+
+
+def upgrade() -> None:
+    op.add_column("tool_request", sa.Column("resolved_at", sa.DateTime(), nullable=True))
+    op.execute(
+        sa.text(
+            "UPDATE tool_request SET resolved_at = created_at"
+            " WHERE status_id IN (SELECT id FROM request_status WHERE name = :done)"
+        ).bindparams(done=REQUEST_DONE)
+    )
+    op.execute(
+        "DELETE FROM tool_request WHERE resolved_at IS NULL AND EXISTS ("
+        " SELECT 1 FROM tool_request earlier"
+        " WHERE earlier.resolved_at IS NULL AND earlier.tool_id = tool_request.tool_id"
+        " AND earlier.to_object_id = tool_request.to_object_id AND earlier.id < tool_request.id"
+        ")"
+    )
+    op.create_index(
+        "uq_tool_request_open_tool_id_to_object_id", "tool_request", ["tool_id", "to_object_id"],
+        unique=True,
+        postgresql_where=sa.text("resolved_at IS NULL"),
+        sqlite_where=sa.text("resolved_at IS NULL"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("uq_tool_request_open_tool_id_to_object_id", table_name="tool_request")
+    op.drop_column("tool_request", "resolved_at")
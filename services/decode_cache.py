@@ -0,0 +1,242 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from config import (
+    DECODE_CACHE_PATH,
+    DECODE_CACHE_MEMORY_SIZE,
+    DECODE_CACHE_MAX_ENTRIES,
+    DECODE_CACHE_MAX_AGE_DAYS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DecodeCacheStats:
+    """Счётчики кэша результатов декодирования"""
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    bytes_saved: int = 0          # не скачано благодаря кэшу
+    decode_seconds_saved: float = 0.0
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    def __str__(self) -> str:
+        return (
+            f"попаданий: {self.hits} (память: {self.memory_hits}, диск: {self.disk_hits}), "
+            f"промахов: {self.misses}, сэкономлено: {self.bytes_saved / 1024 / 1024:.1f} МБ, "
+            f"{self.decode_seconds_saved:.1f}с декодирования"
+        )
+
+
+@dataclass
+class _Entry:
+    qr_codes: List[str]
+    size: int
+    decode_seconds: float
+    version: int
+
+
+class DecodeCache:
+    """Кэш распознанных QR-кодов по file_unique_id: LRU в памяти и SQLite на диске.
+
+    Каждая запись помнит версию детектора, которым получена; записи другой версии
+    считаются промахом, чтобы улучшенный детектор перепроверил старые фото.
+
+    Файл SQLite открыт в режиме WAL: его делят процессы-обработчики webhook-режима.
+    Ошибки диска (например, "database is locked") не прерывают инвентаризацию: чтение
+    считается промахом, и фото скачивается заново, запись просто пропускается.
+    """
+
+    # Очистка диска по возрасту и размеру выполняется раз в столько записей
+    EVICT_EVERY = 100
+
+    def __init__(self, path: Optional[str], memory_size: int, max_entries: int, max_age_seconds: float):
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.stats = DecodeCacheStats()
+        self._memory: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            try:
+                self._open(path)
+            except sqlite3.Error as e:
+                logger.error(f"Кэш декодирования {path} недоступен, работаем только в памяти: {e}")
+                self.close()
+            else:
+                self.evict()
+
+    def get(self, file_unique_id: str, version: int) -> Optional[List[str]]:
+        """Возвращает QR-коды фото или None, если фото ещё не декодировалось детектором версии version"""
+        with self._lock:
+            entry = self._memory.get(file_unique_id)
+            if entry is not None and entry.version == version:
+                self._memory.move_to_end(file_unique_id)
+                self.stats.memory_hits += 1
+            else:
+                try:
+                    entry = self._get_from_disk(file_unique_id, version)
+                except sqlite3.Error as e:
+                    logger.warning(f"Ошибка чтения кэша декодирования: {e}")
+                    self._db.rollback()
+                    entry = None
+                if entry is None:
+                    self.stats.misses += 1
+                    return None
+                self.stats.disk_hits += 1
+                self._remember(file_unique_id, entry)
+
+            self.stats.bytes_saved += entry.size
+            self.stats.decode_seconds_saved += entry.decode_seconds
+            return list(entry.qr_codes)
+
+    def put(
+        self,
+        file_unique_id: str,
+        qr_codes: List[str],
+        version: int,
+        size: int = 0,
+        decode_seconds: float = 0.0
+    ):
+        """Сохраняет результат декодирования фото детектором версии version"""
+        entry = _Entry(list(qr_codes), size, decode_seconds, version)
+        with self._lock:
+            self._remember(file_unique_id, entry)
+            if self._db is None:
+                return
+            now = time.time()
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO decode_cache "
+                    "(file_unique_id, qr_codes, size, decode_seconds, detector_version, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (file_unique_id, json.dumps(entry.qr_codes), size, decode_seconds, version, now, now)
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка записи в кэш декодирования: {e}")
+                self._db.rollback()
+                return
+            self._puts += 1
+        if self._puts % self.EVICT_EVERY == 0:
+            self.evict()
+
+    async def get_async(self, file_unique_id: str, version: int) -> Optional[List[str]]:
+        """get в потоке по умолчанию: чтение SQLite не блокирует event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get, file_unique_id, version)
+
+    async def put_async(
+        self,
+        file_unique_id: str,
+        qr_codes: List[str],
+        version: int,
+        size: int = 0,
+        decode_seconds: float = 0.0
+    ):
+        """put в потоке по умолчанию: запись и commit SQLite не блокируют event loop"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.put, file_unique_id, qr_codes, version, size, decode_seconds)
+
+    def evict(self) -> Tuple[int, int]:
+        """Удаляет с диска устаревшие записи и самые давно использованные сверх лимита"""
+        if self._db is None:
+            return 0, 0
+        with self._lock:
+            try:
+                expired = self._db.execute(
+                    "DELETE FROM decode_cache WHERE created_at < ?",
+                    (time.time() - self.max_age_seconds,)
+                ).rowcount
+                overflow = self._db.execute(
+                    "DELETE FROM decode_cache WHERE file_unique_id IN ("
+                    "SELECT file_unique_id FROM decode_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                ).rowcount
+                self._db.commit()
+            except sqlite3.Error as e:
+                # Очистка повторится через EVICT_EVERY записей
+                logger.warning(f"Ошибка очистки кэша декодирования: {e}")
+                self._db.rollback()
+                return 0, 0
+        return expired, overflow
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _open(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # WAL: читатели не ждут писателя, а запись не блокирует другие процессы на время чтения
+        self._db.execute("PRAGMA journal_mode=WAL")
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(decode_cache)")}
+        if columns and "detector_version" not in columns:
+            # Кэш прежнего формата без версии детектора проще собрать заново
+            self._db.execute("DROP TABLE decode_cache")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS decode_cache ("
+            "file_unique_id TEXT PRIMARY KEY, "
+            "qr_codes TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "decode_seconds REAL NOT NULL, "
+            "detector_version INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS ix_decode_cache_accessed_at ON decode_cache (accessed_at)")
+        self._db.commit()
+
+    def _remember(self, file_unique_id: str, entry: _Entry):
+        self._memory[file_unique_id] = entry
+        self._memory.move_to_end(file_unique_id)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _get_from_disk(self, file_unique_id: str, version: int) -> Optional[_Entry]:
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT qr_codes, size, decode_seconds, created_at FROM decode_cache "
+            "WHERE file_unique_id = ? AND detector_version = ?",
+            (file_unique_id, version)
+        ).fetchone()
+        if row is None:
+            return None
+        qr_codes, size, decode_seconds, created_at = row
+        if created_at < time.time() - self.max_age_seconds:
+            return None
+        self._db.execute(
+            "UPDATE decode_cache SET accessed_at = ? WHERE file_unique_id = ?",
+            (time.time(), file_unique_id)
+        )
+        self._db.commit()
+        return _Entry(json.loads(qr_codes), size, decode_seconds, version)
+
+
+_decode_cache: Optional[DecodeCache] = None
+
+
+def get_decode_cache() -> DecodeCache:
+    """Возвращает общий кэш, открывая его при первом обращении"""
+    global _decode_cache
+    if _decode_cache is None:
+        _decode_cache = DecodeCache(
+            path=DECODE_CACHE_PATH or None,
+            memory_size=DECODE_CACHE_MEMORY_SIZE,
+            max_entries=DECODE_CACHE_MAX_ENTRIES,
+            max_age_seconds=DECODE_CACHE_MAX_AGE_DAYS * 24 * 60 * 60,
+        )
+    return _decode_cache
@@ -1,69 +1,84 @@
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 from database.models import InventoryCheck, ToolOnCheck, User, Object
-from database.connection import SessionLocal
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from datetime import datetime
+from config import BULK_COPY_THRESHOLD
 
 class InventoryCheckService:
     @staticmethod
-    def get_check_by_id(check_id: int) -> Optional[InventoryCheck]:
-        db = SessionLocal()
-        try:
-            return db.query(InventoryCheck).options(joinedload(InventoryCheck.user), joinedload(InventoryCheck.object), joinedload(InventoryCheck.tool_on_checks)).filter(InventoryCheck.id == check_id).first()
-        finally:
-            db.close()
+    async def get_check_by_id(db: AsyncSession, check_id: int) -> Optional[InventoryCheck]:
+        result = await db.execute(
+            select(InventoryCheck).options(joinedload(InventoryCheck.user), joinedload(InventoryCheck.object), joinedload(InventoryCheck.tool_on_checks)).filter(InventoryCheck.id == check_id)
+        )
+        return result.unique().scalars().first()
 
     @staticmethod
-    def get_all_checks() -> List[InventoryCheck]:
-        db = SessionLocal()
-        try:
-            return db.query(InventoryCheck).options(joinedload(InventoryCheck.user), joinedload(InventoryCheck.object)).all()
-        finally:
-            db.close()
+    async def get_all_checks(db: AsyncSession) -> List[InventoryCheck]:
+        result = await db.execute(
+            select(InventoryCheck).options(joinedload(InventoryCheck.user), joinedload(InventoryCheck.object))
+        )
+        return list(result.scalars().all())
 
     @staticmethod
-    def create_check(user_id: int, object_id: int, date: Optional[datetime] = None, tool_ids: Optional[List[int]] = None) -> InventoryCheck:
-        db = SessionLocal()
-        try:
-            check = InventoryCheck(user_id=user_id, object_id=object_id, date=date or datetime.utcnow())
-            db.add(check)
-            db.commit()
-            db.refresh(check)
-            # Add tools to check if provided
-            if tool_ids:
-                for tool_id in tool_ids:
-                    toc = ToolOnCheck(check_id=check.id, tool_id=tool_id)
-                    db.add(toc)
-                db.commit()
-            return check
-        finally:
-            db.close()
+    async def create_check(
+        db: AsyncSession,
+        user_id: int,
+        object_id: int,
+        date: Optional[datetime] = None,
+        tool_ids: Optional[List[int]] = None,
+        missing_tool_ids: Optional[List[int]] = None
+    ) -> InventoryCheck:
+        """Создает запись об инвентаризации вместе с результатами по каждому инструменту.
+
+        tool_ids — найденные инструменты, missing_tool_ids — не найденные. Проверка и ее
+        результаты пишутся в транзакцию переданной сессии.
+        """
+        check = InventoryCheck(user_id=user_id, object_id=object_id, date=date or datetime.utcnow())
+        db.add(check)
+        # Получаем id проверки без коммита
+        await db.flush()
+        rows = [(check.id, tool_id, True) for tool_id in tool_ids or []]
+        rows += [(check.id, tool_id, False) for tool_id in missing_tool_ids or []]
+        if rows:
+            await InventoryCheckService._insert_results(db, rows)
+        return check
+
+    @staticmethod
+    async def _insert_results(db: AsyncSession, rows: List[Tuple[int, int, bool]]) -> None:
+        """Массово вставляет строки tool_on_check (check_id, tool_id, found) в текущей транзакции"""
+        if db.get_bind().dialect.name == "postgresql" and len(rows) >= BULK_COPY_THRESHOLD:
+            # COPY через соединение asyncpg этой же сессии, чтобы остаться в той же транзакции
+            connection = await db.connection()
+            raw_connection = await connection.get_raw_connection()
+            await raw_connection.driver_connection.copy_records_to_table(
+                "tool_on_check", records=rows, columns=["check_id", "tool_id", "found"]
+            )
+            return
+
+        # executemany: SQLAlchemy отправляет строки пачками многострочных INSERT
+        await db.execute(
+            insert(ToolOnCheck),
+            [{"check_id": check_id, "tool_id": tool_id, "found": found} for check_id, tool_id, found in rows]
+        )
 
     @staticmethod
-    def update_check(check_id: int, **kwargs) -> Optional[InventoryCheck]:
-        db = SessionLocal()
-        try:
-            check = db.query(InventoryCheck).filter(InventoryCheck.id == check_id).first()
-            if not check:
-                return None
-            for key, value in kwargs.items():
-                if hasattr(check, key):
-                    setattr(check, key, value)
-            db.commit()
-            db.refresh(check)
-            return check
-        finally:
-            db.close()
+    async def update_check(db: AsyncSession, check_id: int, **kwargs) -> Optional[InventoryCheck]:
+        check = await db.get(InventoryCheck, check_id)
+        if not check:
+            return None
+        for key, value in kwargs.items():
+            if hasattr(check, key):
+                setattr(check, key, value)
+        await db.flush()
+        return check
 
     @staticmethod
-    def delete_check(check_id: int) -> bool:
-        db = SessionLocal()
-        try:
-            check = db.query(InventoryCheck).filter(InventoryCheck.id == check_id).first()
-            if not check:
-                return False
-            db.delete(check)
-            db.commit()
-            return True
-        finally:
-            db.close() 
\ No newline at end of file
+    async def delete_check(db: AsyncSession, check_id: int) -> bool:
+        check = await db.get(InventoryCheck, check_id)
+        if not check:
+            return False
+        await db.delete(check)
+        await db.flush()
+        return True
@@ -1,7 +1,10 @@
-import xml.etree.ElementTree as ET
-from typing import List
+from tempfile import SpooledTemporaryFile
+from typing import BinaryIO, Iterable, List
+from xml.sax.saxutils import XMLGenerator
 from database.models import Tool, Object, User
+from services.qr_service import InventoryDelta
 from datetime import datetime
+from config import INVENTORY_XML_SPOOL_SIZE
 import re
 
 class InventoryReportService:
@@ -16,6 +19,80 @@ class InventoryReportService:
         
         return text
 
+    @staticmethod
+    def write_inventory_xml(
+        output: BinaryIO,
+        object_name: str,
+        user_name: str,
+        date: datetime,
+        found_tools: Iterable[Tool],
+        missing_tools: Iterable[Tool],
+        total_tools: int,
+        found_count: int,
+        missing_count: int
+    ) -> None:
+        """Пишет XML-отчет по инвентаризации в поток по одному элементу, не строя дерево в памяти"""
+        xml = XMLGenerator(output, encoding="utf-8", short_empty_elements=True)
+        xml.startDocument()
+        xml.startElement("InventoryReport", {})
+
+        # Метаданные
+        xml.startElement("Metadata", {})
+        InventoryReportService._write_element(xml, "Object", object_name)
+        InventoryReportService._write_element(xml, "User", user_name)
+        InventoryReportService._write_element(xml, "Date", date.strftime("%Y-%m-%d %H:%M:%S"))
+        InventoryReportService._write_element(xml, "TotalTools", str(total_tools))
+        InventoryReportService._write_element(xml, "FoundTools", str(found_count))
+        InventoryReportService._write_element(xml, "MissingTools", str(missing_count))
+        xml.endElement("Metadata")
+
+        # Найденные и отсутствующие инструменты
+        for section, tools, status_name in (
+            ("FoundTools", found_tools, "В наличии"),
+            ("MissingTools", missing_tools, "Утерян")
+        ):
+            xml.startElement(section, {})
+            for tool in tools:
+                xml.startElement("Tool", {})
+                InventoryReportService._write_element(xml, "InventoryNumber", str(tool.inventory_number or ""))
+                InventoryReportService._write_element(xml, "Name", str(tool.tool_name.name if tool.tool_name else ""))
+                InventoryReportService._write_element(xml, "QRCode", str(tool.qr_code_value or ""))
+                InventoryReportService._write_element(xml, "Status", status_name)
+                xml.endElement("Tool")
+            xml.endElement(section)
+
+        xml.endElement("InventoryReport")
+        xml.endDocument()
+
+    @staticmethod
+    def _write_element(xml: XMLGenerator, tag: str, text: str) -> None:
+        xml.startElement(tag, {})
+        xml.characters(text)
+        xml.endElement(tag)
+
+    @staticmethod
+    def stream_inventory_xml(
+        object_name: str,
+        user_name: str,
+        date: datetime,
+        found_tools: Iterable[Tool],
+        missing_tools: Iterable[Tool],
+        total_tools: int,
+        found_count: int,
+        missing_count: int
+    ) -> SpooledTemporaryFile:
+        """Генерирует XML-отчет в буфер, который уходит на диск только при превышении INVENTORY_XML_SPOOL_SIZE.
+
+        Буфер возвращается перемотанным в начало, закрыть его должен вызывающий код.
+        """
+        buffer = SpooledTemporaryFile(max_size=INVENTORY_XML_SPOOL_SIZE, mode="w+b")
+        InventoryReportService.write_inventory_xml(
+            buffer, object_name, user_name, date,
+            found_tools, missing_tools, total_tools, found_count, missing_count
+        )
+        buffer.seek(0)
+        return buffer
+
     @staticmethod
     def generate_inventory_xml(
         object_name: str,
@@ -25,41 +102,12 @@ class InventoryReportService:
         missing_tools: List[Tool],
         total_tools: int
     ) -> str:
-        """Генерирует XML-отчет по инвентаризации"""
-        
-        # Создаем корневой элемент
-        root = ET.Element("InventoryReport")
-        
-        # Добавляем метаданные
-        metadata = ET.SubElement(root, "Metadata")
-        ET.SubElement(metadata, "Object").text = object_name
-        ET.SubElement(metadata, "User").text = user_name
-        ET.SubElement(metadata, "Date").text = date.strftime("%Y-%m-%d %H:%M:%S")
-        ET.SubElement(metadata, "TotalTools").text = str(total_tools)
-        ET.SubElement(metadata, "FoundTools").text = str(len(found_tools))
-        ET.SubElement(metadata, "MissingTools").text = str(len(missing_tools))
-        
-        # Добавляем найденные инструменты
-        found_section = ET.SubElement(root, "FoundTools")
-        for tool in found_tools:
-            tool_elem = ET.SubElement(found_section, "Tool")
-            ET.SubElement(tool_elem, "InventoryNumber").text = str(tool.inventory_number or "")
-            ET.SubElement(tool_elem, "Name").text = str(tool.tool_name.name if tool.tool_name else "")
-            ET.SubElement(tool_elem, "QRCode").text = str(tool.qr_code_value or "")
-            ET.SubElement(tool_elem, "Status").text = "В наличии"
-        
-        # Добавляем отсутствующие инструменты
-        missing_section = ET.SubElement(root, "MissingTools")
-        for tool in missing_tools:
-            tool_elem = ET.SubElement(missing_section, "Tool")
-            ET.SubElement(tool_elem, "InventoryNumber").text = str(tool.inventory_number or "")
-            ET.SubElement(tool_elem, "Name").text = str(tool.tool_name.name if tool.tool_name else "")
-            ET.SubElement(tool_elem, "QRCode").text = str(tool.qr_code_value or "")
-            ET.SubElement(tool_elem, "Status").text = "Утерян"
-        
-        # Конвертируем в строку
-        xml_str = ET.tostring(root, encoding="utf-8", xml_declaration=True).decode("utf-8")
-        return xml_str
+        """Генерирует XML-отчет по инвентаризации строкой"""
+        with InventoryReportService.stream_inventory_xml(
+            object_name, user_name, date,
+            found_tools, missing_tools, total_tools, len(found_tools), len(missing_tools)
+        ) as buffer:
+            return buffer.read().decode("utf-8")
 
     @staticmethod
     def generate_summary_text(
@@ -91,4 +139,35 @@ class InventoryReportService:
                 inventory_number = tool.inventory_number or "Без номера"
                 summary += f"• {tool_name} (инв. №{inventory_number})\n"
         
-        return summary 
\ No newline at end of file
+        return summary 
+
+    @staticmethod
+    def generate_delta_text(
+        object_name: str,
+        delta: InventoryDelta,
+        found_count: int,
+        missing_count: int
+    ) -> str:
+        """Генерирует текст только с изменениями относительно прошлой инвентаризации"""
+        summary = f"📋 Изменения по объекту '{object_name}' с инвентаризации от {delta.previous_date.strftime('%d.%m.%Y %H:%M')}\n\n"
+        summary += f"📊 Сейчас: найдено {found_count} ✅, утеряно {missing_count} ❌\n\n"
+
+        if delta.is_empty:
+            summary += "Изменений нет."
+            return summary
+
+        for title, tools in (
+            ("❌ Утеряны с прошлой проверки:", delta.newly_lost),
+            ("🔄 Снова найдены:", delta.recovered),
+            ("🆕 Появились на объекте:", delta.arrived)
+        ):
+            if not tools:
+                continue
+            summary += f"{title}\n"
+            for tool in tools:
+                tool_name = tool.tool_name.name if tool.tool_name else "Неизвестный инструмент"
+                inventory_number = tool.inventory_number or "Без номера"
+                summary += f"• {tool_name} (инв. №{inventory_number})\n"
+            summary += "\n"
+
+        return summary.rstrip("\n")
@@ -0,0 +1,89 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from config import INVENTORY_DOWNLOAD_CONCURRENCY
+from services.qr_service import QRCodeService, InventoryTimings
+
+
+class InventorySession:
+    """Инвентаризация, фото которой скачиваются и декодируются в фоне по мере поступления"""
+
+    def __init__(self, bot, on_progress: Optional[Callable[["InventorySession"], Awaitable[None]]] = None):
+        self.bot = bot
+        self.on_progress = on_progress
+        self.timings = InventoryTimings()
+        self.qr_codes: Set[str] = set()
+        self.photo_count = 0
+        self.started = time.perf_counter()
+        self._semaphore = asyncio.Semaphore(max(1, INVENTORY_DOWNLOAD_CONCURRENCY))
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def pending_count(self) -> int:
+        """Количество фото, которые ещё обрабатываются"""
+        return sum(1 for task in self._tasks if not task.done())
+
+    def add_photo(self, file_id: str, file_unique_id: Optional[str] = None):
+        """Запускает фоновую обработку фото"""
+        self.photo_count += 1
+        self.timings.photos += 1
+        self._tasks.append(asyncio.create_task(self._process(file_id, file_unique_id)))
+
+    async def _process(self, file_id: str, file_unique_id: Optional[str]):
+        qr_codes = await QRCodeService.process_photo(file_id, file_unique_id, self.bot, self._semaphore, self.timings)
+        self.qr_codes.update(qr_codes)
+        if self.on_progress:
+            try:
+                await self.on_progress(self)
+            except Exception as e:
+                print(f"Ошибка обновления прогресса инвентаризации: {e}")
+
+    async def wait(self) -> List[str]:
+        """Дожидается обработки всех фото и возвращает распознанные QR-коды.
+
+        Если хоть одно фото не скачалось или не распозналось, бросает исключение.
+        """
+        if self._tasks:
+            QRCodeService.check_photo_results(await asyncio.gather(*self._tasks, return_exceptions=True))
+        return list(self.qr_codes)
+
+    def stop_progress(self):
+        """Больше не сообщать о прогрессе, включая уже отложенное обновление"""
+        stop = getattr(self.on_progress, "stop", None)
+        self.on_progress = None
+        if stop:
+            stop()
+
+    def cancel(self):
+        """Отменяет обработку оставшихся фото"""
+        self.stop_progress()
+        for task in self._tasks:
+            task.cancel()
+
+
+class InventorySessionService:
+    # Активные сессии по (chat_id, user_id)
+    _sessions: Dict[Tuple[int, int], InventorySession] = {}
+
+    @staticmethod
+    def start_session(chat_id: int, user_id: int, bot, on_progress=None) -> InventorySession:
+        """Начинает новую сессию, отменяя предыдущую незавершённую"""
+        InventorySessionService.cancel_session(chat_id, user_id)
+        session = InventorySession(bot, on_progress)
+        InventorySessionService._sessions[(chat_id, user_id)] = session
+        return session
+
+    @staticmethod
+    def get_session(chat_id: int, user_id: int) -> Optional[InventorySession]:
+        return InventorySessionService._sessions.get((chat_id, user_id))
+
+    @staticmethod
+    def finish_session(chat_id: int, user_id: int) -> Optional[InventorySession]:
+        """Убирает сессию из списка активных и возвращает её"""
+        return InventorySessionService._sessions.pop((chat_id, user_id), None)
+
+    @staticmethod
+    def cancel_session(chat_id: int, user_id: int):
+        session = InventorySessionService.finish_session(chat_id, user_id)
+        if session:
+            session.cancel()
@@ -0,0 +1,107 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Optional
+from sqlalchemy import literal, select, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import Role, Status, RequestStatus
+
+# Названия, на которые опирается код бота (заполняются init_db.py)
+ROLE_PENDING = "в обработке"
+ROLE_FOREMAN = "прораб объекта"
+ROLE_WORKER = "рабочий на объекте"
+STATUS_AVAILABLE = "В наличии"
+STATUS_LOST = "Утерян"
+REQUEST_PENDING = "Ожидает одобрения"
+REQUEST_DONE = "Выполнено"
+
+REQUIRED_NAMES = {
+    "roles": (ROLE_PENDING, ROLE_FOREMAN, ROLE_WORKER),
+    "statuses": (STATUS_AVAILABLE, STATUS_LOST),
+    "request_statuses": (REQUEST_PENDING, REQUEST_DONE),
+}
+
+
+@dataclass(frozen=True)
+class LookupTable:
+    """Неизменяемое соответствие name <-> id одной справочной таблицы"""
+    label: str
+    ids: Mapping[str, int]
+    names: Mapping[int, str]
+
+    @classmethod
+    def from_rows(cls, label: str, rows) -> "LookupTable":
+        ids = {name: id_ for id_, name in rows}
+        return cls(label, MappingProxyType(ids), MappingProxyType({id_: name for name, id_ in ids.items()}))
+
+    def id(self, name: str) -> int:
+        if name not in self.ids:
+            raise ValueError(f"{self.label} '{name}' not found")
+        return self.ids[name]
+
+    def get_id(self, name: str) -> Optional[int]:
+        return self.ids.get(name)
+
+    def name(self, id_: int) -> Optional[str]:
+        return self.names.get(id_)
+
+
+@dataclass(frozen=True)
+class Lookups:
+    roles: LookupTable
+    statuses: LookupTable
+    request_statuses: LookupTable
+
+
+class LookupService:
+    """Справочники ролей и статусов, загруженные один раз при запуске.
+
+    Снимок неизменяем и при reload() заменяется целиком, поэтому читать его можно
+    без блокировок и без обращений к БД.
+    """
+    _lookups: Optional[Lookups] = None
+
+    @staticmethod
+    async def load(db: AsyncSession) -> Lookups:
+        """Загружает все три справочника одним запросом и проверяет обязательные названия"""
+        tables = (("roles", Role), ("statuses", Status), ("request_statuses", RequestStatus))
+        query = union_all(*[
+            select(literal(key).label("table"), model.id, model.name) for key, model in tables
+        ])
+        rows = {key: [] for key, _ in tables}
+        for table, id_, name in (await db.execute(query)).all():
+            rows[table].append((id_, name))
+
+        lookups = Lookups(
+            roles=LookupTable.from_rows("Role", rows["roles"]),
+            statuses=LookupTable.from_rows("Status", rows["statuses"]),
+            request_statuses=LookupTable.from_rows("RequestStatus", rows["request_statuses"]),
+        )
+        for key, names in REQUIRED_NAMES.items():
+            for name in names:
+                getattr(lookups, key).id(name)
+
+        LookupService._lookups = lookups
+        return lookups
+
+    @staticmethod
+    async def reload(db: AsyncSession) -> Lookups:
+        """Перечитывает справочники после их изменения в БД"""
+        return await LookupService.load(db)
+
+    @staticmethod
+    def get() -> Lookups:
+        if LookupService._lookups is None:
+            raise RuntimeError("Справочники не загружены: вызовите LookupService.load() при запуске")
+        return LookupService._lookups
+
+    @staticmethod
+    def role_id(name: str) -> int:
+        return LookupService.get().roles.id(name)
+
+    @staticmethod
+    def status_id(name: str) -> int:
+        return LookupService.get().statuses.id(name)
+
+    @staticmethod
+    def request_status_id(name: str) -> int:
+        return LookupService.get().request_statuses.id(name)
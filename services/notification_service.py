@@ -0,0 +1,337 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from sqlalchemy import delete, event, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from config import (
+    NOTIFY_GLOBAL_RATE, NOTIFY_CHAT_RATE, NOTIFY_MAX_ATTEMPTS, NOTIFY_RETRY_BASE, NOTIFY_RETRY_MAX,
+    NOTIFY_BATCH_SIZE, NOTIFY_POLL_INTERVAL, NOTIFY_LEASE
+)
+from database.connection import AsyncSessionLocal
+from database.models import Notification
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_PENDING = "pending"
+NOTIFICATION_FAILED = "failed"
+
+
+class NotificationService:
+    """Постановка уведомлений в очередь notification_outbox.
+
+    Уведомление записывается в транзакцию обработчика и уходит только после ее commit,
+    поэтому обработчик не ждет доставки, а откаченное действие не порождает сообщений.
+    """
+
+    @staticmethod
+    def _row(user, text: str) -> Optional[dict]:
+        chat_id = getattr(user, "chat_id", None)
+        username = getattr(user, "username", None)
+        if not chat_id and not username:
+            return None
+        return {"chat_id": chat_id, "username": username, "text": text}
+
+    @staticmethod
+    async def enqueue(db: AsyncSession, user, text: str) -> bool:
+        """Ставит уведомление пользователю в очередь. False — пользователю нечем написать"""
+        row = NotificationService._row(user, text)
+        if row is None:
+            return False
+        db.add(Notification(**row))
+        _mark_enqueued(db)
+        return True
+
+    @staticmethod
+    async def enqueue_many(db: AsyncSession, messages: Iterable[Tuple[object, str]]) -> int:
+        """Ставит в очередь пары (пользователь, текст) одним INSERT. Возвращает число уведомлений"""
+        rows = [row for row in (NotificationService._row(user, text) for user, text in messages) if row]
+        if rows:
+            await db.execute(insert(Notification), rows)
+            _mark_enqueued(db)
+        return len(rows)
+
+
+# Событие, которым commit с новыми уведомлениями будит диспетчер этого процесса
+_wakeup: Optional[asyncio.Event] = None
+
+
+def _mark_enqueued(db) -> None:
+    getattr(db, "sync_session", db).info["notifications_enqueued"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_dispatcher(session):
+    if session.info.pop("notifications_enqueued", False) and _wakeup is not None:
+        _wakeup.set()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_enqueued(session):
+    session.info.pop("notifications_enqueued", None)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Через сколько секунд появится токен (0 — уже есть)"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+@dataclass(frozen=True)
+class OutgoingNotification:
+    id: int
+    chat_id: Optional[int]
+    username: Optional[str]
+    text: str
+    attempts: int
+
+    @property
+    def chat_key(self) -> Hashable:
+        return self.chat_id or self.username
+
+
+class NotificationDispatcher:
+    """Фоновая отправка уведомлений из notification_outbox с лимитами Telegram.
+
+    Общий лимит бота и лимит на чат — ведра токенов; сообщение в "занятый" чат ждет,
+    не задерживая остальные. TelegramRetryAfter приостанавливает все отправки на
+    указанное время, сетевые и прочие ошибки повторяются с экспоненциальной паузой,
+    блокировка бота и несуществующий чат помечают уведомление как failed.
+    Взятые в работу строки скрываются от других процессов на NOTIFY_LEASE секунд
+    (в PostgreSQL выборка идет с FOR UPDATE SKIP LOCKED); пока строка ждет в памяти,
+    аренда продлевается, а строка, аренду которой продлить не удалось, выбрасывается из очереди.
+    """
+
+    # Сколько ведер чатов хранить, прежде чем выбросить полные (неактивные)
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(
+        self,
+        bot: Bot,
+        session_factory=AsyncSessionLocal,
+        global_rate: float = NOTIFY_GLOBAL_RATE,
+        chat_rate: float = NOTIFY_CHAT_RATE,
+        batch_size: int = NOTIFY_BATCH_SIZE,
+        poll_interval: float = NOTIFY_POLL_INTERVAL
+    ):
+        self.bot = bot
+        self.session_factory = session_factory
+        self.chat_rate = chat_rate
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self.chat_buckets: Dict[Hashable, TokenBucket] = {}
+        self.queue: List[OutgoingNotification] = []
+        self.leases: Dict[int, datetime] = {}  # id строки в очереди -> до какого времени она скрыта
+        self.paused_until = 0.0
+        self.sent = 0
+        self.failed = 0
+
+    async def run(self) -> None:
+        global _wakeup
+        _wakeup = wakeup = asyncio.Event()
+        while True:
+            # Сбрасываем до шага: commit во время шага разбудит следующее ожидание
+            wakeup.clear()
+            try:
+                wait = await self.step()
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомлений: {e}")
+                wait = self.poll_interval
+            # Просыпаемся вовремя, чтобы продлить аренду ждущих строк
+            wait = min(wait, self._renew_delay())
+            if wait > 0:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def step(self) -> float:
+        """Отправляет все, что можно отправить сейчас. Возвращает, сколько секунд можно подождать"""
+        await self._renew_leases()
+        pause = self.paused_until - time.monotonic()
+        if pause > 0:
+            return pause
+        if len(self.queue) < self.batch_size // 2:
+            self.queue.extend(await self._claim(self.batch_size - len(self.queue)))
+        if not self.queue:
+            return self.poll_interval
+
+        wait = self.poll_interval
+        for notification in list(self.queue):
+            chat_bucket = self._chat_bucket(notification.chat_key)
+            chat_delay = chat_bucket.delay()
+            if chat_delay > 0:
+                wait = min(wait, chat_delay)
+                continue
+            global_delay = self.global_bucket.delay()
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+            chat_bucket.take()
+            self.global_bucket.take()
+            self.queue.remove(notification)
+            self.leases.pop(notification.id, None)
+            await self._deliver(notification)
+            if self.paused_until > time.monotonic():
+                return self.paused_until - time.monotonic()
+        return wait if self.queue else 0.0
+
+    def _chat_bucket(self, key: Hashable) -> TokenBucket:
+        bucket = self.chat_buckets.get(key)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.MAX_CHAT_BUCKETS:
+                self.chat_buckets = {k: b for k, b in self.chat_buckets.items() if not b.is_full()}
+            bucket = self.chat_buckets[key] = TokenBucket(self.chat_rate, 1.0)
+        return bucket
+
+    async def _claim(self, limit: int) -> List[OutgoingNotification]:
+        """Берет в работу уведомления, которым пора уйти, и откладывает их на время аренды"""
+        now = datetime.utcnow()
+        query = (
+            select(Notification)
+            .where(Notification.status == NOTIFICATION_PENDING, Notification.next_attempt_at <= now)
+            .order_by(Notification.next_attempt_at, Notification.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        if self.queue:
+            query = query.where(Notification.id.notin_([n.id for n in self.queue]))
+        lease_until = now + timedelta(seconds=NOTIFY_LEASE)
+        async with self.session_factory() as db:
+            rows = (await db.execute(query)).scalars().all()
+            if not rows:
+                return []
+            await db.execute(
+                update(Notification)
+                .where(Notification.id.in_([row.id for row in rows]))
+                .values(next_attempt_at=lease_until)
+            )
+            await db.commit()
+        for row in rows:
+            self.leases[row.id] = lease_until
+        return [OutgoingNotification(row.id, row.chat_id, row.username, row.text, row.attempts) for row in rows]
+
+    def _renew_delay(self) -> float:
+        """Через сколько секунд пора продлевать аренду: за половину NOTIFY_LEASE до ее конца"""
+        if not self.leases:
+            return float("inf")
+        renew_at = min(self.leases.values()) - timedelta(seconds=NOTIFY_LEASE / 2)
+        return max(0.0, (renew_at - datetime.utcnow()).total_seconds())
+
+    async def _renew_leases(self) -> None:
+        """Продлевает аренду строк очереди, у которых прошла половина срока.
+
+        Строка продлевается, только если ее аренда все еще наша (next_attempt_at не изменился);
+        иначе ее уже взял другой процесс или она удалена, и из очереди она выбрасывается.
+        """
+        now = datetime.utcnow()
+        expiring: Dict[datetime, List[int]] = {}
+        for notification_id, until in self.leases.items():
+            if until - now <= timedelta(seconds=NOTIFY_LEASE / 2):
+                expiring.setdefault(until, []).append(notification_id)
+        if not expiring:
+            return
+
+        lease_until = now + timedelta(seconds=NOTIFY_LEASE)
+        renewed = set()
+        async with self.session_factory() as db:
+            for until, ids in expiring.items():
+                result = await db.execute(
+                    update(Notification)
+                    .where(
+                        Notification.id.in_(ids),
+                        Notification.status == NOTIFICATION_PENDING,
+                        Notification.next_attempt_at == until
+                    )
+                    .values(next_attempt_at=lease_until)
+                    .returning(Notification.id)
+                )
+                renewed.update(result.scalars().all())
+            await db.commit()
+
+        lost = {notification_id for ids in expiring.values() for notification_id in ids} - renewed
+        for notification_id in renewed:
+            self.leases[notification_id] = lease_until
+        if lost:
+            logger.warning(f"Аренда уведомлений {sorted(lost)} не продлена: их взял другой процесс, убираем из очереди")
+            self.queue = [notification for notification in self.queue if notification.id not in lost]
+            for notification_id in lost:
+                del self.leases[notification_id]
+
+    async def _deliver(self, notification: OutgoingNotification) -> None:
+        try:
+            if notification.chat_id:
+                await self.bot.send_message(notification.chat_id, notification.text)
+            else:
+                await self.bot.send_message(notification.username.removeprefix("@"), notification.text)
+        except TelegramRetryAfter as e:
+            # Telegram просит подождать: останавливаем все отправки, сообщение повторим без штрафа
+            self.paused_until = time.monotonic() + e.retry_after
+            logger.warning(f"Telegram ограничил отправку на {e.retry_after} с")
+            await self._reschedule(notification, e.retry_after, str(e), count_attempt=False)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Бот заблокирован, чат не найден и т.п. — повтор не поможет
+            logger.warning(f"Уведомление {notification.id} для {notification.username or notification.chat_id} не доставлено: {e}")
+            await self._fail(notification, str(e))
+        except Exception as e:
+            attempts = notification.attempts + 1
+            if attempts >= NOTIFY_MAX_ATTEMPTS:
+                logger.warning(f"Уведомление {notification.id} не доставлено за {attempts} попыток: {e}")
+                await self._fail(notification, str(e), attempts)
+            else:
+                delay = min(NOTIFY_RETRY_BASE * 2 ** (attempts - 1), NOTIFY_RETRY_MAX)
+                await self._reschedule(notification, delay, str(e))
+        else:
+            self.sent += 1
+            async with self.session_factory() as db:
+                await db.execute(delete(Notification).where(Notification.id == notification.id))
+                await db.commit()
+
+    async def _reschedule(self, notification: OutgoingNotification, delay: float, error: str, count_attempt: bool = True) -> None:
+        async with self.session_factory() as db:
+            await db.execute(
+                update(Notification)
+                .where(Notification.id == notification.id)
+                .values(
+                    next_attempt_at=datetime.utcnow() + timedelta(seconds=delay),
+                    attempts=notification.attempts + (1 if count_attempt else 0),
+                    last_error=error
+                )
+            )
+            await db.commit()
+
+    async def _fail(self, notification: OutgoingNotification, error: str, attempts: Optional[int] = None) -> None:
+        self.failed += 1
+        async with self.session_factory() as db:
+            await db.execute(
+                update(Notification)
+                .where(Notification.id == notification.id)
+                .values(status=NOTIFICATION_FAILED, attempts=attempts or notification.attempts + 1, last_error=error)
+            )
+            await db.commit()
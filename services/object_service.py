@@ -0,0 +1,145 @@
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Optional, Tuple
+from sqlalchemy import event, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from config import OBJECT_CACHE_TTL
+from database.models import Object, User
+from services.lookup_service import LookupService, ROLE_FOREMAN
+from services.user_cache import ObjectSnapshot, get_user_cache, publish_invalidation
+
+
+@dataclass(frozen=True)
+class ObjectDirectory:
+    """Неизменяемый список объектов одной версии справочника с username их бригадиров"""
+    version: int
+    loaded_at: float
+    objects: Tuple[ObjectSnapshot, ...]
+    by_id: Mapping[int, ObjectSnapshot]
+    foremen: Mapping[int, str]
+
+    def get(self, object_id: int) -> Optional[ObjectSnapshot]:
+        return self.by_id.get(object_id)
+
+    def foreman_username(self, object_id: int) -> Optional[str]:
+        return self.foremen.get(object_id)
+
+    def without(self, object_id: Optional[int]) -> Tuple[ObjectSnapshot, ...]:
+        return tuple(obj for obj in self.objects if obj.id != object_id)
+
+
+class ObjectService:
+    """Справочник объектов в памяти процесса.
+
+    Объекты меняются редко, поэтому экраны выбора объекта читают снимок без обращений
+    к БД. Каждый commit, изменивший объекты, увеличивает версию, и следующий запрос
+    перечитывает справочник; OBJECT_CACHE_TTL ограничивает срок жизни снимка на случай
+    правок в обход бота.
+    """
+    _directory: Optional[ObjectDirectory] = None
+    _version: int = 0
+
+    @staticmethod
+    async def get_directory(db: AsyncSession) -> ObjectDirectory:
+        directory = ObjectService._directory
+        if (
+            directory is None
+            or directory.version != ObjectService._version
+            or time.monotonic() - directory.loaded_at > OBJECT_CACHE_TTL
+        ):
+            directory = await ObjectService.load(db)
+        return directory
+
+    @staticmethod
+    async def load(db: AsyncSession) -> ObjectDirectory:
+        """Читает объекты и их бригадиров (по object.foreman_id), ничего не изменяя"""
+        # Версию запоминаем до запроса: если объекты изменят во время загрузки,
+        # снимок сразу окажется устаревшим и будет перечитан
+        version = ObjectService._version
+        rows = (await db.execute(
+            select(Object.id, Object.name, User.username)
+            .outerjoin(User, User.id == Object.foreman_id)
+            .order_by(Object.id)
+        )).all()
+        objects = tuple(ObjectSnapshot(id_, name) for id_, name, _ in rows)
+        directory = ObjectDirectory(
+            version=version,
+            loaded_at=time.monotonic(),
+            objects=objects,
+            by_id=MappingProxyType({obj.id: obj for obj in objects}),
+            foremen=MappingProxyType({id_: username for id_, _, username in rows if username}),
+        )
+        ObjectService._directory = directory
+        return directory
+
+    @staticmethod
+    def _foreman_id_query():
+        """id бригадира объекта: пользователь с ролью "прораб объекта" на объекте, с наименьшим id"""
+        return (
+            select(func.min(User.id))
+            .where(User.object_id == Object.id, User.role_id == LookupService.role_id(ROLE_FOREMAN))
+            .correlate(Object)
+            .scalar_subquery()
+        )
+
+    @staticmethod
+    async def sync_foremen(db: AsyncSession, object_ids) -> None:
+        """Пересчитывает object.foreman_id по ролям пользователей и сбрасывает справочник после commit.
+
+        Бригадир объекта — пользователь с ролью "прораб объекта" на этом объекте
+        (при нескольких — с наименьшим id). Вызывается после flush изменений пользователя.
+        """
+        object_ids = {object_id for object_id in object_ids if object_id is not None}
+        if object_ids:
+            await db.execute(
+                update(Object).where(Object.id.in_(object_ids)).values(foreman_id=ObjectService._foreman_id_query()),
+                execution_options={"synchronize_session": "fetch"},
+            )
+        # Справочник хранит и username бригадиров, поэтому сбрасываем его даже без смены foreman_id
+        mark_objects_changed(db)
+
+    @staticmethod
+    async def repair_foremen(db: AsyncSession) -> int:
+        """Исправляет object.foreman_id, разошедшийся с ролями пользователей. Возвращает число объектов.
+
+        Бот поддерживает колонку сам (sync_foremen), расходится она только после правок ролей
+        в обход бота; поэтому проверка выполняется один раз при запуске, а не при чтении справочника.
+        """
+        foreman_id = ObjectService._foreman_id_query()
+        result = await db.execute(
+            update(Object).where(Object.foreman_id.is_distinct_from(foreman_id)).values(foreman_id=foreman_id),
+            execution_options={"synchronize_session": False},
+        )
+        return result.rowcount
+
+    @staticmethod
+    def invalidate():
+        """Помечает справочник устаревшим; кэш пользователей хранит названия объектов, его тоже сбрасываем"""
+        ObjectService._version += 1
+        get_user_cache().clear()
+
+
+def mark_objects_changed(db) -> None:
+    """Сбросить справочник объектов после commit сессии db"""
+    getattr(db, "sync_session", db).info["objects_changed"] = True
+
+
+@event.listens_for(Session, "after_flush")
+def _track_object_changes(session, flush_context):
+    changed = session.new | session.dirty | session.deleted
+    if any(isinstance(instance, Object) for instance in changed):
+        mark_objects_changed(session)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop("objects_changed", False):
+        ObjectService.invalidate()
+        publish_invalidation("objects")
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop("objects_changed", None)
@@ -0,0 +1,49 @@
+from dataclasses import dataclass
+from typing import Any, Optional, Sequence
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+@dataclass(frozen=True)
+class Page:
+    """Страница строк запроса и курсоры соседних страниц (None — страницы нет)"""
+    rows: Sequence[Any]
+    prev_cursor: Optional[int]
+    next_cursor: Optional[int]
+
+    def truncate(self, count: int) -> "Page":
+        """Оставляет первые count строк; следующая страница начнется сразу после них"""
+        if count >= len(self.rows):
+            return self
+        return Page(self.rows[:count], self.prev_cursor, self.rows[count - 1][0] if count else self.next_cursor)
+
+
+async def fetch_page(
+    db: AsyncSession,
+    query: Select,
+    key,
+    limit: int,
+    after: Optional[int] = None,
+    before: Optional[int] = None
+) -> Page:
+    """Keyset-пагинация: одна страница query, упорядоченного по уникальному столбцу key.
+
+    Первый столбец query — значение key, оно служит курсором. after — показать строки
+    после курсора, before — перед ним. Запрос читает не больше limit + 1 строк, поэтому
+    стоимость страницы не зависит от ее номера; для скорости нужен индекс, заканчивающийся key.
+    """
+    if before is not None:
+        rows = (await db.execute(query.where(key < before).order_by(key.desc()).limit(limit + 1))).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit][::-1]
+        if rows:
+            return Page(rows, rows[0][0] if has_more else None, rows[-1][0])
+    else:
+        page_query = query.where(key > after) if after is not None else query
+        rows = (await db.execute(page_query.order_by(key).limit(limit + 1))).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if rows or after is None:
+            return Page(rows, rows[0][0] if after is not None else None, rows[-1][0] if has_more else None)
+    # Строки по ту сторону курсора исчезли (инструменты передали) — показываем первую страницу
+    return await fetch_page(db, query, key, limit)
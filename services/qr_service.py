@@ -1,165 +1,404 @@
 import cv2
 import numpy as np
 from pyzbar import pyzbar
+from pyzbar.pyzbar import ZBarSymbol
 from PIL import Image
 import io
 import aiohttp
 import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime
 from typing import List, Optional, Tuple
-from database.models import Tool, Status
-from database.connection import SessionLocal
+from sqlalchemy import update, select, and_, false, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from database.models import Tool, InventoryCheck, ToolOnCheck
+from config import (
+    INVENTORY_DOWNLOAD_CONCURRENCY,
+    DECODE_WORKERS,
+    QR_DOWNSCALE_MAX_SIDE,
+    QR_TILE_SIZE,
+    QR_TILE_OVERLAP,
+    QR_MIN_CODE_SIZE,
+)
+from services.decode_cache import get_decode_cache
+from services.lookup_service import LookupService, STATUS_AVAILABLE, STATUS_LOST
+
+@dataclass
+class InventoryDelta:
+    """Изменения по сравнению с предыдущей инвентаризацией объекта"""
+    previous_date: Optional[datetime] = None  # None — предыдущей инвентаризации не было
+    newly_lost: List[Tool] = field(default_factory=list)  # были найдены, теперь нет
+    recovered: List[Tool] = field(default_factory=list)   # были утеряны, теперь найдены
+    arrived: List[Tool] = field(default_factory=list)     # появились на объекте после прошлой проверки
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.newly_lost or self.recovered or self.arrived)
+
+
+# Версия детектора QR-кодов: увеличивается при изменениях detect_qr_codes,
+# чтобы кэш декодирования не отдавал результаты прежнего детектора
+DETECTOR_VERSION = 3
+
+# Поиск мест с кодами на уменьшенной копии: перепад яркости между соседними пикселями,
+# который считается резким, и доля таких пикселей в окне размером с самый мелкий код
+QR_EDGE_THRESHOLD = 64
+QR_EDGE_DENSITY = 0.25
+
+
+class PhotoProcessingError(Exception):
+    """Фото не удалось скачать или распознать: по нему нельзя судить, каких инструментов нет"""
+
+
+# Пул процессов для декодирования, создаётся при запуске бота
+_decode_pool: Optional[ProcessPoolExecutor] = None
+
+
+@dataclass
+class InventoryTimings:
+    """Время этапов обработки инвентаризации в секундах"""
+    photos: int = 0
+    cached: int = 0        # фото, взятые из кэша без скачивания
+    download: float = 0.0  # суммарное время скачивания всех фото
+    decode: float = 0.0    # суммарное время декодирования
+    database: float = 0.0
+    total: float = 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"фото: {self.photos} (из кэша: {self.cached}), скачивание: {self.download:.2f}с, "
+            f"декодирование: {self.decode:.2f}с, БД: {self.database:.2f}с, всего: {self.total:.2f}с"
+        )
+
 
 class QRCodeService:
     @staticmethod
-    async def download_photo(file_id: str, bot) -> Optional[bytes]:
-        """Скачивает фото по file_id"""
-        try:
-            file = await bot.get_file(file_id)
-            file_path = file.file_path
-            
-            # Скачиваем файл
-            file_data = await bot.download_file(file_path)
-            return file_data.read()
-        except Exception as e:
-            print(f"Ошибка скачивания фото: {e}")
-            return None
+    async def download_photo(file_id: str, bot) -> bytes:
+        """Скачивает фото по file_id; ошибки скачивания не глушатся"""
+        file = await bot.get_file(file_id)
+        file_path = file.file_path
+
+        # Скачиваем файл
+        file_data = await bot.download_file(file_path)
+        return file_data.read()
 
     @staticmethod
     def decode_qr_codes(image_data: bytes) -> List[str]:
-        """Декодирует QR-коды из изображения"""
-        try:
-            # Конвертируем bytes в numpy array
-            nparr = np.frombuffer(image_data, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            # Находим QR-коды
-            qr_codes = pyzbar.decode(image)
-            
-            # Извлекаем данные из QR-кодов
-            decoded_codes = []
-            for qr in qr_codes:
-                decoded_data = qr.data.decode('utf-8')
-                decoded_codes.append(decoded_data)
-            
-            return decoded_codes
-        except Exception as e:
-            print(f"Ошибка декодирования QR-кода: {e}")
-            return []
+        """Декодирует QR-коды из изображения. Пустой список — фото распознано, кодов на нем нет"""
+        # Сразу декодируем в оттенки серого: цвет для распознавания не нужен
+        nparr = np.frombuffer(image_data, np.uint8)
+        gray = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise ValueError("файл не является изображением")
+        return QRCodeService.detect_qr_codes(gray)
 
     @staticmethod
-    def get_tools_by_qr_codes(qr_codes: List[str], object_id: int) -> List[Tool]:
-        """Получает инструменты по QR-кодам для конкретного объекта"""
-        db = SessionLocal()
-        try:
-            tools = db.query(Tool).filter(
-                Tool.qr_code_value.in_(qr_codes),
-                Tool.current_object_id == object_id
-            ).all()
-            
-            # Предзагружаем связанные данные для каждого инструмента
-            for tool in tools:
-                _ = tool.tool_name.name  # Загружаем tool_name
-                _ = tool.status.name     # Загружаем status
-                _ = tool.inventory_number  # Загружаем inventory_number
-                _ = tool.qr_code_value   # Загружаем qr_code_value
-            
-            return tools
-        finally:
-            db.close()
+    def detect_qr_codes(
+        gray: np.ndarray,
+        max_side: int = QR_DOWNSCALE_MAX_SIDE,
+        tile_size: int = QR_TILE_SIZE,
+        tile_overlap: int = QR_TILE_OVERLAP,
+        min_code_size: int = QR_MIN_CODE_SIZE
+    ) -> List[str]:
+        """Ищет QR-коды в полутоновом изображении.
+
+        Сначала распознается уменьшенная копия (длинная сторона не больше max_side). Затем
+        в полном разрешении просматриваются только места, где на копии есть густые резкие
+        перепады яркости (так выглядит любой код), не объясненные кодами первого прохода:
+        каждая перекрывающаяся плитка обрезается до таких мест с запасом, плитки без них
+        пропускаются. Найденные коды закрашиваются белым, чтобы не распознавать их повторно.
+        Совпадающие коды из разных плиток объединяются.
+        """
+        height, width = gray.shape[:2]
+        payloads = {}  # dict сохраняет порядок и убирает повторы
+        detected = []  # прямоугольники найденных кодов в координатах исходного изображения
+
+        # Проход 1: уменьшенная копия
+        scale = min(1.0, max_side / max(height, width))
+        small = gray if scale == 1.0 else cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        for qr in pyzbar.decode(small, symbols=[ZBarSymbol.QRCODE]):
+            payloads[qr.data.decode('utf-8')] = None
+            # Рамка pyzbar на уменьшенной копии неточна на пиксель-другой: расширяем ее
+            left, top, rect_width, rect_height = qr.rect
+            x1, y1 = max(0, int((left - 1) / scale)), max(0, int((top - 1) / scale))
+            x2 = min(width, int((left + rect_width + 1) / scale) + 1)
+            y2 = min(height, int((top + rect_height + 1) / scale) + 1)
+            detected.append((x1, y1, x2, y2))
+
+        # Мелкие изображения уже распознаны в полном разрешении
+        if scale == 1.0 and max(height, width) <= tile_size:
+            return list(payloads)
+
+        if detected:
+            gray = gray.copy()
+            small = small.copy()
+            for x1, y1, x2, y2 in detected:
+                gray[y1:y2, x1:x2] = 255
+                small[int(y1 * scale):int(y2 * scale) + 1, int(x1 * scale):int(x2 * scale) + 1] = 255
+        candidates = QRCodeService._candidate_mask(small, max(3, int(min_code_size * scale)))
+
+        # Проход 2: плитки в полном разрешении, обрезанные до мест-кандидатов
+        margin = min_code_size
+        step = max(1, tile_size - tile_overlap)
+        for top in QRCodeService._tile_starts(height, tile_size, step):
+            for left in QRCodeService._tile_starts(width, tile_size, step):
+                right, bottom = min(width, left + tile_size), min(height, top + tile_size)
+                small_left, small_top = int(left * scale), int(top * scale)
+                ys, xs = np.nonzero(candidates[small_top:int(bottom * scale), small_left:int(right * scale)])
+                if not len(ys):
+                    continue
+                crop_left = max(left, int((small_left + xs.min()) / scale) - margin)
+                crop_top = max(top, int((small_top + ys.min()) / scale) - margin)
+                crop_right = min(right, int((small_left + xs.max() + 1) / scale) + margin)
+                crop_bottom = min(bottom, int((small_top + ys.max() + 1) / scale) + margin)
+                crop = gray[crop_top:crop_bottom, crop_left:crop_right]
+                for qr in pyzbar.decode(crop, symbols=[ZBarSymbol.QRCODE]):
+                    payloads[qr.data.decode('utf-8')] = None
+
+        return list(payloads)
 
     @staticmethod
-    def get_all_tools_on_object(object_id: int) -> List[Tool]:
-        """Получает все инструменты на объекте"""
-        db = SessionLocal()
-        try:
-            tools = db.query(Tool).filter(Tool.current_object_id == object_id).all()
-            
-            # Предзагружаем связанные данные для каждого инструмента
-            for tool in tools:
-                _ = tool.tool_name.name  # Загружаем tool_name
-                _ = tool.status.name     # Загружаем status
-                _ = tool.inventory_number  # Загружаем inventory_number
-                _ = tool.qr_code_value   # Загружаем qr_code_value
-            
-            return tools
-        finally:
-            db.close()
+    def _candidate_mask(small: np.ndarray, window: int) -> np.ndarray:
+        """Места уменьшенной копии, где может быть QR-код: доля резких перепадов в окне window×window.
+
+        У кода почти каждый пиксель копии — перепад между модулями, у ровного фона и одиночных
+        линий (края полок, коробок) таких пикселей мало.
+        """
+        gradient = cv2.morphologyEx(small, cv2.MORPH_GRADIENT, np.ones((3, 3), np.uint8))
+        edges = (gradient >= QR_EDGE_THRESHOLD).astype(np.float32)
+        return cv2.blur(edges, (window, window)) >= QR_EDGE_DENSITY
 
     @staticmethod
-    def update_tool_status(tool_id: int, status_name: str):
-        """Обновляет статус инструмента"""
-        db = SessionLocal()
+    def _tile_starts(length: int, tile_size: int, step: int) -> List[int]:
+        """Начала плиток вдоль одной оси; последняя плитка прижата к краю"""
+        if length <= tile_size:
+            return [0]
+        starts = list(range(0, length - tile_size, step))
+        starts.append(length - tile_size)
+        return starts
+
+    @staticmethod
+    def start_decode_pool(workers: Optional[int] = None) -> ProcessPoolExecutor:
+        """Создаёт пул процессов для декодирования и прогревает все его процессы"""
+        global _decode_pool
+        if _decode_pool is not None:
+            return _decode_pool
+
+        workers = workers or DECODE_WORKERS or os.cpu_count() or 1
+        # spawn: дочерние процессы не наследуют event loop и соединения с БД
+        _decode_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+        # Прогрев: каждый процесс импортирует cv2/pyzbar и декодирует пустое изображение
+        blank = cv2.imencode(".png", np.full((8, 8), 255, dtype=np.uint8))[1].tobytes()
+        wait([_decode_pool.submit(QRCodeService.decode_qr_codes, blank) for _ in range(workers)])
+        print(f"Пул декодирования QR-кодов запущен: {workers} процессов")
+        return _decode_pool
+
+    @staticmethod
+    def shutdown_decode_pool():
+        """Останавливает пул процессов декодирования"""
+        global _decode_pool
+        if _decode_pool is not None:
+            _decode_pool.shutdown(cancel_futures=True)
+            _decode_pool = None
+
+    @staticmethod
+    async def decode_qr_codes_async(image_data: bytes) -> List[str]:
+        """Декодирует QR-коды в пуле процессов, не блокируя event loop"""
+        loop = asyncio.get_running_loop()
+        # Если пул не запущен, декодируем в потоке по умолчанию
+        return await loop.run_in_executor(_decode_pool, QRCodeService.decode_qr_codes, image_data)
+
+    @staticmethod
+    async def get_inventory_tools(db: AsyncSession, qr_codes: List[str], object_id: int) -> Tuple[List[Tool], List[Tool]]:
+        """Одним запросом получает все инструменты объекта и делит их на найденные и отсутствующие"""
+        # Признак "найден" вычисляется в БД по множеству распознанных кодов
+        found_flag = Tool.qr_code_value.in_(set(qr_codes)) if qr_codes else false()
+        result = await db.execute(select(Tool, found_flag.label("found")).options(
+            joinedload(Tool.tool_name),
+            joinedload(Tool.status)
+        ).filter(Tool.current_object_id == object_id))
+        rows = result.all()
+
+        found_tools = [tool for tool, found in rows if found]
+        missing_tools = [tool for tool, found in rows if not found]
+        return found_tools, missing_tools
+
+    @staticmethod
+    async def process_photo(
+        file_id: str,
+        file_unique_id: Optional[str],
+        bot,
+        semaphore: asyncio.Semaphore,
+        timings: InventoryTimings
+    ) -> List[str]:
+        """Скачивает одно фото и декодирует его сразу после загрузки.
+
+        Если фото не удалось скачать или распознать, бросает PhotoProcessingError.
+        """
+        # Это фото уже декодировалось — не скачиваем его повторно
+        cache = get_decode_cache()
+        if file_unique_id:
+            cached_codes = await cache.get_async(file_unique_id, DETECTOR_VERSION)
+            if cached_codes is not None:
+                timings.cached += 1
+                return cached_codes
+
+        # Одновременно скачивается не больше фото, чем позволяет семафор
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                image_data = await QRCodeService.download_photo(file_id, bot)
+            except Exception as e:
+                raise PhotoProcessingError(f"не удалось скачать фото: {e}") from e
+            finally:
+                timings.download += time.perf_counter() - started
+        if not image_data:
+            raise PhotoProcessingError("не удалось скачать фото: пустой файл")
+
+        # Декодируем вне семафора, освободив слот для следующего скачивания
+        started = time.perf_counter()
         try:
-            # Получаем статус по названию
-            status = db.query(Status).filter(Status.name == status_name).first()
-            if not status:
-                print(f"Статус '{status_name}' не найден")
-                return False
-            
-            # Обновляем статус инструмента
-            tool = db.query(Tool).filter(Tool.id == tool_id).first()
-            if tool:
-                tool.status_id = status.id
-                db.commit()
-                return True
-            return False
-        finally:
-            db.close()
+            qr_codes = await QRCodeService.decode_qr_codes_async(image_data)
+        except Exception as e:
+            raise PhotoProcessingError(f"не удалось распознать фото: {e}") from e
+        decode_seconds = time.perf_counter() - started
+        timings.decode += decode_seconds
+
+        # Ошибки скачивания и распознавания сюда не доходят: кэшируется и пустой результат
+        if file_unique_id:
+            await cache.put_async(
+                file_unique_id, qr_codes, DETECTOR_VERSION, size=len(image_data), decode_seconds=decode_seconds
+            )
+        return qr_codes
 
     @staticmethod
-    async def process_inventory_photos(photo_file_ids: List[str], object_id: int, bot) -> Tuple[List[Tool], List[Tool]]:
-        """Обрабатывает фотографии инвентаризации и возвращает найденные и отсутствующие инструменты"""
-        found_tools = []
+    async def collect_qr_codes(
+        photos: List[Tuple[str, Optional[str]]],
+        bot,
+        concurrency: Optional[int] = None,
+        timings: Optional[InventoryTimings] = None
+    ) -> List[str]:
+        """Скачивает фото (пары file_id, file_unique_id) параллельно и декодирует каждое сразу после загрузки"""
+        timings = timings if timings is not None else InventoryTimings()
+        semaphore = asyncio.Semaphore(max(1, concurrency or INVENTORY_DOWNLOAD_CONCURRENCY))
+
         all_qr_codes = []
-        
-        # Обрабатываем все фотографии
-        for file_id in photo_file_ids:
-            # Скачиваем фото
-            image_data = await QRCodeService.download_photo(file_id, bot)
-            if not image_data:
-                continue
-            
-            # Декодируем QR-коды
-            qr_codes = QRCodeService.decode_qr_codes(image_data)
+        tasks = [
+            QRCodeService.process_photo(file_id, file_unique_id, bot, semaphore, timings)
+            for file_id, file_unique_id in photos
+        ]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        QRCodeService.check_photo_results(results)
+        for qr_codes in results:
             all_qr_codes.extend(qr_codes)
-        
-        # Получаем инструменты по найденным QR-кодам
-        found_tools = QRCodeService.get_tools_by_qr_codes(all_qr_codes, object_id)
-        
-        # Получаем все инструменты на объекте
-        all_tools = QRCodeService.get_all_tools_on_object(object_id)
-        
-        # Находим отсутствующие инструменты
-        found_tool_ids = {tool.id for tool in found_tools}
-        missing_tools = [tool for tool in all_tools if tool.id not in found_tool_ids]
-        
+
+        timings.photos += len(photos)
+        return all_qr_codes
+
+    @staticmethod
+    def check_photo_results(results: list) -> None:
+        """Бросает исключение, если хоть одно фото не обработано (results — из gather с return_exceptions).
+
+        По неполному набору кодов все ненайденные инструменты оказались бы утерянными.
+        """
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            raise RuntimeError(
+                f"не удалось обработать {len(errors)} из {len(results)} фото ({errors[0]}), "
+                f"начните инвентаризацию заново"
+            ) from errors[0]
+
+    @staticmethod
+    async def get_inventory_delta(
+        db: AsyncSession,
+        qr_codes: List[str],
+        object_id: int,
+        timings: Optional[InventoryTimings] = None
+    ) -> Tuple[List[Tool], List[Tool], InventoryDelta]:
+        """Одним запросом сравнивает новое сканирование с последней инвентаризацией объекта.
+
+        Возвращает найденные и отсутствующие инструменты и изменения относительно прошлой проверки.
+        """
+        timings = timings if timings is not None else InventoryTimings()
+        started = time.perf_counter()
+        found_flag = Tool.qr_code_value.in_(set(qr_codes)) if qr_codes else false()
+        # Последняя проверка объекта (индекс inventory_checks(object_id, date))
+        previous_check = select(InventoryCheck.id, InventoryCheck.date).where(
+            InventoryCheck.object_id == object_id
+        ).order_by(InventoryCheck.date.desc(), InventoryCheck.id.desc()).limit(1).subquery()
+        # Результат прошлой проверки по каждому инструменту (первичный ключ tool_on_check)
+        result = await db.execute(select(Tool, found_flag.label("found"), ToolOnCheck.found, previous_check.c.date).options(
+            joinedload(Tool.tool_name),
+            joinedload(Tool.status)
+        ).select_from(Tool).outerjoin(
+            previous_check, true()
+        ).outerjoin(
+            ToolOnCheck, and_(ToolOnCheck.tool_id == Tool.id, ToolOnCheck.check_id == previous_check.c.id)
+        ).filter(Tool.current_object_id == object_id))
+        rows = result.all()
+        timings.database += time.perf_counter() - started
+
+        found_tools, missing_tools = [], []
+        delta = InventoryDelta()
+        for tool, found, previously_found, previous_date in rows:
+            (found_tools if found else missing_tools).append(tool)
+            delta.previous_date = previous_date
+            if previous_date is None:
+                continue
+            if previously_found is None:
+                delta.arrived.append(tool)
+            elif previously_found and not found:
+                delta.newly_lost.append(tool)
+            elif found and not previously_found:
+                delta.recovered.append(tool)
+        return found_tools, missing_tools, delta
+
+    @staticmethod
+    async def resolve_inventory(
+        db: AsyncSession,
+        qr_codes: List[str],
+        object_id: int,
+        timings: Optional[InventoryTimings] = None
+    ) -> Tuple[List[Tool], List[Tool]]:
+        """Сопоставляет распознанные QR-коды с инструментами объекта"""
+        timings = timings if timings is not None else InventoryTimings()
+        started = time.perf_counter()
+
+        found_tools, missing_tools = await QRCodeService.get_inventory_tools(db, qr_codes, object_id)
+
+        timings.database += time.perf_counter() - started
         return found_tools, missing_tools
 
     @staticmethod
-    def update_inventory_statuses(found_tools: List[Tool], missing_tools: List[Tool]):
-        """Обновляет статусы инструментов по результатам инвентаризации"""
-        # Обновляем статус найденных инструментов на "В наличии"
-        for tool in found_tools:
-            tool_id = tool.id
-            if hasattr(tool_id, 'value'):
-                tool_id = tool_id.value
-            try:
-                tool_id_int = int(tool_id) if tool_id is not None else None
-                if tool_id_int is not None:
-                    QRCodeService.update_tool_status(tool_id_int, "В наличии")
-            except Exception as e:
-                print(f"Ошибка обновления статуса инструмента {tool_id}: {e}")
-        
-        # Обновляем статус отсутствующих инструментов на "Утерян"
-        for tool in missing_tools:
-            tool_id = tool.id
-            if hasattr(tool_id, 'value'):
-                tool_id = tool_id.value
-            try:
-                tool_id_int = int(tool_id) if tool_id is not None else None
-                if tool_id_int is not None:
-                    QRCodeService.update_tool_status(tool_id_int, "Утерян")
-            except Exception as e:
-                print(f"Ошибка обновления статуса инструмента {tool_id}: {e}")
-        
-        print(f"Обновлено статусов: {len(found_tools)} найдено, {len(missing_tools)} утеряно") 
\ No newline at end of file
+    async def update_inventory_statuses(db: AsyncSession, found_tools: List[Tool], missing_tools: List[Tool]) -> Tuple[int, int]:
+        """Обновляет статусы инструментов по результатам инвентаризации в транзакции переданной сессии.
+
+        Возвращает количество строк, у которых статус изменился на "В наличии" и на "Утерян".
+        """
+        found_ids = [tool.id for tool in found_tools]
+        missing_ids = [tool.id for tool in missing_tools]
+
+        updated = []
+        for tool_ids, status_name in ((found_ids, STATUS_AVAILABLE), (missing_ids, STATUS_LOST)):
+            if not tool_ids:
+                updated.append(0)
+                continue
+            status_id = LookupService.status_id(status_name)
+            # Один UPDATE на всё множество; строки с тем же статусом не перезаписываем
+            result = await db.execute(
+                update(Tool)
+                .where(Tool.id.in_(tool_ids), Tool.status_id != status_id)
+                .values(status_id=status_id)
+                .execution_options(synchronize_session=False)
+            )
+            updated.append(result.rowcount)
+
+        found_count, missing_count = updated
+        print(f"Обновлено статусов: {found_count} найдено, {missing_count} утеряно")
+        return found_count, missing_count
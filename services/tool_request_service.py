@@ -1,88 +1,213 @@
-from sqlalchemy.orm import Session, joinedload
-from database.models import ToolRequest, Tool, User, Object, RequestStatus
-from database.connection import SessionLocal
-from typing import Optional, List
+from dataclasses import dataclass
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, joinedload
+from config import PAGE_SIZE
+from database.models import ToolRequest, Tool, ToolName, User, Object, RequestStatus
+from services.lookup_service import LookupService, REQUEST_PENDING, REQUEST_DONE
+from services.pagination import Page, fetch_page
+from typing import Iterable, Optional, List
 from datetime import datetime
 
+
+@dataclass(frozen=True)
+class ResolvedRequest:
+    """Обработанная заявка с данными для уведомления заявителя (chat_id/username — как у пользователя)"""
+    id: int
+    tool_name: str
+    inventory_number: str
+    to_object_name: Optional[str]
+    chat_id: Optional[int]
+    username: Optional[str]
+
+
 class ToolRequestService:
     @staticmethod
-    def get_request_by_id(request_id: int) -> Optional[ToolRequest]:
-        db = SessionLocal()
-        try:
-            return db.query(ToolRequest).options(
-                joinedload(ToolRequest.tool),
-                joinedload(ToolRequest.requester),
-                joinedload(ToolRequest.approver),
-                joinedload(ToolRequest.from_object),
-                joinedload(ToolRequest.to_object),
-                joinedload(ToolRequest.status)
-            ).filter(ToolRequest.id == request_id).first()
-        finally:
-            db.close()
+    async def get_request_by_id(db: AsyncSession, request_id: int) -> Optional[ToolRequest]:
+        result = await db.execute(select(ToolRequest).options(
+            joinedload(ToolRequest.tool).joinedload(Tool.tool_name),
+            joinedload(ToolRequest.requester),
+            joinedload(ToolRequest.approver),
+            joinedload(ToolRequest.from_object),
+            joinedload(ToolRequest.to_object),
+            joinedload(ToolRequest.status)
+        ).filter(ToolRequest.id == request_id))
+        return result.scalars().first()
 
     @staticmethod
-    def get_all_requests() -> List[ToolRequest]:
-        db = SessionLocal()
-        try:
-            return db.query(ToolRequest).options(
-                joinedload(ToolRequest.tool),
-                joinedload(ToolRequest.requester),
-                joinedload(ToolRequest.approver),
-                joinedload(ToolRequest.from_object),
-                joinedload(ToolRequest.to_object),
-                joinedload(ToolRequest.status)
-            ).all()
-        finally:
-            db.close()
+    async def get_all_requests(db: AsyncSession) -> List[ToolRequest]:
+        result = await db.execute(select(ToolRequest).options(
+            joinedload(ToolRequest.tool).joinedload(Tool.tool_name),
+            joinedload(ToolRequest.requester),
+            joinedload(ToolRequest.approver),
+            joinedload(ToolRequest.from_object),
+            joinedload(ToolRequest.to_object),
+            joinedload(ToolRequest.status)
+        ))
+        return list(result.scalars().all())
 
     @staticmethod
-    def create_request(tool_id: int, requester_id: int, from_object_id: int, to_object_id: int, status_name: str = "Ожидает одобрения", approver_id: Optional[int] = None) -> ToolRequest:
-        db = SessionLocal()
-        try:
-            status = db.query(RequestStatus).filter(RequestStatus.name == status_name).first()
-            if not status:
-                raise ValueError(f"RequestStatus '{status_name}' not found")
-            request = ToolRequest(
-                tool_id=tool_id,
-                requester_id=requester_id,
-                from_object_id=from_object_id,
-                to_object_id=to_object_id,
-                status_id=status.id,
-                approver_id=approver_id,
-                created_at=datetime.utcnow()
-            )
-            db.add(request)
-            db.commit()
-            db.refresh(request)
-            return request
-        finally:
-            db.close()
+    async def create_request(db: AsyncSession, tool_id: int, requester_id: int, from_object_id: int, to_object_id: int, status_name: str = REQUEST_PENDING, approver_id: Optional[int] = None) -> ToolRequest:
+        """Создает заявку или возвращает уже открытую заявку на этот инструмент для объекта.
+
+        Один INSERT ... ON CONFLICT по частичному уникальному индексу открытых заявок:
+        повторное нажатие не создает дубликат и не требует предварительной проверки.
+        """
+        now = datetime.utcnow()
+        insert = postgresql_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+        stmt = insert(ToolRequest).values(
+            tool_id=tool_id,
+            requester_id=requester_id,
+            from_object_id=from_object_id,
+            to_object_id=to_object_id,
+            status_id=LookupService.request_status_id(status_name),
+            approver_id=approver_id,
+            created_at=now,
+            resolved_at=now if status_name == REQUEST_DONE else None
+        )
+        # Обновление нужно, чтобы RETURNING вернул и уже существующую заявку; донор берется
+        # из новой заявки — старая могла остаться от объекта, откуда инструмент уже ушел
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ToolRequest.tool_id, ToolRequest.to_object_id],
+            index_where=ToolRequest.resolved_at.is_(None),
+            set_={"from_object_id": stmt.excluded.from_object_id}
+        ).returning(ToolRequest)
+        return (await db.scalars(stmt, execution_options={"populate_existing": True})).one()
+
+    @staticmethod
+    async def update_request(db: AsyncSession, request_id: int, **kwargs) -> Optional[ToolRequest]:
+        request = await db.get(ToolRequest, request_id)
+        if not request:
+            return None
+        for key, value in kwargs.items():
+            if hasattr(request, key):
+                setattr(request, key, value)
+        await db.flush()
+        return request
+
+    @staticmethod
+    async def delete_request(db: AsyncSession, request_id: int) -> bool:
+        request = await db.get(ToolRequest, request_id)
+        if not request:
+            return False
+        await db.delete(request)
+        await db.flush()
+        return True
 
     @staticmethod
-    def update_request(request_id: int, **kwargs) -> Optional[ToolRequest]:
-        db = SessionLocal()
-        try:
-            request = db.query(ToolRequest).filter(ToolRequest.id == request_id).first()
-            if not request:
-                return None
-            for key, value in kwargs.items():
-                if hasattr(request, key):
-                    setattr(request, key, value)
-            db.commit()
-            db.refresh(request)
-            return request
-        finally:
-            db.close()
+    async def get_incoming_page(
+        db: AsyncSession,
+        from_object_id: int,
+        after: Optional[int] = None,
+        before: Optional[int] = None,
+        limit: int = PAGE_SIZE
+    ) -> Page:
+        """Страница невыполненных заявок на инструменты объекта-донора одним запросом.
+
+        Строки: id, tool_name, inventory_number, to_object_name, requester_name, requester_username.
+        """
+        to_object = aliased(Object)
+        query = (
+            select(
+                ToolRequest.id, ToolName.name, Tool.inventory_number, to_object.name,
+                User.name, User.username
+            )
+            .join(Tool, Tool.id == ToolRequest.tool_id)
+            .join(ToolName, ToolName.id == Tool.name_id)
+            .join(User, User.id == ToolRequest.requester_id)
+            .outerjoin(to_object, to_object.id == ToolRequest.to_object_id)
+            .where(
+                ToolRequest.from_object_id == from_object_id,
+                ToolRequest.status_id != LookupService.request_status_id(REQUEST_DONE),
+                # Заявки на уже переданные инструменты не показываем, их закроет resolve_requests
+                Tool.current_object_id == from_object_id
+            )
+        )
+        return await fetch_page(db, query, ToolRequest.id, limit, after=after, before=before)
 
     @staticmethod
-    def delete_request(request_id: int) -> bool:
-        db = SessionLocal()
-        try:
-            request = db.query(ToolRequest).filter(ToolRequest.id == request_id).first()
-            if not request:
-                return False
-            db.delete(request)
-            db.commit()
-            return True
-        finally:
-            db.close() 
\ No newline at end of file
+    async def resolve_requests(
+        db: AsyncSession,
+        from_object_id: int,
+        approver_id: int,
+        approve: bool,
+        request_ids: Optional[Iterable[int]] = None
+    ) -> List[ResolvedRequest]:
+        """Одобряет или отклоняет невыполненные заявки объекта-донора пачкой.
+
+        request_ids=None — все заявки объекта. Заявки и их инструменты блокируются
+        FOR UPDATE SKIP LOCKED: то, что сейчас обрабатывает другой бригадир, пропускается
+        и не вернется в результате. Обрабатываются только заявки на инструменты, которые
+        еще на объекте-доноре; заявки на уже переданные инструменты закрываются без
+        уведомления. При одобрении инструменты переносятся одним UPDATE; если на один
+        инструмент выбрано несколько заявок, одобряется самая ранняя, остальные остаются
+        ждать. Возвращает обработанные заявки; commit делает вызывающий.
+        """
+        done_id = LookupService.request_status_id(REQUEST_DONE)
+        now = datetime.utcnow()
+        # Инструмент уже ушел с объекта — одобрять такие заявки нельзя, закрываем их
+        await db.execute(
+            update(ToolRequest)
+            .where(
+                ToolRequest.from_object_id == from_object_id,
+                ToolRequest.status_id != done_id,
+                ~select(Tool.id).where(
+                    Tool.id == ToolRequest.tool_id, Tool.current_object_id == from_object_id
+                ).exists()
+            )
+            .values(status_id=done_id, resolved_at=now),
+            execution_options={"synchronize_session": False}
+        )
+        query = (
+            select(ToolRequest.id, ToolRequest.tool_id)
+            .join(Tool, Tool.id == ToolRequest.tool_id)
+            .where(
+                ToolRequest.from_object_id == from_object_id,
+                ToolRequest.status_id != done_id,
+                Tool.current_object_id == from_object_id
+            )
+            .order_by(ToolRequest.id)
+            .with_for_update(of=(ToolRequest, Tool), skip_locked=True)
+        )
+        if request_ids is not None:
+            query = query.where(ToolRequest.id.in_(list(request_ids)))
+        ids = []
+        tool_ids = set()
+        for request_id, tool_id in (await db.execute(query)).all():
+            if approve and tool_id in tool_ids:
+                continue
+            ids.append(request_id)
+            tool_ids.add(tool_id)
+        if not ids:
+            return []
+
+        to_object = aliased(Object)
+        rows = (await db.execute(
+            select(ToolRequest.id, ToolName.name, Tool.inventory_number, to_object.name, User.chat_id, User.username)
+            .join(Tool, Tool.id == ToolRequest.tool_id)
+            .join(ToolName, ToolName.id == Tool.name_id)
+            .join(User, User.id == ToolRequest.requester_id)
+            .outerjoin(to_object, to_object.id == ToolRequest.to_object_id)
+            .where(ToolRequest.id.in_(ids))
+            .order_by(ToolRequest.id)
+        )).all()
+
+        await db.execute(
+            update(ToolRequest)
+            .where(ToolRequest.id.in_(ids))
+            .values(status_id=done_id, approver_id=approver_id, resolved_at=now),
+            execution_options={"synchronize_session": False}
+        )
+        if approve:
+            # Каждый инструмент переезжает на объект своей (единственной в пачке) заявки
+            await db.execute(
+                update(Tool)
+                .where(Tool.id.in_(tool_ids), Tool.current_object_id == from_object_id)
+                .values(current_object_id=select(ToolRequest.to_object_id).where(
+                    ToolRequest.tool_id == Tool.id, ToolRequest.id.in_(ids)
+                ).scalar_subquery()),
+                execution_options={"synchronize_session": False}
+            )
+        return [ResolvedRequest(*row) for row in rows]
@@ -0,0 +1,67 @@
+from typing import Optional
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import PAGE_SIZE
+from database.models import Tool, ToolName
+from services.lookup_service import LookupService, STATUS_AVAILABLE
+from services.pagination import Page, fetch_page
+
+
+class ToolService:
+    @staticmethod
+    async def get_object_tools_page(
+        db: AsyncSession,
+        object_id: int,
+        after: Optional[int] = None,
+        before: Optional[int] = None,
+        limit: int = PAGE_SIZE
+    ) -> Page:
+        """Страница инструментов объекта по индексу (current_object_id, id).
+
+        Строки: id, name, inventory_number, status_id; название статуса берется
+        из LookupService без join.
+        """
+        query = (
+            select(Tool.id, ToolName.name, Tool.inventory_number, Tool.status_id)
+            .join(ToolName, ToolName.id == Tool.name_id)
+            .where(Tool.current_object_id == object_id)
+        )
+        return await fetch_page(db, query, Tool.id, limit, after=after, before=before)
+
+    @staticmethod
+    async def get_available_names_page(
+        db: AsyncSession,
+        object_id: int,
+        after: Optional[int] = None,
+        before: Optional[int] = None,
+        limit: int = PAGE_SIZE
+    ) -> Page:
+        """Страница названий доступных инструментов объекта с количеством: name_id, name, count"""
+        query = (
+            select(Tool.name_id, ToolName.name, func.count(Tool.id))
+            .join(ToolName, ToolName.id == Tool.name_id)
+            .where(Tool.current_object_id == object_id, Tool.status_id == LookupService.status_id(STATUS_AVAILABLE))
+            .group_by(Tool.name_id, ToolName.name)
+        )
+        return await fetch_page(db, query, Tool.name_id, limit, after=after, before=before)
+
+    @staticmethod
+    async def get_available_tools_page(
+        db: AsyncSession,
+        object_id: int,
+        name_id: int,
+        after: Optional[int] = None,
+        before: Optional[int] = None,
+        limit: int = PAGE_SIZE
+    ) -> Page:
+        """Страница доступных инструментов объекта с одним названием: id, name, inventory_number"""
+        query = (
+            select(Tool.id, ToolName.name, Tool.inventory_number)
+            .join(ToolName, ToolName.id == Tool.name_id)
+            .where(
+                Tool.current_object_id == object_id,
+                Tool.status_id == LookupService.status_id(STATUS_AVAILABLE),
+                Tool.name_id == name_id
+            )
+        )
+        return await fetch_page(db, query, Tool.id, limit, after=after, before=before)
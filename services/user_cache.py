@@ -0,0 +1,168 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, Optional, Set, Tuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from config import USER_CACHE_TTL, USER_CACHE_MAX_SIZE
+from database.models import User
+
+
+@dataclass(frozen=True)
+class ObjectSnapshot:
+    id: int
+    name: str
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """Неизменяемая копия пользователя с объектом: живет дольше сессии БД"""
+    id: int
+    username: str
+    name: Optional[str]
+    chat_id: Optional[int]
+    role_id: int
+    object_id: Optional[int]
+    object: Optional[ObjectSnapshot]
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        """user должен быть загружен вместе с object (joinedload)"""
+        return cls(
+            id=user.id,
+            username=user.username,
+            name=user.name,
+            chat_id=user.chat_id,
+            role_id=user.role_id,
+            object_id=user.object_id,
+            object=ObjectSnapshot(user.object.id, user.object.name) if user.object else None,
+        )
+
+
+@dataclass
+class UserCacheStats:
+    """Счётчики кэша пользователей"""
+    hits: int = 0
+    misses: int = 0
+    invalidations: int = 0
+
+    def __str__(self) -> str:
+        return f"попаданий: {self.hits}, промахов: {self.misses}, сбросов: {self.invalidations}"
+
+
+class UserCache:
+    """LRU-кэш пользователей с TTL по username и Telegram id"""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.stats = UserCacheStats()
+        # ключ -> (время записи, снимок); ключи ("username", "@name") и ("telegram_id", 123)
+        self._entries: "OrderedDict[Hashable, Tuple[float, UserSnapshot]]" = OrderedDict()
+        # id пользователя -> его ключи, чтобы сбросить запись по любому из них
+        self._keys_by_user: Dict[int, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, username: Optional[str], telegram_id: Optional[int] = None) -> Optional[UserSnapshot]:
+        keys = [("username", username)]
+        if telegram_id is not None:
+            keys.insert(0, ("telegram_id", telegram_id))
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                stored_at, user = entry
+                if time.monotonic() - stored_at > self.ttl:
+                    self._drop_user(user.id)
+                    continue
+                # Пользователь сменил username в Telegram — запись по id больше не годится
+                if user.username != username:
+                    self._drop_user(user.id)
+                    continue
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                return user
+            self.stats.misses += 1
+            return None
+
+    def put(self, user: UserSnapshot, telegram_id: Optional[int] = None):
+        with self._lock:
+            self._drop_user(user.id)
+            keys = {("username", user.username)}
+            if telegram_id is not None:
+                keys.add(("telegram_id", telegram_id))
+            stored_at = time.monotonic()
+            for key in keys:
+                self._entries[key] = (stored_at, user)
+            self._keys_by_user[user.id] = keys
+            while len(self._entries) > self.max_size:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._drop_user(evicted.id)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            if self._drop_user(user_id):
+                self.stats.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def _drop_user(self, user_id: int) -> bool:
+        keys = self._keys_by_user.pop(user_id, None)
+        for key in keys or ():
+            self._entries.pop(key, None)
+        return bool(keys)
+
+
+_user_cache: Optional[UserCache] = None
+
+
+def get_user_cache() -> UserCache:
+    """Возвращает общий кэш пользователей"""
+    global _user_cache
+    if _user_cache is None:
+        _user_cache = UserCache(ttl=USER_CACHE_TTL, max_size=USER_CACHE_MAX_SIZE)
+    return _user_cache
+
+
+# Рассылка сбросов кэшей другим процессам бота (webhook с несколькими процессами)
+_invalidation_publisher: Optional[Callable[[str, Optional[int]], None]] = None
+
+
+def set_invalidation_publisher(publisher: Optional[Callable[[str, Optional[int]], None]]):
+    """Задает функцию (вид, id), которой сбросы после commit передаются остальным процессам"""
+    global _invalidation_publisher
+    _invalidation_publisher = publisher
+
+
+def publish_invalidation(kind: str, key: Optional[int] = None):
+    """Сообщает другим процессам о сбросе: "user" с id пользователя или "objects" """
+    if _invalidation_publisher is not None:
+        _invalidation_publisher(kind, key)
+
+
+def invalidate_user(db, user_id: int):
+    """Сбрасывает пользователя сейчас и еще раз после commit сессии db.
+
+    Повторный сброс нужен, потому что до commit параллельный апдейт может прочитать
+    из БД старые данные и снова положить их в кэш.
+    """
+    get_user_cache().invalidate(user_id)
+    session = getattr(db, "sync_session", db)
+    session.info.setdefault("invalidate_user_ids", set()).add(user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    for user_id in session.info.pop("invalidate_user_ids", ()):
+        get_user_cache().invalidate(user_id)
+        publish_invalidation("user", user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop("invalidate_user_ids", None)
@@ -1,113 +1,136 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload
 from database.models import User, Role, Object
-from database.connection import SessionLocal
+from services.lookup_service import LookupService, ROLE_PENDING, ROLE_FOREMAN, ROLE_WORKER
+from services.object_service import ObjectService
+from services.user_cache import UserSnapshot, get_user_cache, invalidate_user
 from typing import Optional, List
+from config import PAGE_SIZE
+from services.pagination import Page, fetch_page
 
 class UserService:
     @staticmethod
-    def get_user_by_id(user_id: int) -> Optional[User]:
-        db = SessionLocal()
-        try:
-            return db.query(User).options(joinedload(User.role), joinedload(User.object)).filter(User.id == user_id).first()
-        finally:
-            db.close()
+    async def get_user_by_id(db: AsyncSession, user_id: int) -> Optional[User]:
+        result = await db.execute(
+            select(User).options(joinedload(User.role), joinedload(User.object)).filter(User.id == user_id)
+        )
+        return result.scalars().first()
 
     @staticmethod
-    def get_user_by_username(username: str) -> Optional[User]:
-        db = SessionLocal()
-        try:
-            return db.query(User).options(joinedload(User.role), joinedload(User.object)).filter(User.username == username).first()
-        finally:
-            db.close()
+    async def get_user_by_username(db: AsyncSession, username: str) -> Optional[User]:
+        result = await db.execute(
+            select(User).options(joinedload(User.role), joinedload(User.object)).filter(User.username == username)
+        )
+        return result.scalars().first()
 
     @staticmethod
-    def get_all_users() -> List[User]:
-        db = SessionLocal()
-        try:
-            return db.query(User).options(joinedload(User.role), joinedload(User.object)).all()
-        finally:
-            db.close()
+    async def get_user_snapshot(db: AsyncSession, username: Optional[str], telegram_id: Optional[int] = None) -> Optional[UserSnapshot]:
+        """Пользователь из кэша по Telegram id или username; при промахе — из БД с записью в кэш"""
+        if not username:
+            return None
+        cache = get_user_cache()
+        snapshot = cache.get(username, telegram_id)
+        if snapshot is None:
+            user = await UserService.get_user_by_username(db, username)
+            if not user:
+                return None
+            snapshot = UserSnapshot.from_user(user)
+            cache.put(snapshot, telegram_id)
+        return snapshot
 
     @staticmethod
-    def create_user(username: str, name: Optional[str] = None, role_name: str = "в обработке", object_id: Optional[int] = None, chat_id: Optional[int] = None) -> User:
-        db = SessionLocal()
-        try:
-            role = db.query(Role).filter(Role.name == role_name).first()
-            if not role:
-                raise ValueError(f"Role '{role_name}' not found")
-            user = User(username=username, name=name, role_id=role.id, object_id=object_id, chat_id=chat_id)
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-            return user
-        finally:
-            db.close()
+    async def get_all_users(db: AsyncSession) -> List[User]:
+        result = await db.execute(select(User).options(joinedload(User.role), joinedload(User.object)))
+        return list(result.scalars().all())
 
     @staticmethod
-    def update_user(user_id: int, **kwargs) -> Optional[User]:
-        db = SessionLocal()
-        try:
-            user = db.query(User).filter(User.id == user_id).first()
-            if not user:
-                return None
-            for key, value in kwargs.items():
-                if hasattr(user, key):
-                    setattr(user, key, value)
-            db.commit()
-            db.refresh(user)
-            return user
-        finally:
-            db.close()
+    async def create_user(db: AsyncSession, username: str, name: Optional[str] = None, role_name: str = ROLE_PENDING, object_id: Optional[int] = None, chat_id: Optional[int] = None) -> User:
+        user = User(username=username, name=name, role_id=LookupService.role_id(role_name), object_id=object_id, chat_id=chat_id)
+        db.add(user)
+        # id нужен сразу, commit сделает middleware в конце апдейта
+        await db.flush()
+        if role_name == ROLE_FOREMAN:
+            await ObjectService.sync_foremen(db, [object_id])
+        return user
 
     @staticmethod
-    def delete_user(user_id: int) -> bool:
-        db = SessionLocal()
-        try:
-            user = db.query(User).filter(User.id == user_id).first()
-            if not user:
-                return False
-            db.delete(user)
-            db.commit()
-            return True
-        finally:
-            db.close()
+    async def update_user(db: AsyncSession, user_id: int, **kwargs) -> Optional[User]:
+        user = await db.get(User, user_id)
+        if not user:
+            return None
+        before = (user.role_id, user.object_id, user.username)
+        for key, value in kwargs.items():
+            if hasattr(user, key):
+                setattr(user, key, value)
+        await db.flush()
+        invalidate_user(db, user_id)
+        await UserService._sync_foreman(db, user, *before)
+        return user
 
     @staticmethod
-    def approve_user(user_id: int, object_id: int) -> bool:
-        """Approve user registration and assign to object"""
-        db = SessionLocal()
-        try:
-            user = db.query(User).filter(User.id == user_id).first()
-            if user:
-                # Get worker role (role_id = 3)
-                worker_role = db.query(Role).filter(Role.id == 3).first()
-                if not worker_role:
-                    return False
-                
-                user.role_id = worker_role.id
-                user.object_id = object_id
-                db.commit()
-                return True
+    async def delete_user(db: AsyncSession, user_id: int) -> bool:
+        user = await db.get(User, user_id)
+        if not user:
             return False
-        finally:
-            db.close()
+        if user.role_id == LookupService.role_id(ROLE_FOREMAN):
+            # Сначала снимаем бригадира с объекта, чтобы object.foreman_id на него не ссылался
+            object_id, user.object_id = user.object_id, None
+            await db.flush()
+            await ObjectService.sync_foremen(db, [object_id])
+        await db.delete(user)
+        await db.flush()
+        invalidate_user(db, user_id)
+        return True
 
     @staticmethod
-    def reject_user(user_id: int) -> bool:
+    async def approve_user(db: AsyncSession, user_id: int, object_id: int) -> bool:
+        """Approve user registration and assign to object"""
+        user = await db.get(User, user_id)
+        if user:
+            before = (user.role_id, user.object_id, user.username)
+            user.role_id = LookupService.role_id(ROLE_WORKER)
+            user.object_id = object_id
+            await db.flush()
+            invalidate_user(db, user_id)
+            await UserService._sync_foreman(db, user, *before)
+            return True
+        return False
+
+    @staticmethod
+    async def reject_user(db: AsyncSession, user_id: int) -> bool:
         """Reject user registration"""
-        db = SessionLocal()
-        try:
-            user = db.query(User).filter(User.id == user_id).first()
-            if user:
-                # Set role to "в обработке" (role_id = 1) and null object
-                pending_role = db.query(Role).filter(Role.id == 1).first()
-                if not pending_role:
-                    return False
-                
-                user.role_id = pending_role.id
-                user.object_id = None
-                db.commit()
-                return True
-            return False
-        finally:
-            db.close() 
\ No newline at end of file
+        user = await db.get(User, user_id)
+        if user:
+            before = (user.role_id, user.object_id, user.username)
+            # Возвращаем роль "в обработке" и снимаем с объекта
+            user.role_id = LookupService.role_id(ROLE_PENDING)
+            user.object_id = None
+            await db.flush()
+            invalidate_user(db, user_id)
+            await UserService._sync_foreman(db, user, *before)
+            return True
+        return False
+
+    @staticmethod
+    async def get_registrations_page(
+        db: AsyncSession,
+        object_id: int,
+        after: Optional[int] = None,
+        before: Optional[int] = None,
+        limit: int = PAGE_SIZE
+    ) -> Page:
+        """Страница заявок на регистрацию на объект (роль "в обработке"): id, username, name"""
+        query = select(User.id, User.username, User.name).where(
+            User.object_id == object_id, User.role_id == LookupService.role_id(ROLE_PENDING)
+        )
+        return await fetch_page(db, query, User.id, limit, after=after, before=before)
+
+    @staticmethod
+    async def _sync_foreman(db: AsyncSession, user: User, old_role_id: int, old_object_id: Optional[int], old_username: str) -> None:
+        """Обновляет object.foreman_id, если изменение роли, объекта или username касается бригадира"""
+        foreman_role_id = LookupService.role_id(ROLE_FOREMAN)
+        if foreman_role_id not in (old_role_id, user.role_id):
+            return
+        if (old_role_id, old_object_id, old_username) != (user.role_id, user.object_id, user.username):
+            await ObjectService.sync_foremen(db, [old_object_id, user.object_id])